@@ -0,0 +1,294 @@
+"""asyncio client for the Calendar API calls the scripts make, as an alternative to googleapiclient.
+
+Covers events list, get, update, patch and delete, and batches of writes, on one aiohttp
+session. The session's connector keeps connections to the API host alive and open at most
+`concurrency` of them, and the same number of requests are in flight at once, so page
+fetches and write batches overlap on a single thread instead of waiting on each other.
+Errors come back as googleapiclient HttpErrors and are retried by the same RetryPolicy as
+the blocking client, and writes in a batch are settled part by part exactly like BatchWriter
+does.
+
+aiohttp is optional: pip install aiohttp. Only --async needs it.
+"""
+from __future__ import print_function
+import asyncio
+import json
+import logging
+import re
+import time
+import uuid
+from urllib.parse import quote, urlencode
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from batching import BatchResult, DEFAULT_BATCH_SIZE, WRITE_RESPONSE_FIELDS, settle_write, settle_lost_batch
+from dispatcher import DEFAULT_WORKERS
+from metrics import call_kind
+from retry_policy import RetryPolicy, retry_after_seconds, is_precondition_failed
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+API_ROOT = 'https://www.googleapis.com/'
+SERVICE_PATH = 'calendar/v3/'
+BATCH_PATH = 'batch/calendar/v3'
+HTTP_TIMEOUT = 60
+DEFAULT_CONCURRENCY = DEFAULT_WORKERS
+WRITE_METHODS = {'update': 'PUT', 'patch': 'PATCH', 'delete': 'DELETE'}
+
+
+def _query_value(value):
+    # The API spells booleans in lower case
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _query(params):
+    return dict((key, _query_value(value)) for key, value in params.items() if value is not None)
+
+
+def _error(status, headers, content, uri):
+    """An HttpError like googleapiclient raises, so the retry policy and callers can't tell the clients apart."""
+    response = httplib2.Response(dict(headers, status=str(status)))
+    return HttpError(response, content, uri=uri)
+
+
+def _json(content):
+    return json.loads(content.decode('utf-8')) if content else None
+
+
+def event_path(calendar_id, event_id=None):
+    path = SERVICE_PATH + 'calendars/' + quote(calendar_id, safe='') + '/events'
+    if event_id is not None:
+        path += '/' + quote(event_id, safe='')
+    return path
+
+
+class AsyncCalendarClient(object):
+    """One aiohttp session, with pooled connections and bounded concurrency, for the Calendar API.
+
+    Use it as an async context manager. Every request pays `limiter` (a TokenBucket) first when
+    one is given, a batch paying one token per part like the dispatcher does. With a RunMetrics,
+    every HTTP request is recorded under the same call types as the blocking client's.
+    """
+
+    def __init__(self, credentials=None, concurrency=DEFAULT_CONCURRENCY, policy=None, limiter=None, metrics=None,
+                 root_url=API_ROOT, timeout=HTTP_TIMEOUT):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.credentials = credentials
+        self.concurrency = concurrency
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.limiter = limiter
+        self.metrics = metrics
+        self.root_url = root_url
+        self.timeout = timeout
+        self.session = None
+        self.slots = None
+        self.refresh_lock = None
+
+    async def open(self):
+        if aiohttp is None:
+            raise RuntimeError("The async client needs aiohttp: pip install aiohttp")
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.refresh_lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _headers(self):
+        headers = {}
+        if self.credentials is not None:
+            # Only one task refreshes an expired token; the rest wait for it and reuse the new one
+            async with self.refresh_lock:
+                if not self.credentials.valid:
+                    from google.auth.transport.requests import Request
+                    await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+            self.credentials.apply(headers)
+        return headers
+
+    async def _send(self, method, path, params=None, body=None, content_type='application/json', tokens=1,
+                    extra_headers=None):
+        """Sends one HTTP request and returns (headers, content), raising an HttpError for anything but a 2xx.
+
+        A 304 Not Modified is raised too, the same as googleapiclient does.
+        """
+        url = self.root_url + path
+        if params:
+            url += '?' + urlencode(_query(params))
+        headers = await self._headers()
+        headers.update(extra_headers or {})
+        if body is not None:
+            headers['content-type'] = content_type
+        if self.limiter is not None:
+            await self.limiter.acquire_async(tokens)
+        async with self.slots:
+            started = time.perf_counter()
+            status = 0
+            content = b''
+            try:
+                async with self.session.request(method, url, data=body, headers=headers) as response:
+                    content = await response.read()
+                    status = response.status
+                    response_headers = dict(response.headers)
+            except aiohttp.ClientConnectionError as e:
+                # Dropped connections are retryable, like they are for httplib2
+                raise ConnectionError(str(e)) from e
+            finally:
+                if self.metrics is not None:
+                    self.metrics.record_call(call_kind(method, url), time.perf_counter() - started, len(body or b''),
+                                             len(content), status)
+        if status >= 300:
+            raise _error(status, response_headers, content, url)
+        return response_headers, content
+
+    async def _call(self, method, path, params=None, body=None, description='request', kind='request', headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        _, content = await self.policy.call_async(
+            lambda: self._send(method, path, params, data, extra_headers=headers), description, kind)
+        return _json(content)
+
+    async def list_events(self, calendar_id, etag=None, **params):
+        """One page of events.list, with the same parameters googleapiclient takes.
+
+        With an etag the page is only sent if the listing changed since; otherwise a 304 HttpError is raised.
+        """
+        headers = {'If-None-Match': etag} if etag else None
+        return await self._call('GET', event_path(calendar_id), params, description="events list", kind='events.list',
+                                headers=headers)
+
+    async def iter_event_pages(self, calendar_id, etag=None, **params):
+        """Async generator following nextPageToken; yields each page's response as it arrives.
+
+        An etag is sent with the first page only, as list_events does.
+        """
+        page_token = None
+        while True:
+            page = await self.list_events(calendar_id, etag=etag if page_token is None else None, pageToken=page_token,
+                                          **params)
+            yield page
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+
+    async def get_event(self, calendar_id, event_id, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else None
+        return await self._call('GET', event_path(calendar_id, event_id), params, description="get of " + event_id,
+                                kind='events.get', headers=headers)
+
+    async def update_event(self, calendar_id, event_id, body, **params):
+        return await self._call('PUT', event_path(calendar_id, event_id), params, body,
+                                "update of " + str(body.get('summary', event_id)), 'events.update')
+
+    async def patch_event(self, calendar_id, event_id, body, **params):
+        return await self._call('PATCH', event_path(calendar_id, event_id), params, body,
+                                "patch of " + str(body.get('summary', event_id)), 'events.patch')
+
+    async def delete_event(self, calendar_id, event_id):
+        return await self._call('DELETE', event_path(calendar_id, event_id), description="delete of " + event_id,
+                                kind='events.delete')
+
+    async def send_batch(self, calendar_id, writes):
+        """Sends PendingWrites as one batch request and sorts them into (BatchResult, writes to retry)."""
+        boundary = '===============' + uuid.uuid4().hex + '=='
+        parts = []
+        for index, write in enumerate(writes):
+            request_line = WRITE_METHODS[write.kind] + ' /' + event_path(calendar_id, write.event_id)
+            part = ('--' + boundary + '\r\nContent-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n'
+                    'Content-ID: <' + str(index) + '>\r\n\r\n')
+            condition = 'If-Match: ' + write.etag + '\r\n' if write.etag else ''
+            if write.kind == 'delete':
+                part += request_line + ' HTTP/1.1\r\n' + condition + '\r\n'
+            else:
+                data = json.dumps(write.body)
+                part += (request_line + '?fields=' + WRITE_RESPONSE_FIELDS + ' HTTP/1.1\r\n' + condition +
+                         'Content-Type: application/json\r\ncontent-length: ' + str(len(data.encode('utf-8'))) +
+                         '\r\n\r\n' + data)
+            parts.append(part + '\r\n')
+        body = (''.join(parts) + '--' + boundary + '--\r\n').encode('utf-8')
+        self.policy.record(calls=len(writes))
+        headers, content = await self._send('POST', BATCH_PATH, body=body,
+                                            content_type='multipart/mixed; boundary="' + boundary + '"',
+                                            tokens=len(writes))
+        result = BatchResult()
+        retry = []
+        responses = self._parse_batch(headers, content)
+        for index, write in enumerate(writes):
+            status, part_headers, part_content = responses.get(str(index), (500, {}, b''))
+            error = _error(status, part_headers, part_content, self.root_url + BATCH_PATH) if status >= 400 else None
+            settle_write(write, error, self.policy, result, retry)
+        return result, retry
+
+    @staticmethod
+    def _parse_batch(headers, content):
+        # Returns {content id: (status, headers, content)} for every part of a multipart/mixed batch response
+        content_type = dict((key.lower(), value) for key, value in headers.items()).get('content-type', '')
+        boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode('utf-8')
+        responses = {}
+        for part in content.split(b'--' + boundary)[1:]:
+            if part.startswith(b'--'):
+                break
+            part = part.replace(b'\r\n', b'\n').lstrip(b'\n')
+            part_headers, _, http_response = part.partition(b'\n\n')
+            content_id = re.search(rb'Content-ID: <response-([^>]*)>', part_headers, re.I).group(1).decode('utf-8')
+            response_head, _, response_body = http_response.partition(b'\n\n')
+            lines = response_head.decode('utf-8').split('\n')
+            status = int(lines[0].split(' ', 2)[1])
+            response_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            responses[content_id] = (status, response_headers, response_body.strip())
+        return responses
+
+    async def write_batch(self, calendar_id, writes):
+        """Sends writes (at most a batch's worth) until each one succeeds or gives up; returns the BatchResult.
+
+        Parts that failed with a retryable error are sent again after backing off, for at least as
+        long as the most demanding Retry-After among them, while other batches keep going.
+        """
+        result = BatchResult()
+        round_number = 0
+        while writes:
+            try:
+                batch_result, retry = await self.send_batch(calendar_id, writes)
+            except Exception as e:
+                batch_result, retry = BatchResult(), []
+                settle_lost_batch(writes, e, self.policy, batch_result, retry)
+            result.merge(batch_result)
+            for write in batch_result.failed:
+                # A write made conditional on an etag that is out of date is up to the caller to redo
+                level = logging.INFO if is_precondition_failed(write.error) else logging.WARNING
+                log.log(level, "Failed to %s event: %s (%s)", write.kind, write.summary, write.error)
+            if retry:
+                error = max((write.error for write in retry), key=lambda error: retry_after_seconds(error) or 0)
+                sleep_time = await self.policy.wait_async(round_number, error, 'batch')
+                log.warning("Retrying %d writes in %.2f seconds (%s)", len(retry), sleep_time, error)
+                round_number += 1
+            writes = retry
+        return result
+
+    async def write(self, calendar_id, writes, batch_size=DEFAULT_BATCH_SIZE):
+        """Sends any number of PendingWrites as concurrent batches and returns the combined BatchResult."""
+        writes = list(writes)
+        log.info("Sending %d writes in batches of %d", len(writes), batch_size)
+        results = await asyncio.gather(*[self.write_batch(calendar_id, writes[start:start + batch_size])
+                                         for start in range(0, len(writes), batch_size)])
+        result = BatchResult()
+        for batch_result in results:
+            result.merge(batch_result)
+        return result
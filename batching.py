@@ -0,0 +1,198 @@
+from __future__ import print_function
+from collections import deque
+import logging
+
+from event_model import EventRecord
+from retry_policy import RetryPolicy, retry_after_seconds, is_precondition_failed
+
+log = logging.getLogger(__name__)
+
+# Google recommends no more than 50 calls in a single Calendar batch request
+# Ref: https://developers.google.com/calendar/api/guides/batch
+DEFAULT_BATCH_SIZE = 50
+# Nothing in a write's response is used, so ask for as little of it as possible
+WRITE_RESPONSE_FIELDS = 'id'
+
+
+class PendingWrite(object):
+    """A single update, patch or delete waiting to be sent as one part of a batch request.
+
+    With an etag the write is sent with If-Match, so it fails with 412 instead of overwriting an
+    event that changed after it was fetched.
+    """
+
+    def __init__(self, kind, event_id, body=None, summary=None, etag=None):
+        self.kind = kind
+        self.event_id = event_id
+        self.body = body
+        self.summary = summary
+        self.etag = etag
+        self.attempts = 0
+        self.error = None
+
+
+class BatchResult(object):
+    """Outcome of a flush: the writes that went through and the ones that gave up."""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+    def merge(self, other):
+        self.succeeded.extend(other.succeeded)
+        self.failed.extend(other.failed)
+
+
+def settle_write(write, error, policy, result, retry):
+    """Files one part of a batch under succeeded, failed or retry once its response is in."""
+    write.attempts += 1
+    write.error = error
+    if error is None:
+        result.succeeded.append(write)
+    elif policy.is_retryable(error) and write.attempts < policy.max_attempts:
+        retry.append(write)
+    else:
+        if policy.is_retryable(error):
+            policy.record(give_ups=1)
+        result.failed.append(write)
+
+
+def settle_lost_batch(writes, error, policy, result, retry):
+    # The whole batch request died (connection reset, worker crash...), so every part gets another go
+    retryable = policy.is_retryable(error)
+    for write in writes:
+        write.attempts += 1
+        write.error = error
+        if retryable and write.attempts < policy.max_attempts:
+            retry.append(write)
+        else:
+            if retryable:
+                policy.record(give_ups=1)
+            result.failed.append(write)
+
+
+class BatchWriter(object):
+    """Groups event updates, patches and deletes into batch HTTP requests.
+
+    Each part of a batch succeeds or fails on its own, so after every round only the
+    parts that failed with a retryable error are put back in the queue for the next one.
+    Which errors are retryable, how many attempts a write gets and how long to back off
+    between rounds all come from the retry policy.
+    """
+
+    def __init__(self, service, calendar_id, batch_size=DEFAULT_BATCH_SIZE, policy=None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.service = service
+        self.calendar_id = calendar_id
+        self.batch_size = batch_size
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.pending = deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def update(self, event):
+        self.pending.append(PendingWrite('update', event['id'], body=event, summary=event.get('summary')))
+
+    def patch(self, event, fields):
+        """Queues a patch that only carries the given top-level fields of the event (an API dict or an EventRecord).
+
+        A patch of an EventRecord is conditional on the etag it was fetched with.
+        """
+        if isinstance(event, EventRecord):
+            self.add_patch(event.id, event.to_patch(fields), event.summary, event.etag)
+            return
+        self.add_patch(event['id'], dict((field, event.get(field)) for field in fields), event.get('summary'))
+
+    def add_patch(self, event_id, body, summary=None, etag=None):
+        """Queues a patch with a body that is already built, e.g. one read back from a change plan."""
+        self.pending.append(PendingWrite('patch', event_id, body=body, summary=summary, etag=etag))
+
+    def delete(self, event):
+        self.pending.append(PendingWrite('delete', event['id'], summary=event.get('summary')))
+
+    def add(self, write):
+        """Queues a PendingWrite that was built elsewhere."""
+        self.pending.append(write)
+
+    def _build_request(self, write):
+        if write.kind == 'update':
+            request = self.service.events().update(calendarId=self.calendar_id, eventId=write.event_id, body=write.body,
+                                                   fields=WRITE_RESPONSE_FIELDS)
+        elif write.kind == 'patch':
+            request = self.service.events().patch(calendarId=self.calendar_id, eventId=write.event_id, body=write.body,
+                                                  fields=WRITE_RESPONSE_FIELDS)
+        else:
+            request = self.service.events().delete(calendarId=self.calendar_id, eventId=write.event_id)
+        if write.etag:
+            request.headers['If-Match'] = write.etag
+        return request
+
+    def _take_batch(self):
+        batch = []
+        while self.pending and len(batch) < self.batch_size:
+            batch.append(self.pending.popleft())
+        return batch
+
+    def send_batch(self, writes, http=None):
+        """Sends one batch request and sorts its parts into succeeded, failed and retry."""
+        result = BatchResult()
+        retry = []
+
+        def callback(request_id, response, exception):
+            settle_write(writes[int(request_id)], exception, self.policy, result, retry)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index, write in enumerate(writes):
+            batch.add(self._build_request(write), request_id=str(index))
+        self.policy.record(calls=len(writes))
+        batch.execute(http=http)
+        return result, retry
+
+    def flush(self, dispatcher=None):
+        """Sends everything that is queued and returns the combined BatchResult.
+
+        With a dispatcher, all the batches of a round are sent concurrently on its worker pool.
+        """
+        result = BatchResult()
+        round_number = 0
+        while self.pending:
+            if dispatcher is None:
+                writes = self._take_batch()
+                log.info("Sending batch of %d writes (%d queued)", len(writes), len(self.pending))
+                batch_result, retry = self.send_batch(writes)
+            else:
+                batch_result, retry = self._dispatch_round(dispatcher)
+            result.merge(batch_result)
+            for write in batch_result.failed:
+                # A write made conditional on an etag that is out of date is up to the caller to redo
+                level = logging.INFO if is_precondition_failed(write.error) else logging.WARNING
+                log.log(level, "Failed to %s event: %s (%s)", write.kind, write.summary, write.error)
+            if retry:
+                # Put the failed parts back at the front and back off before the next round,
+                # for at least as long as the most demanding Retry-After among them
+                self.pending.extendleft(reversed(retry))
+                error = max((write.error for write in retry), key=lambda error: retry_after_seconds(error) or 0)
+                sleep_time = self.policy.wait(round_number, error, 'batch')
+                log.warning("Retrying %d writes in %.2f seconds (%s)", len(retry), sleep_time, error)
+                round_number += 1
+            else:
+                round_number = 0
+        return result
+
+    def _dispatch_round(self, dispatcher):
+        batches = []
+        while self.pending:
+            batches.append(self._take_batch())
+        log.info("Sending %d batches on %d workers", len(batches), dispatcher.workers)
+        result = BatchResult()
+        retry = []
+        for writes, outcome, error in dispatcher.map(batches, self.send_batch):
+            if error is None:
+                batch_result, batch_retry = outcome
+                result.merge(batch_result)
+                retry.extend(batch_retry)
+                continue
+            settle_lost_batch(writes, error, self.policy, result, retry)
+        return result, retry
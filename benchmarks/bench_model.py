@@ -0,0 +1,91 @@
+"""Compares API event dicts with EventRecords: memory per event and speed of equality checks.
+
+The dicts are the masked EVENT_FIELDS resources that execute_updates receives. Equality is
+timed with the str()/json.dumps comparison events_are_equal used to do and with plain ==
+on records.
+
+Usage: python benchmarks/bench_model.py [--events 100000]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from event_model import EventRecord
+from synthetic import synthetic_events
+import update_calendar_events as uce
+
+
+def legacy_reminders_are_equal(event1, event2):
+    if event1.get('reminders') == event2.get('reminders'):
+        return True
+    if event1.get('reminders').get('useDefault') != event2.get('reminders').get('useDefault'):
+        return False
+    if event1.get('reminders').get('useDefault') is True:
+        return True
+    overrides_set_1 = set(json.dumps(override, sort_keys=True) for override in event1.get('reminders').get('overrides'))
+    overrides_set_2 = set(json.dumps(override, sort_keys=True) for override in event2.get('reminders').get('overrides'))
+    return overrides_set_1 == overrides_set_2
+
+
+def legacy_events_are_equal(event1, event2):
+    # events_are_equal as it was before the event model
+    return (str(event1.get('id')) == str(event2.get('id')) and
+            str(event1.get('summary')) == str(event2.get('summary')) and
+            str(event1.get('start').get('dateTime')) == str(event2.get('start').get('dateTime')) and
+            str(event1.get('end').get('dateTime')) == str(event2.get('end').get('dateTime')) and
+            event1.get('location') == event2.get('location') and
+            str(event1.get('description')) == str(event2.get('description')) and
+            legacy_reminders_are_equal(event1, event2) and
+            str(event1.get('colorId')) == str(event2.get('colorId')))
+
+
+def masked(event):
+    return json.loads(json.dumps(dict((field, event[field]) for field in uce.EVENT_FIELDS.split(',') if field in event)))
+
+
+def traced_size(build):
+    tracemalloc.start()
+    value = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, current
+
+
+def equality_rate(compare, pairs):
+    started = time.perf_counter()
+    for first, second in pairs:
+        compare(first, second)
+    return len(pairs) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    args = parser.parse_args()
+
+    # Serialized first so the dicts and records are built from the same bytes as an API response
+    payload = json.dumps([masked(event) for event in synthetic_events(args.events)])
+    dicts, dict_bytes = traced_size(lambda: json.loads(payload))
+    records, record_bytes = traced_size(lambda: [EventRecord.from_api(event) for event in json.loads(payload)])
+
+    print("%-8s %14s %14s" % ('model', 'total MiB', 'bytes/event'))
+    print("%-8s %14.1f %14.0f" % ('dict', dict_bytes / 2.0**20, float(dict_bytes) / args.events))
+    print("%-8s %14.1f %14.0f" % ('record', record_bytes / 2.0**20, float(record_bytes) / args.events))
+
+    # Each side is compared with an equal copy, the case where every field has to be looked at
+    dict_pairs = list(zip(dicts, json.loads(payload)))
+    record_pairs = [(record, record.copy()) for record in records]
+    print("%-8s %14s" % ('model', 'compares/s'))
+    print("%-8s %14.0f" % ('dict', equality_rate(legacy_events_are_equal, dict_pairs)))
+    print("%-8s %14.0f" % ('record', equality_rate(lambda first, second: first == second, record_pairs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Estimates bytes on the wire for a run over a synthetic schedule, with and without the field masks.
+
+List bytes compare full event resources with the EVENT_FIELDS partial response. Write bytes
+compare a full events().update body with an events().patch body carrying only the fields the
+rules changed. JSON sizes only; HTTP headers and gzip are left out of both sides.
+
+Usage: python benchmarks/bench_payload.py [--events 2000]
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from event_model import EventRecord
+from synthetic import synthetic_events
+import update_calendar_events as uce
+
+
+def json_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+def masked(event):
+    fields = uce.EVENT_FIELDS.split(',')
+    return dict((field, event[field]) for field in fields if field in event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    uce.initialize_colors()
+    uce.load_rule_set(os.path.join(ROOT, 'rules.json'))
+    events = synthetic_events(args.events)
+
+    list_full = sum(json_size(event) for event in events)
+    list_masked = sum(json_size(masked(event)) for event in events)
+
+    update_bytes = 0
+    patch_bytes = 0
+    writes = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            record = EventRecord.from_api(event)
+            original = record.copy()
+            uce.apply_rules(record)
+            changed_fields = record.changed_fields(original)
+            if changed_fields:
+                writes += 1
+                # A full update sends the whole event back with the new values
+                update_bytes += json_size(dict(event, **record.to_patch(changed_fields)))
+                patch_bytes += json_size(record.to_patch(changed_fields))
+
+    print("%d events, %d writes" % (len(events), writes))
+    print("%-8s %14s %14s %8s" % ('', 'before bytes', 'after bytes', 'saved'))
+    print("%-8s %14d %14d %7.0f%%" % ('list', list_full, list_masked, 100.0 * (1 - float(list_masked) / list_full)))
+    if writes:
+        print("%-8s %14d %14d %7.0f%%" % ('writes', update_bytes, patch_bytes, 100.0 * (1 - float(patch_bytes) / update_bytes)))
+
+
+if __name__ == '__main__':
+    main()
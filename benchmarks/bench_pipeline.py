@@ -0,0 +1,193 @@
+"""Runs the real scripts end to end against the in-process fake Calendar API and reports cost per run.
+
+Every (scenario, size) pair runs in a fresh child process so peak memory is its own. Scenarios:
+    updates        update_calendar_events.execute_updates (list, rules, batched patches, deletes)
+    deletions      update_calendar_events.delete_unwanted_events on its own (list, batched deletes)
+    notifications  change_notifications.update_notifications (list, batched reminder patches and deletes)
+    series         update_calendar_events.execute_updates with single_events=False (--series)
+With --async the updates, series and notifications scenarios run on the aiohttp client against
+the same fake served over local HTTP, with --workers requests in flight.
+With --shards N the updates scenario lists the calendar as N time windows at once.
+With --instances N the calendar holds size / N daily series of N occurrences instead of
+single events, so 'updates' against 'series' shows what evaluating series once saves.
+For each one, wall time, HTTP requests, API calls, bytes each way and peak RSS are printed. The
+RSS figure includes the fake server's copy of the calendar, so 'base' (after loading it) is
+printed next to the peak.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 1000,10000,100000] [--scenarios updates,deletions]
+                                           [--latency 0.05] [--server-rate 50] [--instances 10] [--shards 8] [--async] [--json]
+"""
+from __future__ import print_function
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('updates', 'deletions', 'notifications', 'series')
+DEFAULT_SIZES = '1000,10000,100000'
+# The client's own limiter is set high so the fake server's latency and rate limit decide the pace
+DEFAULT_CLIENT_RATE = 1000.0
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scenario(scenario, size, options):
+    """Runs in the child process and returns the measurements as a dict."""
+    from googleapiclient.discovery import build
+
+    from deletion import DeletePolicy, DeletionJournal
+    from dispatcher import Dispatcher, TokenBucket
+    from retry_policy import RetryPolicy
+    from async_client import AsyncCalendarClient
+    from fake_calendar import FakeCalendarBackend, FakeHttp, FakeServer
+    from synthetic import synthetic_events, synthetic_series
+    import change_notifications
+    import update_calendar_events as uce
+
+    calendar_id = uce.OLYMPIC_CALENDAR_ID
+    # change_notifications only looks at events that haven't ended yet; the rest list from EVENTS_START_DATE
+    if scenario == 'notifications':
+        start = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    else:
+        start = uce.EVENTS_START_DATE + datetime.timedelta(days=1)
+    # Far enough out for the longest synthetic event, so --shards windows cover the whole calendar
+    end_date = start + datetime.timedelta(minutes=20 * size, hours=4)
+    backend = FakeCalendarBackend(latency=options['latency'], requests_per_second=options['server_rate'])
+    if options['instances'] > 1:
+        events = synthetic_series(max(1, size // options['instances']), options['instances'], start=start)
+    else:
+        events = synthetic_events(size, start=start)
+    backend.add_calendar(calendar_id, uce.OLYMPIC_CALENDAR_NAME, events)
+    calendar = {'id': calendar_id, 'summary': uce.OLYMPIC_CALENDAR_NAME}
+    base_rss = peak_rss_mb()
+
+    policy = RetryPolicy(base_delay=0.05, max_delay=1)
+    uce.service = build('calendar', 'v3', http=FakeHttp(backend), static_discovery=True)
+    uce.dispatcher = Dispatcher(workers=options['workers'], limiter=TokenBucket(options['client_rate']),
+                                http_factory=lambda: FakeHttp(backend))
+    uce.retry_policy = policy
+    uce.delete_policy = DeletePolicy('auto', None)
+    journal_dir = tempfile.mkdtemp()
+    uce.deletion_journal = DeletionJournal(os.path.join(journal_dir, 'deletions.jsonl'))
+    uce.initialize_colors()
+    uce.load_rule_set(os.path.join(ROOT, 'rules.json'))
+    change_notifications.service = uce.service
+    change_notifications.retry_policy = policy
+    # Both scripts remove unwanted events without asking
+    change_notifications.delete_policy = uce.delete_policy
+    change_notifications.deletion_journal = uce.deletion_journal
+
+    async def run_async(server):
+        async with AsyncCalendarClient(concurrency=options['workers'], policy=policy,
+                                       limiter=TokenBucket(options['client_rate']), root_url=server.root_url) as client:
+            if scenario == 'notifications':
+                await change_notifications.update_notifications_async(calendar, client)
+            else:
+                await uce.execute_updates_async(calendar, client, single_events=scenario != 'series')
+
+    started = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if options['async']:
+            with FakeServer(backend) as server:
+                asyncio.run(run_async(server))
+        elif scenario == 'updates' and options['shards'] > 1:
+            uce.execute_updates(calendar, end_date=end_date, shards=options['shards'])
+        elif scenario == 'updates':
+            uce.execute_updates(calendar)
+        elif scenario == 'series':
+            uce.execute_updates(calendar, single_events=False)
+        elif scenario == 'deletions':
+            for _ in uce.delete_unwanted_events(uce.get_events_from_calendar(calendar), calendar_id):
+                pass
+        else:
+            change_notifications.update_notifications(calendar)
+    elapsed = time.time() - started
+
+    return {'scenario': scenario, 'events': size, 'seconds': elapsed, 'requests': backend.requests,
+            'batches': backend.batch_requests, 'calls': sum(backend.calls.values()),
+            'rate_limited': backend.rate_limited, 'retries': policy.retries,
+            'bytes_sent': backend.bytes_sent, 'bytes_received': backend.bytes_received,
+            'base_rss_mb': base_rss, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_child(scenario, size, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', scenario, str(size),
+               '--latency', str(args.latency), '--workers', str(args.workers), '--client-rate', str(args.client_rate),
+               '--instances', str(args.instances), '--shards', str(args.shards)]
+    if args.use_async:
+        command.append('--async')
+    if args.server_rate is not None:
+        command += ['--server-rate', str(args.server_rate)]
+    output = subprocess.check_output(command, cwd=ROOT)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated event counts (default: %(default)s)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="Comma-separated scenarios to run (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds the fake server takes per HTTP request (default: %(default)s)")
+    parser.add_argument('--server-rate', type=float,
+                        help="Calls per second the fake server allows before answering rateLimitExceeded")
+    parser.add_argument('--workers', type=int, default=4, help="Dispatcher workers (default: %(default)s)")
+    parser.add_argument('--client-rate', type=float, default=DEFAULT_CLIENT_RATE,
+                        help="Requests per second for the client's token bucket (default: %(default)s)")
+    parser.add_argument('--instances', type=int, default=1,
+                        help="Occurrences per recurring series; 1 means no series (default: %(default)s)")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Time windows the updates scenario lists at the same time (default: %(default)s)")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Run on the aiohttp client against the fake served over local HTTP")
+    parser.add_argument('--json', action='store_true', help="Print one JSON object per run instead of a table")
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'EVENTS'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {'latency': args.latency, 'server_rate': args.server_rate, 'workers': args.workers,
+               'client_rate': args.client_rate, 'instances': args.instances,
+               'async': args.use_async, 'shards': args.shards}
+    if args.child:
+        print(json.dumps(run_scenario(args.child[0], int(args.child[1]), options)))
+        return
+
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise SystemExit("Unknown scenario: " + scenario)
+        if args.use_async and scenario == 'deletions':
+            raise SystemExit("The deletions scenario has no async version")
+    if not args.json:
+        print("%-14s %7s %8s %8s %8s %7s %8s %11s %11s %8s %8s" % (
+            'scenario', 'events', 'seconds', 'requests', 'calls', 'limited', 'retries', 'sent', 'received',
+            'base MB', 'peak MB'))
+    for scenario in scenarios:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            result = run_child(scenario, size, args)
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print("%-14s %7d %8.2f %8d %8d %7d %8d %11d %11d %8.1f %8.1f" % (
+                scenario, size, result['seconds'], result['requests'], result['calls'], result['rate_limited'],
+                result['retries'], result['bytes_sent'], result['bytes_received'], result['base_rss_mb'],
+                result['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
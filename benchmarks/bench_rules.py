@@ -0,0 +1,103 @@
+"""Compares the hard-coded regex cascade execute_updates used to run with the compiled rule file.
+
+Checks that both produce the same colors and reminders for every synthetic event, then reports
+how many summaries per second each one classifies.
+
+Usage: python benchmarks/bench_rules.py [--events 100000] [--rules rules.json]
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from event_model import EventRecord
+from synthetic import synthetic_events
+import update_calendar_events as uce
+
+
+def legacy_apply_rules(event):
+    # The cascade as it was hard-coded in execute_updates. The Round Robin check used a
+    # mid-pattern (?i), which Python 3.11 rejects, so it is written with a scoped flag here.
+    uce.remove_notifications(event)
+    uce.set_color(event, 'gray')
+    if bool(re.match(".*🏅.*", event.summary)):
+        uce.set_color(event, 'yellow')
+        uce.add_notifications(event, [uce.STD_NOTIFICATION_TIME, uce.ONE_DAY_NOTIFICATION_TIME])
+    if bool(re.match(".*USA.*", event.summary)):
+        uce.set_color(event, 'light blue')
+        uce.add_notifications(event, uce.STD_NOTIFICATION_TIME)
+    if bool(re.match(".*Curling.*", event.summary)):
+        if bool(re.match(".*USA.*", event.summary)):
+            uce.add_notifications(event, [uce.ONE_DAY_NOTIFICATION_TIME, 30])
+        if not bool(re.match(".*(?i:Round Robin).*", event.summary)):
+            uce.set_color(event, 'dark blue')
+            uce.add_notifications(event, [uce.STD_NOTIFICATION_TIME, uce.ONE_DAY_NOTIFICATION_TIME])
+    if bool(re.match(".*Snowboarding.*", event.summary)):
+        uce.set_color(event, 'green')
+    if bool(re.match("(?i)(.*Skiing.*|.*Super-G.*|.*Downhill.*|.*Alpine.*)", event.summary)) or bool(re.match(".*Super G.*", event.summary)):
+        uce.set_color(event, 'green')
+        uce.add_notifications(event, [uce.STD_NOTIFICATION_TIME])
+    if bool(re.match(".*Hockey.*", event.summary)):
+        uce.set_color(event, 'gray')
+        uce.remove_notifications(event)
+
+
+def legacy_classify(summary):
+    # Only the pattern checks of the cascade, for the throughput comparison
+    return (bool(re.match(".*🏅.*", summary)),
+            bool(re.match(".*USA.*", summary)),
+            bool(re.match(".*Curling.*", summary)) and bool(re.match(".*USA.*", summary)),
+            bool(re.match(".*Curling.*", summary)) and not bool(re.match(".*(?i:Round Robin).*", summary)),
+            bool(re.match(".*Snowboarding.*", summary)),
+            bool(re.match("(?i)(.*Skiing.*|.*Super-G.*|.*Downhill.*|.*Alpine.*)", summary)) or bool(re.match(".*Super G.*", summary)),
+            bool(re.match(".*Hockey.*", summary)))
+
+
+def check_parity(events):
+    mismatches = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            legacy_record = EventRecord.from_api(event)
+            record = EventRecord.from_api(event)
+            legacy_apply_rules(legacy_record)
+            uce.apply_rules(record)
+            if legacy_record != record:
+                mismatches += 1
+    return mismatches
+
+
+def throughput(function, summaries):
+    started = time.perf_counter()
+    for summary in summaries:
+        function(summary)
+    return len(summaries) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--rules', default=os.path.join(ROOT, 'rules.json'))
+    args = parser.parse_args()
+
+    uce.initialize_colors()
+    uce.load_rule_set(args.rules)
+    events = synthetic_events(args.events)
+
+    mismatches = check_parity(events[:min(len(events), 20000)])
+    print("Parity check: " + ("OK" if mismatches == 0 else str(mismatches) + " events differ"))
+
+    summaries = [event['summary'] for event in events]
+    print("%-10s %14s" % ('engine', 'summaries/s'))
+    print("%-10s %14.0f" % ('legacy', throughput(legacy_classify, summaries)))
+    print("%-10s %14.0f" % ('compiled', throughput(uce.RULES.matching_rules, summaries)))
+
+
+if __name__ == '__main__':
+    main()
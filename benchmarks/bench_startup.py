@@ -0,0 +1,78 @@
+"""Times building the Calendar service the old ways and through calendar_client.
+
+'download' fetches the discovery document on every start, as clients before 2.0 and builds
+with a discovery URL do. 'build' is the build() call the scripts used to make. 'client' is
+calendar_client.get_service. A throwaway token file is written so no browser login or token
+refresh happens.
+
+Usage: python benchmarks/bench_startup.py [--runs 5]
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import calendar_client
+
+
+def write_token(path):
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    creds = Credentials(token='benchmark', refresh_token='benchmark', client_id='benchmark',
+                        client_secret='benchmark', token_uri='https://oauth2.googleapis.com/token',
+                        scopes=calendar_client.SCOPES, expiry=expiry)
+    with open(path, 'w') as token:
+        token.write(creds.to_json())
+
+
+def download_startup(token_path):
+    creds = Credentials.from_authorized_user_file(token_path, calendar_client.SCOPES)
+    return build('calendar', 'v3', credentials=creds, static_discovery=False, cache_discovery=False)
+
+
+def build_startup(token_path):
+    creds = Credentials.from_authorized_user_file(token_path, calendar_client.SCOPES)
+    return build('calendar', 'v3', credentials=creds)
+
+
+def client_startup(token_path):
+    # Clear the per-process caches so every run is a cold start
+    calendar_client._credentials_cache.clear()
+    calendar_client._service_cache.clear()
+    return calendar_client.get_service(token_path)
+
+
+def best_of(function, token_path, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(token_path)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        token_path = os.path.join(directory, 'token.json')
+        write_token(token_path)
+        print("%-10s %10s" % ('startup', 'best ms'))
+        for name, function in (('download', download_startup), ('build', build_startup), ('client', client_startup)):
+            try:
+                print("%-10s %10.1f" % (name, 1000 * best_of(function, token_path, args.runs)))
+            except Exception as e:
+                print("%-10s %10s (%s)" % (name, 'failed', e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,543 @@
+"""In-process fake of the Calendar v3 endpoints the scripts use, for benchmarks without a Google account.
+
+FakeCalendarBackend holds calendars and events in memory. FakeHttp speaks HTTP to it through the
+same interface as httplib2.Http, so a service built with
+    build('calendar', 'v3', http=FakeHttp(backend), static_discovery=True)
+runs the real googleapiclient request, batch and error handling code. FakeServer puts the same
+backend behind a real local HTTP server for clients that open their own connections, like the
+aiohttp one behind --async. Covered endpoints:
+calendarList.list, calendars.get, events.list (paging, timeMin/timeMax, q, fields, syncToken,
+singleEvents), events.get, events.update, events.patch, events.delete, events.watch, channels.stop
+and batch requests.
+
+Events with a 'recurrence' of 'RRULE:FREQ=DAILY|WEEKLY;COUNT=n[;INTERVAL=k]' are series: with
+singleEvents=true they are listed as their instances, otherwise as the master plus its
+exceptions. Writing to an instance id turns that instance into an exception, like the API.
+
+Events and event listings carry etags: writes with an If-Match that no longer matches get 412,
+and reads with an If-None-Match that still matches get an empty 304, in batches too.
+
+A watch channel gets a 'sync' ping when it opens and an 'exists' ping for every write to its
+calendar, POSTed to its address with the X-Goog-* headers Google sends. Pings go out in order on a
+delivery thread; wait_for_pings() blocks until they are all delivered, and `pings` records each
+one with the status the receiver answered.
+
+Latency is added per HTTP request and a token bucket answers 403 rateLimitExceeded once the
+configured rate is exceeded, per batch part like the real API. The backend counts requests,
+batch parts and bytes in both directions.
+"""
+from __future__ import print_function
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import copy
+import datetime
+import json
+import queue
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import httplib2
+
+DEFAULT_PAGE_SIZE = 250
+MAX_PAGE_SIZE = 2500
+# Google's default and longest lifetime for a web_hook channel
+DEFAULT_CHANNEL_TTL = 7 * 24 * 60 * 60
+
+
+class FakeError(Exception):
+    def __init__(self, status, reason, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+    def body(self):
+        return {'error': {'code': self.status, 'message': self.message,
+                          'errors': [{'domain': 'usageLimits' if self.status in (403, 429) else 'global',
+                                      'reason': self.reason, 'message': self.message}]}}
+
+
+def _project(resource, fields):
+    """Applies a partial-response mask like 'nextPageToken,items(id,summary)' to the top two levels."""
+    if not fields:
+        return resource
+    projected = {}
+    for field in re.findall(r'(\w+)(?:\(([^)]*)\))?', fields):
+        name, sub_fields = field
+        if name not in resource:
+            continue
+        value = resource[name]
+        if sub_fields and isinstance(value, list):
+            keep = sub_fields.split(',')
+            value = [dict((key, item[key]) for key in keep if key in item) for item in value]
+        projected[name] = value
+    return projected
+
+
+def _merge(resource, changes):
+    # Patch semantics: nested objects are merged field by field, while lists and plain values are replaced
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(resource.get(key), dict):
+            _merge(resource[key], value)
+        else:
+            resource[key] = value
+
+
+def _check_event(event):
+    reminders = event.get('reminders') or {}
+    if reminders.get('useDefault') and reminders.get('overrides'):
+        raise FakeError(400, 'cannotUseDefaultRemindersAndSpecifyOverride',
+                        'Cannot specify both default reminders and overrides at the same time.')
+
+
+def _start_key(event):
+    start = event.get('start', {})
+    return start.get('dateTime', start.get('date', ''))
+
+
+def _parse_time(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def _format_time(value):
+    return value.isoformat() + 'Z'
+
+
+def _instances(master):
+    """The generated instances of a series master, newest version of the master applied to all of them."""
+    rule = dict(part.split('=', 1) for part in master['recurrence'][0].split(':', 1)[1].split(';'))
+    step = datetime.timedelta(days={'DAILY': 1, 'WEEKLY': 7}[rule['FREQ']] * int(rule.get('INTERVAL', 1)))
+    first_start = _parse_time(master['start']['dateTime'])
+    first_end = _parse_time(master['end']['dateTime'])
+    instances = []
+    for number in range(int(rule.get('COUNT', 1))):
+        start = first_start + step * number
+        instance = dict((key, value) for key, value in master.items() if key != 'recurrence')
+        instance['id'] = master['id'] + '_' + start.strftime('%Y%m%dT%H%M%SZ')
+        instance['recurringEventId'] = master['id']
+        instance['originalStartTime'] = {'dateTime': _format_time(start), 'timeZone': 'UTC'}
+        instance['start'] = {'dateTime': _format_time(start), 'timeZone': 'UTC'}
+        instance['end'] = {'dateTime': _format_time(first_end + step * number), 'timeZone': 'UTC'}
+        instances.append(instance)
+    return instances
+
+
+class FakeCalendarBackend(object):
+    def __init__(self, latency=0.0, requests_per_second=None, burst=None, page_size=DEFAULT_PAGE_SIZE):
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst is not None else requests_per_second
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.default_page_size = page_size
+        self.lock = threading.Lock()
+        self.calendars = {}
+        # calendar id -> {event id: event}; deleted events stay as cancelled tombstones for sync
+        self.events = {}
+        self.sorted_ids = {}
+        self.expanded = {}
+        self.version = 0
+        # channel id -> the channel resource plus its calendar and address
+        self.channels = {}
+        self.pings = []
+        self.ping_queue = queue.Queue()
+        self.ping_thread = None
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.requests = 0
+        self.batch_requests = 0
+        self.calls = {}
+        self.rate_limited = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add_calendar(self, calendar_id, summary, events=()):
+        with self.lock:
+            self.calendars[calendar_id] = {'kind': 'calendar#calendarListEntry', 'id': calendar_id,
+                                           'summary': summary, 'timeZone': 'UTC'}
+            self.events[calendar_id] = {}
+            for event in events:
+                self.version += 1
+                event = copy.deepcopy(event)
+                event['_version'] = self.version
+                event['etag'] = '"%d"' % self.version
+                self.events[calendar_id][event['id']] = event
+            self.sorted_ids[calendar_id] = None
+            self.expanded[calendar_id] = None
+
+    def _take_token(self):
+        if self.requests_per_second is None:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.requests_per_second)
+        self.refilled_at = now
+        if self.tokens < 1:
+            self.rate_limited += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def handle(self, method, path, query, body, headers=None):
+        """Serves one API call and returns (status, response dict or None). Header names are lower case."""
+        with self.lock:
+            if not self._take_token():
+                error = FakeError(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+                return error.status, error.body()
+            try:
+                return self._route(method, path, query, body, headers or {})
+            except FakeError as error:
+                return error.status, error.body()
+
+    def _route(self, method, path, query, body, headers):
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts[:2] != ['calendar', 'v3']:
+            raise FakeError(404, 'notFound', 'Not Found')
+        parts = parts[2:]
+        if parts == ['users', 'me', 'calendarList'] and method == 'GET':
+            self._count('calendarList.list')
+            return 200, _project({'kind': 'calendar#calendarList', 'items': list(self.calendars.values())},
+                                 query.get('fields'))
+        if parts == ['channels', 'stop'] and method == 'POST':
+            self._count('channels.stop')
+            return self._stop_channel(body or {})
+        if len(parts) < 2 or parts[0] != 'calendars' or parts[1] not in self.calendars:
+            raise FakeError(404, 'notFound', 'Not Found')
+        calendar_id = parts[1]
+        if len(parts) == 2 and method == 'GET':
+            self._count('calendars.get')
+            return 200, _project(self.calendars[calendar_id], query.get('fields'))
+        if len(parts) == 3 and parts[2] == 'events' and method == 'GET':
+            self._count('events.list')
+            return self._list_events(calendar_id, query, headers)
+        if parts[2:] == ['events', 'watch'] and method == 'POST':
+            self._count('events.watch')
+            return self._watch(calendar_id, body or {})
+        if len(parts) == 4 and parts[2] == 'events':
+            return self._event_call(calendar_id, parts[3], method, query, body, headers)
+        raise FakeError(404, 'notFound', 'Not Found')
+
+    def _ordered_events(self, calendar_id):
+        if self.sorted_ids[calendar_id] is None:
+            events = self.events[calendar_id]
+            self.sorted_ids[calendar_id] = sorted(events, key=lambda event_id: (_start_key(events[event_id]), event_id))
+        events = self.events[calendar_id]
+        return [events[event_id] for event_id in self.sorted_ids[calendar_id]]
+
+    def _expanded_events(self, calendar_id):
+        """Every event with series replaced by their instances, exceptions in place of the instances they modify."""
+        if self.expanded[calendar_id] is None:
+            events = self.events[calendar_id]
+            expanded = []
+            for event in self._ordered_events(calendar_id):
+                if 'recurrence' in event:
+                    for instance in _instances(event):
+                        expanded.append(events.get(instance['id'], instance))
+                elif event.get('recurringEventId') not in events:
+                    expanded.append(event)
+            expanded.sort(key=lambda event: (_start_key(event), event['id']))
+            self.expanded[calendar_id] = expanded
+        return self.expanded[calendar_id]
+
+    def _materialize_instance(self, calendar_id, event_id):
+        # Writing to a generated instance stores it as an exception of its series
+        master_id, _, _ = event_id.rpartition('_')
+        master = self.events[calendar_id].get(master_id)
+        if master is None or 'recurrence' not in master:
+            return None
+        for instance in _instances(master):
+            if instance['id'] == event_id:
+                self.events[calendar_id][event_id] = instance
+                self.sorted_ids[calendar_id] = None
+                self.expanded[calendar_id] = None
+                return instance
+        return None
+
+    def _list_events(self, calendar_id, query, headers):
+        page_size = min(int(query.get('maxResults', self.default_page_size)), MAX_PAGE_SIZE)
+        offset = int(query.get('pageToken') or 0)
+        sync_token = query.get('syncToken')
+        if query.get('singleEvents') == 'true':
+            listing = self._expanded_events(calendar_id)
+        else:
+            if 'orderBy' in query:
+                raise FakeError(400, 'invalid', 'The requested ordering is not available for the particular query.')
+            listing = self._ordered_events(calendar_id)
+        if sync_token is not None:
+            if not sync_token.isdigit():
+                raise FakeError(410, 'fullSyncRequired', 'Sync token is no longer valid, a full sync is required.')
+            since = int(sync_token)
+            matches = [event for event in listing if event['_version'] > since]
+        else:
+            time_min = query.get('timeMin')
+            time_max = query.get('timeMax')
+            text = (query.get('q') or '').lower()
+            matches = []
+            for event in listing:
+                if event.get('status') == 'cancelled':
+                    continue
+                # A series is in the window while any of its instances is
+                end = _instances(event)[-1]['end'] if 'recurrence' in event else event['end']
+                if time_min and end.get('dateTime', '') <= time_min:
+                    continue
+                if time_max and _start_key(event) >= time_max:
+                    continue
+                if text and text not in (event.get('summary', '') + ' ' + event.get('description', '')).lower():
+                    continue
+                matches.append(event)
+        page = [dict((key, value) for key, value in event.items() if key != '_version')
+                for event in matches[offset:offset + page_size]]
+        # The collection's etag changes with every write to any event
+        etag = '"p%d"' % self.version
+        if headers.get('if-none-match') == etag:
+            return 304, None
+        response = {'kind': 'calendar#events', 'etag': etag, 'summary': self.calendars[calendar_id]['summary'],
+                    'items': page}
+        if offset + page_size < len(matches):
+            response['nextPageToken'] = str(offset + page_size)
+        else:
+            response['nextSyncToken'] = str(self.version)
+        return 200, _project(response, query.get('fields'))
+
+    def _event_call(self, calendar_id, event_id, method, query, body, headers):
+        events = self.events[calendar_id]
+        event = events.get(event_id)
+        if event is None and method != 'GET':
+            event = self._materialize_instance(calendar_id, event_id)
+        if event is None:
+            raise FakeError(404, 'notFound', 'Not Found')
+        # Deleted events can still be read and written back (which restores them), but not deleted twice
+        if event.get('status') == 'cancelled' and method == 'DELETE':
+            raise FakeError(410, 'deleted', 'Resource has been deleted')
+        if method == 'GET':
+            self._count('events.get')
+            if headers.get('if-none-match') == event['etag']:
+                return 304, None
+            return 200, self._public(event, query)
+        if headers.get('if-match') not in (None, '*', event['etag']):
+            self._count('events.' + {'DELETE': 'delete', 'PUT': 'update', 'PATCH': 'patch'}.get(method, method.lower()))
+            raise FakeError(412, 'conditionNotMet', 'Precondition Failed')
+        if method == 'DELETE':
+            self._count('events.delete')
+            self._write(event, {'status': 'cancelled'})
+            return 204, None
+        if method == 'PUT':
+            self._count('events.update')
+            _check_event(body or {})
+            kept = {'id': event_id, '_version': event['_version']}
+            event.clear()
+            event.update(kept)
+            self._write(event, body or {})
+            return 200, self._public(event, query)
+        if method == 'PATCH':
+            self._count('events.patch')
+            merged = copy.deepcopy(event)
+            _merge(merged, body or {})
+            _check_event(merged)
+            self._write(event, body or {})
+            return 200, self._public(event, query)
+        raise FakeError(405, 'methodNotAllowed', 'Method Not Allowed')
+
+    def _write(self, event, changes):
+        self.version += 1
+        _merge(event, copy.deepcopy(changes))
+        event['_version'] = self.version
+        event['etag'] = '"%d"' % self.version
+        event['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        for calendar_id, events in self.events.items():
+            if events.get(event['id']) is event:
+                self.expanded[calendar_id] = None
+                if 'start' in changes:
+                    self.sorted_ids[calendar_id] = None
+                self._ping(calendar_id, 'exists')
+
+    def _watch(self, calendar_id, body):
+        if body.get('type') != 'web_hook' or not body.get('address') or not body.get('id'):
+            raise FakeError(400, 'invalid', 'A web_hook channel needs an id and an address.')
+        if body['id'] in self.channels:
+            raise FakeError(400, 'channelIdNotUnique', 'Channel id not unique.')
+        ttl = int((body.get('params') or {}).get('ttl', DEFAULT_CHANNEL_TTL))
+        channel = {'kind': 'api#channel', 'id': body['id'], 'resourceId': 'resource-' + uuid.uuid4().hex[:12],
+                   'resourceUri': 'https://www.googleapis.com/calendar/v3/calendars/' + calendar_id + '/events',
+                   'expiration': str(int((time.time() + min(ttl, DEFAULT_CHANNEL_TTL)) * 1000))}
+        if body.get('token'):
+            channel['token'] = body['token']
+        self.channels[body['id']] = dict(channel, calendarId=calendar_id, address=body['address'], messages=0)
+        self._ping(calendar_id, 'sync', body['id'])
+        return 200, channel
+
+    def _stop_channel(self, body):
+        channel = self.channels.get(body.get('id'))
+        if channel is None or channel['resourceId'] != body.get('resourceId'):
+            raise FakeError(404, 'notFound', 'Channel \'' + str(body.get('id')) + '\' not found for project')
+        del self.channels[body['id']]
+        return 204, None
+
+    def _ping(self, calendar_id, state, channel_id=None):
+        now = time.time() * 1000
+        for channel in list(self.channels.values()):
+            if channel['calendarId'] != calendar_id or (channel_id and channel['id'] != channel_id):
+                continue
+            if int(channel['expiration']) < now:
+                continue
+            headers = {'X-Goog-Channel-ID': channel['id'], 'X-Goog-Resource-ID': channel['resourceId'],
+                       'X-Goog-Resource-URI': channel['resourceUri'], 'X-Goog-Resource-State': state,
+                       'X-Goog-Message-Number': str(channel['messages'] + 1),
+                       'X-Goog-Channel-Expiration': time.strftime('%a, %d %b %Y %H:%M:%S GMT',
+                                                                  time.gmtime(int(channel['expiration']) / 1000))}
+            channel['messages'] += 1
+            if 'token' in channel:
+                headers['X-Goog-Channel-Token'] = channel['token']
+            if self.ping_thread is None:
+                self.ping_thread = threading.Thread(target=self._deliver_pings, name='fake-pings', daemon=True)
+                self.ping_thread.start()
+            self.ping_queue.put((channel['address'], headers))
+
+    def _deliver_pings(self):
+        # Outside the backend lock, so a receiver can call the API while it handles a ping
+        while True:
+            address, headers = self.ping_queue.get()
+            try:
+                request = urllib.request.Request(address, data=b'', headers=headers, method='POST')
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = None
+            self.pings.append((headers['X-Goog-Channel-ID'], headers['X-Goog-Resource-State'], status))
+            self.ping_queue.task_done()
+
+    def wait_for_pings(self):
+        """Blocks until every ping sent so far has been delivered."""
+        self.ping_queue.join()
+
+    def _public(self, event, query):
+        return _project(dict((key, value) for key, value in event.items() if key != '_version'), query.get('fields'))
+
+    def event(self, calendar_id, event_id):
+        return self.events[calendar_id].get(event_id)
+
+
+class FakeHttp(object):
+    """Drop-in for httplib2.Http that answers from a FakeCalendarBackend. One per thread, like httplib2."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        body = body or b''
+        headers = dict((key.lower(), value) for key, value in (headers or {}).items())
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        url = urlsplit(uri)
+        with self.backend.lock:
+            self.backend.requests += 1
+            self.backend.bytes_sent += len(body)
+        if url.path.startswith('/batch/'):
+            status, response_headers, content = self._batch(body, headers)
+        else:
+            status, response = self.backend.handle(method, url.path, self._query(url.query), self._json(body), headers)
+            response_headers = {'content-type': 'application/json; charset=UTF-8'}
+            content = json.dumps(response).encode('utf-8') if response is not None else b''
+        with self.backend.lock:
+            self.backend.bytes_received += len(content)
+        response_headers['status'] = str(status)
+        return httplib2.Response(response_headers), content
+
+    @staticmethod
+    def _query(query_string):
+        return dict((key, values[-1]) for key, values in parse_qs(query_string).items())
+
+    @staticmethod
+    def _json(body):
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def _batch(self, body, headers):
+        with self.backend.lock:
+            self.backend.batch_requests += 1
+        boundary = re.search(r'boundary="?([^";]+)"?', headers['content-type']).group(1).encode('utf-8')
+        responses = []
+        for part in body.split(b'--' + boundary)[1:]:
+            if part.startswith(b'--'):
+                break
+            part_headers, _, http_request = part.lstrip(b'\r\n').partition(b'\n\n')
+            if not http_request:
+                part_headers, _, http_request = part.lstrip(b'\r\n').partition(b'\r\n\r\n')
+            content_id = re.search(rb'Content-ID: <([^>]*)>', part_headers).group(1).decode('utf-8')
+            request_head, _, request_body = http_request.replace(b'\r\n', b'\n').partition(b'\n\n')
+            request_lines = request_head.decode('utf-8').split('\n')
+            method, path, _ = request_lines[0].split(' ', 2)
+            part_request_headers = dict((key.strip().lower(), value.strip()) for key, _, value in
+                                        (line.partition(':') for line in request_lines[1:] if ':' in line))
+            url = urlsplit(path)
+            status, response = self.backend.handle(method, url.path, self._query(url.query),
+                                                   self._json(request_body.strip()), part_request_headers)
+            content = json.dumps(response) if response is not None else ''
+            responses.append('--batch_fake\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n'
+                             'HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n%s\r\n'
+                             % (content_id, status, 'OK' if status < 300 else 'Error', content))
+        responses.append('--batch_fake--\r\n')
+        return 200, {'content-type': 'multipart/mixed; boundary=batch_fake'}, ''.join(responses).encode('utf-8')
+
+
+class FakeServer(object):
+    """Serves a FakeCalendarBackend on a local port, one thread per connection, with keep-alive.
+
+    root_url stands in for https://www.googleapis.com/. Each handler thread answers through its
+    own FakeHttp, so latency and rate limiting behave exactly as they do in process.
+    """
+
+    def __init__(self, backend, host='127.0.0.1', port=0):
+        self.backend = backend
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.root_url = 'http://%s:%d/' % self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _handler(self):
+        backend = self.backend
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _answer(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                response, content = FakeHttp(backend).request(self.path, self.command, body, dict(self.headers))
+                self.send_response(response.status)
+                for key, value in response.items():
+                    if key != 'status':
+                        self.send_header(key, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _answer
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import datetime
+import random
+
+SPORTS = ['Curling', 'Snowboarding', 'Alpine Skiing', 'Hockey', 'Figure Skating', 'Biathlon', 'Speed Skating',
+          'Luge', 'Bobsled', 'Ski Jumping', 'Freestyle Skiing', 'Downhill', 'Super-G', 'Super G']
+STAGES = ['Round Robin', 'Semifinal', 'Final', 'Qualifying', 'Heats', 'Quarterfinal']
+TEAMS = ['USA', 'CAN', 'SWE', 'GBR', 'NOR', 'GER', 'SUI', 'JPN']
+PREFIXES = ['', '', '', '', '🏅 ', '🥉 ']
+SUFFIXES = ['', '', '', '', ' (Re-Air)', ' re-air']
+DESCRIPTION = ("Watch live coverage on NBC, Peacock and the NBC Sports app. " * 8).strip()
+
+
+def synthetic_summary(rng):
+    sport = rng.choice(SPORTS)
+    stage = rng.choice(STAGES)
+    if rng.random() < 0.5:
+        teams = rng.sample(TEAMS, 2)
+        summary = sport + ' ' + stage + ': ' + teams[0] + ' vs. ' + teams[1]
+    else:
+        summary = sport + ' ' + stage
+    return rng.choice(PREFIXES) + summary + rng.choice(SUFFIXES)
+
+
+def synthetic_event(index, rng, start=datetime.datetime(2022, 2, 3)):
+    """Builds an event resource shaped like the ones the NBC Sports calendar returns."""
+    begins = start + datetime.timedelta(minutes=20 * index)
+    ends = begins + datetime.timedelta(hours=rng.choice([1, 2, 3]))
+    if rng.random() < 0.3:
+        reminders = {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': rng.choice([5, 10, 30, 1440])}]}
+    else:
+        reminders = {'useDefault': True}
+    event = {
+        'kind': 'calendar#event',
+        'etag': '"%d"' % (3280000000000000 + index),
+        'id': 'evt%07d' % index,
+        'status': 'confirmed',
+        'htmlLink': 'https://www.google.com/calendar/event?eid=evt%07d' % index,
+        'created': '2022-01-20T18:00:00.000Z',
+        'updated': '2022-01-27T18:00:00.000Z',
+        'summary': synthetic_summary(rng),
+        'description': DESCRIPTION,
+        'location': 'Beijing',
+        'creator': {'email': 'nbcolympics@example.com'},
+        'organizer': {'email': 'icn02kf62d26hurpro3qksjhjc@group.calendar.google.com', 'displayName': 'NBC Sports', 'self': True},
+        'start': {'dateTime': begins.isoformat() + 'Z', 'timeZone': 'UTC'},
+        'end': {'dateTime': ends.isoformat() + 'Z', 'timeZone': 'UTC'},
+        'iCalUID': 'evt%07d@google.com' % index,
+        'sequence': 0,
+        'reminders': reminders,
+        'eventType': 'default',
+    }
+    if rng.random() < 0.5:
+        event['colorId'] = rng.choice(['5', '7', '8', '9', '10'])
+    return event
+
+
+def synthetic_events(count, seed=2022, start=datetime.datetime(2022, 2, 3)):
+    rng = random.Random(seed)
+    return [synthetic_event(index, rng, start) for index in range(count)]
+
+
+def synthetic_series(count, instances, seed=2022, start=datetime.datetime(2022, 2, 3)):
+    """count daily recurring events of `instances` occurrences each, so count * instances events in all."""
+    events = synthetic_events(count, seed, start)
+    for event in events:
+        event['recurrence'] = ['RRULE:FREQ=DAILY;COUNT=%d' % instances]
+    return events
@@ -0,0 +1,78 @@
+from __future__ import print_function
+import datetime
+import os.path
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+import httplib2
+
+CREDENTIALS_DIR = 'credentials'
+TOKEN_PATH = 'token.json'
+HTTP_TIMEOUT = 60
+# Refresh the access token ahead of time only when it is about to run out
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# If modifying these scopes, delete the file token.json.
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+_credentials_cache = {}
+_service_cache = {}
+
+
+def _needs_refresh(creds):
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    return creds.expiry - datetime.datetime.utcnow() < REFRESH_MARGIN
+
+
+def load_credentials(token_path=TOKEN_PATH, scopes=SCOPES, credentials_dir=CREDENTIALS_DIR):
+    """Returns the saved credentials, refreshing them only when they are near expiry.
+
+    The file token.json stores the user's access and refresh tokens, and is created
+    automatically when the authorization flow completes for the first time. Credentials are
+    cached per token file, so every caller in the process shares the same object.
+    """
+    creds = _credentials_cache.get(token_path)
+    if creds is None and os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, scopes)
+    if creds is not None and not _needs_refresh(creds):
+        _credentials_cache[token_path] = creds
+        return creds
+    # If there are no (valid) credentials available, let the user log in.
+    if creds and creds.refresh_token:
+        creds.refresh(Request())
+    else:
+        flow = InstalledAppFlow.from_client_secrets_file(
+            os.path.join(credentials_dir, 'credentials.json'), scopes)
+        creds = flow.run_local_server(port=0)
+    # Save the credentials for the next run
+    with open(token_path, 'w') as token:
+        token.write(creds.to_json())
+    _credentials_cache[token_path] = creds
+    return creds
+
+
+def new_http(creds):
+    """An authorized httplib2 connection. httplib2 keeps connections to a host alive between calls."""
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+
+
+def build_service(creds, http=None):
+    # The Calendar v3 discovery document ships with google-api-python-client, so building the
+    # service never has to download it. The on-disk discovery cache is only for dynamic documents.
+    return build('calendar', 'v3', http=http if http is not None else new_http(creds),
+                 static_discovery=True, cache_discovery=False)
+
+
+def get_service(token_path=TOKEN_PATH, scopes=SCOPES):
+    """Returns the Calendar service for a token file, building it once per process."""
+    service = _service_cache.get(token_path)
+    if service is None:
+        service = _service_cache[token_path] = build_service(load_credentials(token_path, scopes))
+    return service
@@ -0,0 +1,70 @@
+from __future__ import print_function
+import time
+
+from calendar_resolver import CALENDAR_LIST_FIELDS
+from event_store import EventStore, CALENDAR_LIST_STATE
+from event_sync import sync_events
+from retry_policy import RetryPolicy
+
+DEFAULT_MIRROR_PATH = 'mirror.db'
+# How old the mirror can get before a read syncs it first
+DEFAULT_MAX_AGE = 15 * 60
+
+
+class CalendarMirror(object):
+    """Read-through local copy of the calendar list and calendars' events for read-only commands.
+
+    Reads are answered from an EventStore. A calendar, or the calendar list, is synced
+    first only when it has never been fetched or was last synced more than max_age
+    seconds ago. Events are kept current with the sync layer's incremental sync. The
+    service is only built when a sync is needed, so a fresh mirror never loads
+    credentials or touches the network. refresh=True throws the local copy away and
+    fetches it again.
+    """
+
+    def __init__(self, get_service, path=DEFAULT_MIRROR_PATH, max_age=DEFAULT_MAX_AGE, policy=None, sync_from=None):
+        self.get_service = get_service
+        self.store = EventStore(path)
+        self.max_age = max_age
+        self.policy = policy if policy is not None else RetryPolicy()
+        # timeMin for the first, full sync of a calendar; later syncs only fetch changes
+        self.sync_from = sync_from
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _is_stale(self, synced_at):
+        return synced_at is None or time.time() - synced_at > self.max_age
+
+    def calendars(self, refresh=False):
+        if refresh or self._is_stale(self.store.get_synced_at(CALENDAR_LIST_STATE)):
+            service = self.get_service()
+            calendars = []
+            page_token = None
+            while True:
+                calendar_list = self.policy.execute(
+                    service.calendarList().list(pageToken=page_token, fields=CALENDAR_LIST_FIELDS), "calendar list")
+                calendars.extend(calendar_list.get('items', []))
+                page_token = calendar_list.get('nextPageToken')
+                if not page_token:
+                    break
+            self.store.replace_calendars(calendars)
+        return list(self.store.iter_calendars())
+
+    def sync(self, calendar_id, refresh=False):
+        if refresh:
+            self.store.clear(calendar_id)
+        if refresh or self._is_stale(self.store.get_synced_at(calendar_id)):
+            for _ in sync_events(self.get_service(), calendar_id, self.store, time_min=self.sync_from, policy=self.policy):
+                pass
+
+    def events(self, calendar_id, time_min=None, time_max=None, text=None, limit=None, refresh=False):
+        """Events overlapping [time_min, time_max) whose summary contains text, in start order."""
+        self.sync(calendar_id, refresh)
+        return self.store.query_events(calendar_id, time_min, time_max, text, limit)
@@ -0,0 +1,100 @@
+from __future__ import print_function
+import csv
+import json
+import os.path
+import time
+
+from retry_policy import RetryPolicy
+
+CALENDAR_IDS_PATH = 'calendar_ids.csv'
+CACHE_PATH = '.calendar_cache.json'
+CACHE_TTL = 7 * 24 * 60 * 60
+# Everything get_events_from_calendar and print_calendar_info need from a calendar
+CALENDAR_LIST_FIELDS = 'nextPageToken,items(id,summary,timeZone)'
+
+
+def _is_account(value):
+    return '@' in value and ' ' not in value
+
+
+def read_calendar_ids(path=CALENDAR_IDS_PATH):
+    """Reads calendar_ids.csv, which holds a row of account emails followed by 'name, calendar id' rows.
+
+    Returns (accounts, {calendar name: calendar id}).
+    """
+    accounts = []
+    calendar_ids = {}
+    if not os.path.exists(path):
+        return accounts, calendar_ids
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        for row in csv.reader(csv_file, skipinitialspace=True):
+            row = [value.strip() for value in row if value.strip()]
+            if not row:
+                continue
+            if all(_is_account(value) for value in row):
+                accounts.extend(row)
+            elif len(row) == 2:
+                calendar_ids[row[0]] = row[1]
+    return accounts, calendar_ids
+
+
+class CalendarResolver(object):
+    """Resolves calendar names to calendars through a local cache file before asking the API.
+
+    The cache is seeded from calendar_ids.csv, whose entries count as fresh at start-up since the
+    file is maintained by hand, and looked-up entries expire after `ttl` seconds. On a
+    miss, calendarList is paged only until the first calendar with that name is found, and the
+    list entry is used as-is instead of making a second calendars().get call.
+    """
+
+    def __init__(self, service, cache_path=CACHE_PATH, ttl=CACHE_TTL, seed_path=CALENDAR_IDS_PATH, policy=None):
+        self.service = service
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.cache = self._load_cache()
+        _, seeds = read_calendar_ids(seed_path)
+        for name, calendar_id in seeds.items():
+            if name not in self.cache:
+                self.cache[name] = {'calendar': {'id': calendar_id, 'summary': name}, 'cached_at': time.time()}
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except ValueError:
+            print("Ignoring unreadable calendar cache: " + self.cache_path)
+            return {}
+
+    def _save_cache(self):
+        with open(self.cache_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(self.cache, cache_file, indent=2)
+
+    def _find_in_calendar_list(self, name):
+        page_token = None
+        while True:
+            calendar_list = self.policy.execute(
+                self.service.calendarList().list(pageToken=page_token, fields=CALENDAR_LIST_FIELDS), "calendar list")
+            for calendar_list_entry in calendar_list.get('items', []):
+                if calendar_list_entry.get('summary') == name:
+                    return calendar_list_entry
+            page_token = calendar_list.get('nextPageToken')
+            if not page_token:
+                return None
+
+    def resolve(self, name, refresh=False):
+        entry = self.cache.get(name)
+        if entry is not None and not refresh and time.time() - entry.get('cached_at', 0) < self.ttl:
+            return entry['calendar']
+        calendar = self._find_in_calendar_list(name)
+        if calendar is None:
+            raise LookupError("No calendar named " + repr(name))
+        self.cache[name] = {'calendar': calendar, 'cached_at': time.time()}
+        self._save_cache()
+        return calendar
+
+    def forget(self, name):
+        if self.cache.pop(name, None) is not None:
+            self._save_cache()
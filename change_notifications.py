@@ -1,155 +1,199 @@
 from __future__ import print_function
-from audioop import add
-from time import sleep
-import math
-import random
 import re
+import asyncio
+import argparse
 import datetime
-import os.path
-from pprint import pprint
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+import calendar_client
+from async_client import AsyncCalendarClient
+from batching import BatchWriter, BatchResult, PendingWrite
+from calendar_resolver import CalendarResolver
+from deletion import (DeletePolicy, DeletionJournal, DeletionCapExceeded, DELETE_MODES, DEFAULT_DELETE_MODE,
+                      DEFAULT_MAX_DELETIONS, JOURNAL_PATH)
+from event_model import normalize_overrides, DEFAULT_REMINDER_METHOD
+from retry_policy import RetryPolicy
+
 OLYMPIC_CALENDAR_ID = 'icn02kf62d26hurpro3qksjhjc@group.calendar.google.com'
 service=None
-CREDENTIALS_DIR='credentials'
-
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
+retry_policy = RetryPolicy()
+# Shared with update_calendar_events: the same cap on deletions, and a journal that --undo-deletions there can restore
+delete_policy = DeletePolicy()
+deletion_journal = DeletionJournal()
+# Minutes before USA and gold medal events that the one custom notification goes off
+NOTIFICATION_MINUTES = 10
+# Only what the reconciler looks at is downloaded
+EVENT_LIST_FIELDS = 'nextPageToken,items(id,summary,reminders)'
 
 
-def update_event(event):
-    print("Updating event: " + event.get('summary'))
-    # Implelmentation of exponential backoff; Ref: https://cloud.google.com/storage/docs/retry-strategy#exponential-backoff
-    max_retry_time = 60
-    max_retries = math.log(max_retry_time + 1, 2)
-    retry_count = 0
-    while True:
-        try:
-            service.events().update(calendarId=OLYMPIC_CALENDAR_ID, eventId=event['id'], body=event).execute()
-        except HttpError as e:
-            if e.reason == "Rate Limit Exceeded":
-                print("Retry count: " + str(retry_count + 1))
-                if retry_count <= max_retries:
-                    print("Error: " + str(e))
-                    sleep_time = 2**retry_count + random.uniform(0, 1)
-                    print("Retrying in " + str(2**retry_count) + " seconds")
-                    sleep(2**retry_count)                
-                    retry_count += 1
-                else:
-                    # print("Error: " + str(e))
-                    # print("Exceeded maximum number of retries")
-                    raise
-            break
-    print("Event updated successfully")
-
 def print_calendar_info(calendar):
     print("Calendar: " + calendar.get('summary') + " (" + calendar.get('id') + ")")
 
 
+def event_list_params():
+    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
+    return {'timeMin': now, 'maxResults': 2500, 'singleEvents': True, 'orderBy': 'startTime',
+            'fields': EVENT_LIST_FIELDS}
+
+
+# Generator that follows nextPageToken and yields events as each page arrives
 def get_events_from_calendar(calendar):
     id = calendar.get('id')
     print("Getting events from calendar:")
     print_calendar_info(calendar)
-
-    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-    events_result = service.events().list(calendarId=id, timeMin=now,
-                                            maxResults=999, singleEvents=True,
-                                            orderBy='startTime').execute()
-    events = events_result.get('items', [])
-    return events
+    params = event_list_params()
+    page_token = None
+    while True:
+        events_result = retry_policy.execute(service.events().list(calendarId=id, pageToken=page_token, **params),
+                                             "events list")
+        for event in events_result.get('items', []):
+            yield event
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
 
 
 def get_calendar_by_id(id):
-    return service.calendars().get(calendarId=id).execute()
+    return retry_policy.execute(service.calendars().get(calendarId=id), "calendar get")
 
+# Served from the local calendar cache (seeded from calendar_ids.csv) whenever possible
 def get_calendar_by_name(name):
-    id = None 
-    page_token = None
-    while True:
-            calendar_list = service.calendarList().list(pageToken=page_token).execute()
-            for calendar_list_entry in calendar_list['items']:
-                if calendar_list_entry['summary'] == name:
-                    id = calendar_list_entry.get('id')
-            page_token = calendar_list.get('nextPageToken')
-            if not page_token:
-                break
-    return get_calendar_by_id(id)
-
-def remove_events(events):    
-    if len(events) > 0:
-        for event in events:
-            user_input = input("Would you like to remove event: " + event.get('summary') + "? (y/n)")
-            if user_input =='y' or user_input == 'Y':
-                service.events().delete(calendarId=OLYMPIC_CALENDAR_ID, eventId=event.get('id')).execute()
-                print("Removed event: " + event.get('summary'))
-    else:
-        print("No events to remove")
-
-
-def remove_notifications(event):
-    if event.get('reminders').get('useDefault') == False:
-        print("Removing notifications for event: " + event.get('summary'))
-        event['reminders'] = {'useDefault': True}   
-        update_event(event)
-
-def add_notification(event, minutes):
-    print(f"Adding {minutes} minute notification for event: " + event.get('summary'))
-    event['reminders'] = {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': minutes}]}
-
-def main():
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
-    """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_DIR + '/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    return CalendarResolver(service, policy=retry_policy).resolve(name)
 
-    try:
-        global service
-        service = build('calendar', 'v3', credentials=creds)
+def is_reair(event):
+    return 'Re-Air' in event.get('summary') or 're-air' in event.get('summary') or 'Re-air' in event.get('summary')
 
-        olympics_calendar = get_calendar_by_name('NBC Sports')
-        olympic_events = get_events_from_calendar(olympics_calendar)
+def is_usa(event):
+    return bool(re.match(".*USA.*", event.get('summary')))
+
+def is_gold_medal(event):
+    return bool(re.match(".*🏅.*", event.get('summary')))
 
-        reair_events = list(filter( lambda event: 'Re-Air' in event.get('summary') or 're-air' in event.get('summary') or 'Re-air' in event.get('summary'), olympic_events))
 
-        usa_events = list(filter(lambda event: bool(re.match(".*USA.*", event.get('summary'))), olympic_events))
-        gold_medal_events = list(filter(lambda event: bool(re.match(".*🏅.*", event.get('summary'))), olympic_events))
-        non_gold_medal_events = list(filter(lambda event: not bool(re.match(".*🏅.*", event.get('summary'))), olympic_events))
-        bronze_medal_events = list(filter(lambda event: bool(re.match(".*🥉.*", event.get('summary'))), olympic_events))
+# The reminders an event should end up with. USA and gold medal events get one notification; bronze medal (🥉)
+# events, like every other event, go back to the calendar's default notifications.
+def target_reminders(event):
+    if is_usa(event) or is_gold_medal(event):
+        return {'useDefault': False, 'overrides': [{'method': DEFAULT_REMINDER_METHOD, 'minutes': NOTIFICATION_MINUTES}]}
+    # A patch merges into the stored reminders, so the old overrides have to be cleared explicitly
+    return {'useDefault': True, 'overrides': []}
 
-        remove_events(reair_events)
-        for event in olympic_events:
-            remove_notifications(event)
+def reminders_match(current, target):
+    current = current or {'useDefault': True}
+    if current.get('useDefault', True) is not False:
+        return target['useDefault']
+    return target['useDefault'] is False and normalize_overrides(current.get('overrides')) == normalize_overrides(target['overrides'])
 
-        for event in usa_events:
-            add_notification(event, 10)
 
-        for event in gold_medal_events:
-            add_notification(event, 10)
-        
+# Returns the Re-Air events the delete policy lets go (it asks about each one by default), or none at all when
+# there are more than it allows
+def select_deletions(events):
+    if not events:
+        return []
+    try:
+        return delete_policy.select(events)
+    except DeletionCapExceeded as e:
+        print("Not removing events: " + str(e))
+        return []
+
+# Works out each event's final state in one pass over all the filters and returns the writes that get the calendar
+# there and the events being deleted, by id: a delete for each Re-Air event the delete policy lets go and one
+# reminders patch for each other event whose reminders differ from its target. Events that are already right get
+# no write at all.
+def reconcile(olympic_events, summary):
+    writes = []
+    reairs = []
+    for event in olympic_events:
+        summary['events'] += 1
+        if is_reair(event):
+            reairs.append(event)
+            continue
+        target = target_reminders(event)
+        if reminders_match(event.get('reminders'), target):
+            summary['unchanged'] += 1
+            continue
+        print("Setting " + ("default" if target['useDefault'] else "custom") + " notifications for event: " +
+              event.get('summary'))
+        writes.append(PendingWrite('patch', event['id'], body={'reminders': target}, summary=event.get('summary')))
+    deleted_events = dict((event['id'], event) for event in select_deletions(reairs))
+    writes.extend(PendingWrite('delete', event['id'], summary=event.get('summary')) for event in deleted_events.values())
+    return writes, deleted_events
+
+def print_results(calendar_id, result, deleted_events, summary):
+    deletion_journal.record(calendar_id, [deleted_events[write.event_id] for write in result.succeeded
+                                          if write.kind == 'delete'])
+    for write in result.succeeded:
+        if write.kind == 'delete':
+            print("Removed event: " + write.summary)
+    for write in result.failed:
+        print("Failed to " + write.kind + " event: " + write.summary + " (" + str(write.error) + ")")
+    summary['deleted'] = len([write for write in result.succeeded if write.kind == 'delete'])
+    summary['updated'] = len(result.succeeded) - summary['deleted']
+    summary['failed'] = len(result.failed)
+    print("Events checked: " + str(summary['events']) + ", already up to date: " + str(summary['unchanged']) +
+          ", updated: " + str(summary['updated']) + ", removed: " + str(summary['deleted']) +
+          ", failed: " + str(summary['failed']))
+
+
+def update_notifications(olympics_calendar):
+    summary = {'events': 0, 'unchanged': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    writer = BatchWriter(service, olympics_calendar.get('id'), policy=retry_policy)
+    writes, deleted_events = reconcile(get_events_from_calendar(olympics_calendar), summary)
+    for write in writes:
+        writer.add(write)
+    print_results(olympics_calendar.get('id'), writer.flush(), deleted_events, summary)
+    return summary
+
+# update_notifications on the async client: pages are fetched one after another and the writes go out as
+# concurrent batches once every prompt has been answered
+async def update_notifications_async(olympics_calendar, client):
+    summary = {'events': 0, 'unchanged': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+    print("Getting events from calendar:")
+    print_calendar_info(olympics_calendar)
+    olympic_events = []
+    async for page in client.iter_event_pages(olympics_calendar.get('id'), **event_list_params()):
+        olympic_events.extend(page.get('items', []))
+    writes, deleted_events = reconcile(olympic_events, summary)
+    result = await client.write(olympics_calendar.get('id'), writes) if writes else BatchResult()
+    print_results(olympics_calendar.get('id'), result, deleted_events, summary)
+    return summary
+
+
+async def run_async(olympics_calendar):
+    async with AsyncCalendarClient(calendar_client.load_credentials(), policy=retry_policy) as client:
+        await update_notifications_async(olympics_calendar, client)
+
+
+def main(argv=None):
+    """Removes Re-Air events and sets notifications on the NBC Sports calendar, writing only what differs."""
+    parser = argparse.ArgumentParser(description="Remove Re-Air events and set notifications on the NBC Sports calendar")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Use the asyncio client (needs aiohttp) and send the writes as concurrent batches")
+    parser.add_argument('--delete-mode', choices=DELETE_MODES, default=DEFAULT_DELETE_MODE,
+                        help="How Re-Air events are removed: ask for each one, only list them, or delete without asking (default: %(default)s)")
+    parser.add_argument('--max-deletions', type=int, default=DEFAULT_MAX_DELETIONS,
+                        help="Refuse to delete anything if more than this many events would go (default: %(default)s)")
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help="JSON lines file recording every deleted event, which update_calendar_events.py "
+                             "--undo-deletions restores from (default: %(default)s)")
+    args = parser.parse_args(argv)
+    global service, delete_policy, deletion_journal
+    service = calendar_client.get_service()
+    delete_policy = DeletePolicy(args.delete_mode, args.max_deletions)
+    deletion_journal = DeletionJournal(args.journal)
+
+    try:
+        olympics_calendar = get_calendar_by_name('NBC Sports')
+        if args.use_async:
+            asyncio.run(run_async(olympics_calendar))
+        else:
+            update_notifications(olympics_calendar)
     except HttpError as error:
         print('An error occurred: %s' % error)
+    finally:
+        print(retry_policy.summary())
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,96 @@
+from __future__ import print_function
+import datetime
+import json
+import os
+
+PLAN_VERSION = 1
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+class ChangePlanWriter(object):
+    """Writes a change plan: a JSON lines file with a header line and then one change per line.
+
+    A change is either {"op": "patch", "id", "summary", "body"} with only the changed fields
+    in the body, or {"op": "delete", "id", "summary", "event"} with the event as fetched so
+    the deletion journal can still restore it. The plan is written to a temporary file and
+    only moved into place once it is complete, so a plan that exists is never half written.
+    """
+
+    def __init__(self, path, calendar_id):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.header = {'plan': PLAN_VERSION, 'id': datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%fZ'),
+                       'calendarId': calendar_id}
+        self.patches = 0
+        self.deletes = 0
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        self._write(self.header)
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def patch(self, record, fields):
+        self._write({'op': 'patch', 'id': record.id, 'summary': record.summary, 'body': record.to_patch(fields)})
+        self.patches += 1
+
+    def delete(self, event):
+        self._write({'op': 'delete', 'id': event['id'], 'summary': event.get('summary'), 'event': event})
+        self.deletes += 1
+
+    def close(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def read_plan(path):
+    """Returns (header, list of changes) for a plan written by ChangePlanWriter."""
+    with open(path, encoding='utf-8') as plan_file:
+        header = json.loads(plan_file.readline())
+        if header.get('plan') != PLAN_VERSION:
+            raise ValueError(path + " is not a version " + str(PLAN_VERSION) + " change plan")
+        changes = [json.loads(line) for line in plan_file if line.strip()]
+    return header, changes
+
+
+class PlanCheckpoint(object):
+    """How far applying a plan got: every change before `next` is done, and so is every index in `done`.
+
+    Changes are settled one by one, so a round in which some writes gave up still keeps the ones
+    that went through, and a resumed apply only sends what is left.
+
+    It is saved next to the plan after each round of writes by writing a temporary file and
+    renaming it over the old one, so a crash leaves either the old or the new checkpoint.
+    """
+
+    def __init__(self, plan_path, plan_id):
+        self.path = plan_path + CHECKPOINT_SUFFIX
+        self.plan_id = plan_id
+
+    def load(self):
+        state = {'plan': self.plan_id, 'next': 0, 'done': [], 'updated': 0, 'deleted': 0, 'failed': 0}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            # A checkpoint left over from another plan written to the same path doesn't count
+            if saved.get('plan') == self.plan_id:
+                state.update(saved)
+        return state
+
+    def save(self, state):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,90 @@
+from __future__ import print_function
+import datetime
+import json
+import os
+
+DELETE_MODES = ('prompt', 'dry-run', 'auto')
+DEFAULT_DELETE_MODE = 'prompt'
+DEFAULT_MAX_DELETIONS = 100
+JOURNAL_PATH = 'deletions.jsonl'
+
+
+class DeletionCapExceeded(Exception):
+    pass
+
+
+class DeletePolicy(object):
+    """Decides which of the unwanted events actually get deleted.
+
+    'prompt' asks about each event like the script always has, 'dry-run' only lists them and
+    'auto' deletes them all without asking so a run can go unattended. In every mode, a run
+    that would delete more than max_deletions events is refused outright, since that almost
+    always means a rule or the feed has gone wrong.
+    """
+
+    def __init__(self, mode=DEFAULT_DELETE_MODE, max_deletions=DEFAULT_MAX_DELETIONS, ask=input):
+        if mode not in DELETE_MODES:
+            raise ValueError("Unknown delete mode: " + str(mode))
+        self.mode = mode
+        self.max_deletions = max_deletions
+        self.ask = ask
+
+    def select(self, events):
+        if self.max_deletions is not None and len(events) > self.max_deletions:
+            raise DeletionCapExceeded(str(len(events)) + " events to delete is over the limit of " +
+                                      str(self.max_deletions) + "; nothing was deleted")
+        if self.mode == 'dry-run':
+            for event in events:
+                print("Would remove event: " + event.get('summary'))
+            return []
+        if self.mode == 'auto':
+            return list(events)
+        selected = []
+        for event in events:
+            user_input = self.ask("Would you like to remove event: " + event.get('summary') + "? (y/n)")
+            if user_input == 'y' or user_input == 'Y':
+                selected.append(event)
+        return selected
+
+
+class DeletionJournal(object):
+    """Append-only JSON lines log of deleted events so a bad run can be undone.
+
+    Every line holds the run id, the calendar id and the event as it was fetched. Parallel runs
+    (see pipeline.py) share one journal, so each call's lines go to the file in a single append.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.run_id = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%fZ')
+
+    def record(self, calendar_id, events):
+        data = ''.join(json.dumps({'run': self.run_id, 'calendarId': calendar_id, 'event': event},
+                                  ensure_ascii=False) + '\n' for event in events).encode('utf-8')
+        if not data:
+            return
+        # With O_APPEND every write lands at the end of the file as a whole, even with other processes appending
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = os.write(descriptor, data)
+            while written < len(data):
+                written += os.write(descriptor, data[written:])
+        finally:
+            os.close(descriptor)
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                if line.strip():
+                    yield json.loads(line)
+
+    def last_run_id(self):
+        run_id = None
+        for entry in self.entries():
+            run_id = entry['run']
+        return run_id
+
+    def entries_for_run(self, run_id):
+        return [entry for entry in self.entries() if entry['run'] == run_id]
@@ -0,0 +1,117 @@
+from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import logging
+import threading
+import time
+
+# The Calendar API's default quota is 600 queries per minute per user
+# Ref: https://developers.google.com/calendar/api/guides/quota
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_WORKERS = 4
+# Shortfalls smaller than this are rounding error from the refill arithmetic, not a reason to wait
+TOKEN_TOLERANCE = 1e-9
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket that blocks callers until they are allowed to send.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, so short bursts go out
+    immediately while the long-run send rate never exceeds the quota.
+    """
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _take(self, tokens):
+        # Returns 0 once the tokens are taken, otherwise how long to wait before trying again.
+        # A request bigger than the bucket (a full batch on a small quota) waits for a full bucket and goes negative
+        with self.lock:
+            self._refill()
+            if self.tokens + TOKEN_TOLERANCE >= min(tokens, self.capacity):
+                self.tokens -= tokens
+                return 0.0
+            return (min(tokens, self.capacity) - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Takes `tokens` from the bucket, sleeping until enough have refilled. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            wait = self._take(float(tokens))
+            if not wait:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens=1):
+        """acquire() for coroutines: other tasks keep running while this one waits for tokens."""
+        waited = 0.0
+        while True:
+            wait = self._take(float(tokens))
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+class Dispatcher(object):
+    """Runs jobs on a pool of worker threads, each job paying the shared token bucket before it is sent.
+
+    httplib2 connections aren't thread-safe, so every worker thread gets its own HTTP object from
+    http_factory. A job that raises doesn't take the run down with it: its error is handed back
+    to the caller next to the job so the work can be re-queued.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, limiter=None, http_factory=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.limiter = limiter
+        self.http_factory = http_factory
+        self.local = threading.local()
+
+    def http(self):
+        if self.http_factory is None:
+            return None
+        if getattr(self.local, 'http', None) is None:
+            self.local.http = self.http_factory()
+        return self.local.http
+
+    def _run(self, job, handler, cost):
+        if self.limiter is not None:
+            self.limiter.acquire(cost(job))
+        try:
+            return handler(job, http=self.http())
+        except Exception:
+            # Don't reuse a connection that may be left in a bad state
+            self.local.http = None
+            raise
+
+    def map(self, jobs, handler, cost=len):
+        """Calls handler(job, http=...) for every job and yields (job, result, error) as each one finishes."""
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._run, job, handler, cost): job for job in jobs}
+            for finished, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                log.debug("Dispatched %d/%d jobs", finished, len(jobs))
+                yield job, result, error
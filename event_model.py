@@ -0,0 +1,126 @@
+from __future__ import print_function
+
+DEFAULT_REMINDER_METHOD = 'popup'
+
+
+def normalize_overrides(overrides):
+    """Reminder overrides as a frozenset of (method, minutes) pairs, so their order never matters."""
+    return frozenset((override.get('method', DEFAULT_REMINDER_METHOD), override.get('minutes'))
+                     for override in overrides or ())
+
+
+def _when(value):
+    # Timed events carry dateTime and all-day events carry date
+    value = value or {}
+    return value.get('dateTime', value.get('date'))
+
+
+class EventRecord(object):
+    """The fields of an event that the rules look at or manage, instead of the whole API resource.
+
+    Records compare and hash on the same fields events_are_equal always looked at, with
+    reminder overrides held as a frozenset so no per-comparison normalizing is needed. When
+    useDefault is on the overrides are left empty, since the API ignores them then. The etag and
+    updated time the event was fetched with are kept for conditional writes but aren't compared. Records
+    are mutable so the rules can edit them, so don't change one while it is a dict key or
+    in a set.
+    """
+
+    __slots__ = ('id', 'status', 'summary', 'start', 'end', 'location', 'description', 'use_default_reminders',
+                 'overrides', 'color_id', 'etag', 'updated')
+
+    def __init__(self, id, summary=None, start=None, end=None, location=None, description=None,
+                 use_default_reminders=True, overrides=frozenset(), color_id=None, status=None, etag=None, updated=None):
+        self.id = id
+        self.status = status
+        self.summary = summary
+        self.start = start
+        self.end = end
+        self.location = location
+        self.description = description
+        self.use_default_reminders = use_default_reminders
+        self.overrides = frozenset() if use_default_reminders else frozenset(overrides)
+        self.color_id = color_id
+        self.etag = etag
+        self.updated = updated
+
+    @classmethod
+    def from_api(cls, event):
+        reminders = event.get('reminders') or {}
+        use_default = reminders.get('useDefault', True) is not False
+        color_id = event.get('colorId')
+        return cls(event['id'], summary=event.get('summary'), start=_when(event.get('start')),
+                   end=_when(event.get('end')), location=event.get('location'), description=event.get('description'),
+                   use_default_reminders=use_default,
+                   overrides=() if use_default else normalize_overrides(reminders.get('overrides')),
+                   color_id=str(color_id) if color_id is not None else None, status=event.get('status'),
+                   etag=event.get('etag'), updated=event.get('updated'))
+
+    def copy(self):
+        record = EventRecord.__new__(EventRecord)
+        for slot in EventRecord.__slots__:
+            setattr(record, slot, getattr(self, slot))
+        return record
+
+    def _key(self):
+        return (self.id, self.summary, self.start, self.end, self.location, self.description,
+                self.use_default_reminders, self.overrides, self.color_id)
+
+    def __eq__(self, other):
+        if not isinstance(other, EventRecord):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'EventRecord(%r, %r)' % (self.id, self.summary)
+
+    def reminders(self):
+        """The reminders as the API resource spells them."""
+        # A patch merges into the stored reminders, so the overrides have to be cleared explicitly or the API
+        # refuses default reminders next to the old overrides
+        if self.use_default_reminders:
+            return {'useDefault': True, 'overrides': []}
+        return {'useDefault': False,
+                'overrides': [{'method': method, 'minutes': minutes} for method, minutes in sorted(self.overrides)]}
+
+    def changed_fields(self, original):
+        """Names of the API fields that differ from `original`, an earlier copy of this record."""
+        changed = []
+        if self.summary != original.summary:
+            changed.append('summary')
+        if self.location != original.location:
+            changed.append('location')
+        if self.description != original.description:
+            changed.append('description')
+        if self.use_default_reminders != original.use_default_reminders or self.overrides != original.overrides:
+            changed.append('reminders')
+        if self.color_id != original.color_id:
+            changed.append('colorId')
+        if self.status != original.status:
+            changed.append('status')
+        return changed
+
+    def to_patch(self, fields):
+        """A patch body carrying only the given API fields."""
+        body = {}
+        for field in fields:
+            if field == 'reminders':
+                body['reminders'] = self.reminders()
+            elif field == 'colorId':
+                body['colorId'] = self.color_id
+            elif field in ('summary', 'location', 'description', 'status'):
+                body[field] = getattr(self, field)
+            else:
+                raise ValueError("Can't patch " + field + " from an EventRecord")
+        return body
+
+
+def as_record(event):
+    return event if isinstance(event, EventRecord) else EventRecord.from_api(event)
@@ -0,0 +1,215 @@
+from __future__ import print_function
+import datetime
+import json
+import sqlite3
+import time
+
+DEFAULT_STORE_PATH = 'events.db'
+# sync_state row that records when the calendar list was last fetched
+CALENDAR_LIST_STATE = '#calendarList'
+# Columns added for time-range and text queries after the first version of the events table
+QUERY_COLUMNS = ('start_time', 'end_time', 'summary')
+# Column added to sync_state for the digest of the rules the synced events were evaluated with
+RULES_DIGEST_COLUMN = 'rules_digest'
+
+
+def utc_timestamp(value):
+    """Normalizes an RFC 3339 dateTime, or a date for all-day events, to a sortable UTC 'YYYY-MM-DDTHH:MM:SSZ'."""
+    if not value:
+        return None
+    if len(value) == 10:
+        # All-day events have no time zone; they are taken to start at midnight UTC
+        return value + 'T00:00:00Z'
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _event_time(event, key):
+    value = event.get(key) or {}
+    return utc_timestamp(value.get('dateTime', value.get('date')))
+
+
+def _query_values(event):
+    return (_event_time(event, 'start'), _event_time(event, 'end'), event.get('summary'))
+
+
+class EventStore(object):
+    """Local SQLite copy of calendar events plus the sync token needed to fetch only what changed.
+
+    Events also keep their UTC start and end times and summary in indexed columns so they can
+    be queried by time range and text without parsing every body. The calendar list can be
+    kept here too, as can the ids of synced events whose changes haven't been applied yet.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                calendar_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                PRIMARY KEY (calendar_id, event_id)
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                calendar_id TEXT PRIMARY KEY,
+                sync_token TEXT,
+                synced_at REAL
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS calendars (
+                calendar_id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                body TEXT NOT NULL
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pending_events (
+                calendar_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                PRIMARY KEY (calendar_id, event_id)
+            )""")
+        self._add_query_columns()
+        self._add_rules_digest_column()
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_time)")
+        self.connection.commit()
+
+    def _add_query_columns(self):
+        columns = set(row[1] for row in self.connection.execute("PRAGMA table_info(events)"))
+        missing = [column for column in QUERY_COLUMNS if column not in columns]
+        if not missing:
+            return
+        for column in missing:
+            self.connection.execute("ALTER TABLE events ADD COLUMN " + column + " TEXT")
+        # Fill them in for events stored before the columns existed
+        rows = self.connection.execute("SELECT calendar_id, event_id, body FROM events").fetchall()
+        self.connection.executemany(
+            "UPDATE events SET start_time = ?, end_time = ?, summary = ? WHERE calendar_id = ? AND event_id = ?",
+            [_query_values(json.loads(body)) + (calendar_id, event_id) for calendar_id, event_id, body in rows])
+
+    def _add_rules_digest_column(self):
+        columns = set(row[1] for row in self.connection.execute("PRAGMA table_info(sync_state)"))
+        if RULES_DIGEST_COLUMN not in columns:
+            self.connection.execute("ALTER TABLE sync_state ADD COLUMN " + RULES_DIGEST_COLUMN + " TEXT")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_sync_token(self, calendar_id):
+        row = self.connection.execute(
+            "SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_sync_token(self, calendar_id, sync_token, rules_digest=None):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, synced_at, rules_digest) VALUES (?, ?, ?, ?)",
+            (calendar_id, sync_token, time.time(), rules_digest))
+        self.connection.commit()
+
+    def get_rules_digest(self, calendar_id):
+        """Digest of the rules the calendar's last sync was evaluated with, or None."""
+        row = self.connection.execute(
+            "SELECT rules_digest FROM sync_state WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_synced_at(self, calendar_id):
+        """When the calendar (or with CALENDAR_LIST_STATE, the calendar list) was last synced, or None."""
+        row = self.connection.execute(
+            "SELECT synced_at FROM sync_state WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_event(self, calendar_id, event_id):
+        row = self.connection.execute(
+            "SELECT body FROM events WHERE calendar_id = ? AND event_id = ?", (calendar_id, event_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_event(self, calendar_id, event):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO events (calendar_id, event_id, body, start_time, end_time, summary) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (calendar_id, event['id'], json.dumps(event)) + _query_values(event))
+
+    def delete_event(self, calendar_id, event_id):
+        self.connection.execute(
+            "DELETE FROM events WHERE calendar_id = ? AND event_id = ?", (calendar_id, event_id))
+        self.connection.execute(
+            "DELETE FROM pending_events WHERE calendar_id = ? AND event_id = ?", (calendar_id, event_id))
+
+    def mark_pending(self, calendar_id, event_id):
+        """Records that an event was synced but whatever it needs hasn't been done yet."""
+        self.connection.execute(
+            "INSERT OR IGNORE INTO pending_events (calendar_id, event_id) VALUES (?, ?)", (calendar_id, event_id))
+
+    def get_pending_ids(self, calendar_id):
+        return set(row[0] for row in self.connection.execute(
+            "SELECT event_id FROM pending_events WHERE calendar_id = ?", (calendar_id,)))
+
+    def set_pending_ids(self, calendar_id, event_ids):
+        """Replaces the calendar's pending events with event_ids, once a run has settled everything else."""
+        self.connection.execute("DELETE FROM pending_events WHERE calendar_id = ?", (calendar_id,))
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO pending_events (calendar_id, event_id) VALUES (?, ?)",
+            [(calendar_id, event_id) for event_id in event_ids])
+        self.connection.commit()
+
+    def iter_events(self, calendar_id):
+        for row in self.connection.execute("SELECT body FROM events WHERE calendar_id = ?", (calendar_id,)):
+            yield json.loads(row[0])
+
+    def query_events(self, calendar_id, time_min=None, time_max=None, text=None, limit=None):
+        """Events overlapping [time_min, time_max) whose summary contains text, in start order.
+
+        Times are RFC 3339 strings like the API's timeMin and timeMax; text is matched without
+        regard to case (ASCII only, like SQLite's LIKE).
+        """
+        sql = "SELECT body FROM events WHERE calendar_id = ?"
+        parameters = [calendar_id]
+        if time_min:
+            sql += " AND end_time > ?"
+            parameters.append(utc_timestamp(time_min))
+        if time_max:
+            sql += " AND start_time < ?"
+            parameters.append(utc_timestamp(time_max))
+        if text:
+            sql += " AND summary LIKE ? ESCAPE '\\'"
+            parameters.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        sql += " ORDER BY start_time"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return [json.loads(row[0]) for row in self.connection.execute(sql, parameters)]
+
+    def replace_calendars(self, calendars):
+        """Stores a freshly fetched calendar list in place of the old one."""
+        self.connection.execute("DELETE FROM calendars")
+        self.connection.executemany(
+            "INSERT INTO calendars (calendar_id, position, body) VALUES (?, ?, ?)",
+            [(calendar['id'], position, json.dumps(calendar)) for position, calendar in enumerate(calendars)])
+        self.set_sync_token(CALENDAR_LIST_STATE, None)
+
+    def iter_calendars(self):
+        for row in self.connection.execute("SELECT body FROM calendars ORDER BY position"):
+            yield json.loads(row[0])
+
+    def count_events(self, calendar_id):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM events WHERE calendar_id = ?", (calendar_id,)).fetchone()[0]
+
+    def clear(self, calendar_id):
+        """Forgets every event and the sync token for a calendar so the next sync is a full one."""
+        self.connection.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+        self.connection.execute("DELETE FROM pending_events WHERE calendar_id = ?", (calendar_id,))
+        self.connection.execute("DELETE FROM sync_state WHERE calendar_id = ?", (calendar_id,))
+        self.connection.commit()
+
+    def commit(self):
+        self.connection.commit()
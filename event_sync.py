@@ -0,0 +1,113 @@
+from __future__ import print_function
+
+from googleapiclient.errors import HttpError
+
+from retry_policy import RetryPolicy
+
+# Ref: https://developers.google.com/calendar/api/guides/sync
+SYNC_PAGE_SIZE = 250
+# Appended to the calendar id for the store's rows and sync token when series aren't expanded, since a
+# sync token only describes the kind of listing it came from
+SERIES_STATE_SUFFIX = '#series'
+
+
+def sync_state_key(calendar_id, single_events=True):
+    """The key a calendar's store rows, sync token and pending events are kept under."""
+    return calendar_id if single_events else calendar_id + SERIES_STATE_SUFFIX
+
+
+def is_sync_token_expired(error):
+    # The server answers 410 Gone when a sync token is no longer valid and a full sync is required
+    return isinstance(error, HttpError) and error.resp.status == 410
+
+
+def _list_pages(service, calendar_id, page_size, policy, sync_token=None, time_min=None, fields=None, single_events=True):
+    page_token = None
+    while True:
+        kwargs = {'calendarId': calendar_id, 'maxResults': page_size, 'singleEvents': single_events,
+                  'pageToken': page_token}
+        if fields:
+            # The mask has to keep nextPageToken, nextSyncToken and each item's status
+            kwargs['fields'] = fields
+        # timeMin and orderBy can't be combined with syncToken, so they only go on the full sync
+        if sync_token:
+            kwargs['syncToken'] = sync_token
+        elif time_min:
+            kwargs['timeMin'] = time_min
+        events_result = policy.execute(service.events().list(**kwargs), "events sync")
+        yield events_result
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def sync_events(service, calendar_id, store, time_min=None, page_size=SYNC_PAGE_SIZE, policy=None, fields=None,
+                single_events=True, rules_digest=None, retry_pending=False):
+    """Yields the events that changed since the last sync and keeps the local store up to date.
+
+    With no saved sync token this is a full sync of everything from time_min onward. Cancelled
+    events are dropped from the store instead of being yielded. The new sync token is only saved
+    once the caller has consumed the whole delta, so an interrupted run will fetch it again.
+    With single_events=False recurring series come as their master event plus any modified
+    instances, and are stored apart from the expanded listing.
+
+    rules_digest identifies the rules the caller evaluates the events with. When it differs from
+    the one saved with the sync token, every stored event may now need a different outcome, so
+    the store is cleared and a full sync runs.
+
+    With retry_pending, every event of the delta is marked pending in the store as it is saved,
+    and events still pending from earlier runs are yielded again from the store after the
+    delta. The caller clears them with store.set_pending_ids once their changes are applied,
+    so nothing it failed to do is lost when the sync token moves on.
+    """
+    policy = policy if policy is not None else RetryPolicy()
+    state_key = sync_state_key(calendar_id, single_events)
+    sync_token = store.get_sync_token(state_key)
+    if sync_token and rules_digest != store.get_rules_digest(state_key):
+        print("Rules changed since the last sync, running a full sync")
+        store.clear(state_key)
+        sync_token = None
+    elif sync_token:
+        print("Fetching changes since last sync")
+    else:
+        print("No sync token saved, running a full sync")
+    # Read after any clear above, which also drops what was pending
+    pending_ids = store.get_pending_ids(state_key) if retry_pending else set()
+    seen_ids = set()
+    try:
+        next_sync_token = yield from _sync_pages(service, calendar_id, state_key, store, page_size, policy, sync_token,
+                                                 time_min, fields, single_events, retry_pending, seen_ids)
+    except HttpError as e:
+        if not (sync_token and is_sync_token_expired(e)):
+            raise
+        print("Sync token expired, running a full sync")
+        store.clear(state_key)
+        pending_ids = set()
+        next_sync_token = yield from _sync_pages(service, calendar_id, state_key, store, page_size, policy, None,
+                                                 time_min, fields, single_events, retry_pending, seen_ids)
+    if pending_ids - seen_ids:
+        print("Retrying " + str(len(pending_ids - seen_ids)) + " events left over from earlier runs")
+    for event_id in sorted(pending_ids - seen_ids):
+        # Cancelled since then events are gone from the store, and with them their pending mark
+        event = store.get_event(state_key, event_id)
+        if event is not None:
+            yield event
+    store.set_sync_token(state_key, next_sync_token, rules_digest)
+
+
+def _sync_pages(service, calendar_id, state_key, store, page_size, policy, sync_token, time_min, fields, single_events,
+                retry_pending, seen_ids):
+    next_sync_token = None
+    for events_result in _list_pages(service, calendar_id, page_size, policy, sync_token, time_min, fields, single_events):
+        for event in events_result.get('items', []):
+            if event.get('status') == 'cancelled':
+                store.delete_event(state_key, event['id'])
+                continue
+            store.put_event(state_key, event)
+            if retry_pending:
+                store.mark_pending(state_key, event['id'])
+            seen_ids.add(event['id'])
+            yield event
+        store.commit()
+        next_sync_token = events_result.get('nextSyncToken')
+    return next_sync_token
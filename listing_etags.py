@@ -0,0 +1,48 @@
+from __future__ import print_function
+import json
+import os.path
+
+LISTING_ETAGS_PATH = '.listing_etags.json'
+
+
+def listing_key(calendar_id, params, rules_digest):
+    """Identifies a listing by calendar, list parameters and rule file, the things a run's outcome depends on."""
+    return json.dumps([calendar_id, params, rules_digest], sort_keys=True, default=str)
+
+
+class ListingEtags(object):
+    """Etags of event listings that a run left fully up to date, kept in a small JSON file.
+
+    The next run of the same listing sends the etag as If-None-Match on its first page. A 304
+    means nothing on the calendar changed since, so there is nothing to fetch or evaluate.
+    """
+
+    def __init__(self, path=LISTING_ETAGS_PATH):
+        self.path = path
+        self.etags = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as etags_file:
+                return json.load(etags_file)
+        except ValueError:
+            print("Ignoring unreadable listing etags: " + self.path)
+            return {}
+
+    def _save(self):
+        with open(self.path, 'w', encoding='utf-8') as etags_file:
+            json.dump(self.etags, etags_file, indent=2)
+
+    def get(self, key):
+        return self.etags.get(key)
+
+    def remember(self, key, etag):
+        if etag and self.etags.get(key) != etag:
+            self.etags[key] = etag
+            self._save()
+
+    def forget(self, key):
+        if self.etags.pop(key, None) is not None:
+            self._save()
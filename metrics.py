@@ -0,0 +1,228 @@
+from __future__ import print_function
+from urllib.parse import urlsplit, unquote
+import contextlib
+import datetime
+import json
+import math
+import threading
+import time
+
+# Reported for every call type
+PERCENTILES = (50, 90, 99)
+EVENT_METHODS = {'GET': 'events.get', 'PUT': 'events.update', 'PATCH': 'events.patch', 'DELETE': 'events.delete'}
+
+
+def call_kind(method, uri):
+    """Names an HTTP request after the API method it calls, e.g. 'events.list' or 'batch'.
+
+    The names match googleapiclient's methodId without the 'calendar.' prefix, so transport
+    and retry numbers for the same call end up in the same place.
+    """
+    path = urlsplit(uri).path
+    if path.startswith('/batch/'):
+        return 'batch'
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    if parts[:2] == ['calendar', 'v3']:
+        parts = parts[2:]
+    if parts[:3] == ['users', 'me', 'calendarList']:
+        return 'calendarList.list' if len(parts) == 3 else 'calendarList.get'
+    if parts == ['channels', 'stop']:
+        return 'channels.stop'
+    if len(parts) == 2 and parts[0] == 'calendars':
+        return 'calendars.get'
+    if len(parts) == 3 and parts[2] == 'events':
+        return 'events.list'
+    if len(parts) == 4 and parts[2] == 'events':
+        if parts[3] == 'watch':
+            return 'events.watch'
+        return EVENT_METHODS.get(method, 'events.' + method.lower())
+    return method + ' ' + path
+
+
+def request_kind(request):
+    """The call type of a googleapiclient HttpRequest, named like call_kind."""
+    method_id = getattr(request, 'methodId', None)
+    if not method_id:
+        return call_kind(request.method, request.uri)
+    return method_id[len('calendar.'):] if method_id.startswith('calendar.') else method_id
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100.0 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+class CallStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.sleep_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = []
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        report = {'count': self.count, 'errors': self.errors, 'retries': self.retries,
+                  'sleep_seconds': round(self.sleep_seconds, 6), 'bytes_sent': self.bytes_sent,
+                  'bytes_received': self.bytes_received,
+                  'latency_seconds': dict(('p' + str(p), round(percentile(latencies, p), 6)) for p in PERCENTILES)}
+        report['latency_seconds']['max'] = round(latencies[-1], 6) if latencies else 0.0
+        report['latency_seconds']['sum'] = round(sum(latencies), 6)
+        return report
+
+
+class MeteredHttp(object):
+    """Wraps an httplib2-style HTTP object and records every request's latency and size."""
+
+    def __init__(self, http, metrics):
+        self.http = http
+        self.metrics = metrics
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        started = time.perf_counter()
+        status = 0
+        content = b''
+        try:
+            response, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            status = response.status
+            return response, content
+        finally:
+            self.metrics.record_call(call_kind(method, uri), time.perf_counter() - started,
+                                     len(body or b''), len(content or b''), status)
+
+    def __getattr__(self, name):
+        # Credentials, timeouts etc. still belong to the wrapped object
+        return getattr(self.http, name)
+
+
+class RunMetrics(object):
+    """Timings and API call statistics for one run.
+
+    Phases nest and each one is charged only for its own time, so a delete that happens
+    while the event stream is being read counts as 'delete' and not as 'fetch'. Phases are
+    timed on the main thread; calls and retries can be recorded from any thread.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started_at = datetime.datetime.utcnow()
+        self.started = clock()
+        self.phases = {}
+        self.calls = {}
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        frame = [self.clock(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = self.clock() - frame[0]
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def timed(self, iterable, name):
+        """Yields from iterable, charging the time spent waiting for each item to the phase `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _stats(self, kind):
+        stats = self.calls.get(kind)
+        if stats is None:
+            stats = self.calls[kind] = CallStats()
+        return stats
+
+    def record_call(self, kind, seconds, bytes_sent=0, bytes_received=0, status=200):
+        with self.lock:
+            stats = self._stats(kind)
+            stats.count += 1
+            if not status or status >= 400:
+                stats.errors += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latencies.append(seconds)
+
+    def record_retry(self, kind, sleep_seconds=0.0):
+        with self.lock:
+            stats = self._stats(kind)
+            stats.retries += 1
+            stats.sleep_seconds += sleep_seconds
+
+    def wrap(self, http):
+        return MeteredHttp(http, self)
+
+    def report(self, summary=None):
+        with self.lock:
+            calls = dict((kind, stats.report()) for kind, stats in sorted(self.calls.items()))
+        report = {'started_at': self.started_at.isoformat() + 'Z',
+                  'elapsed_seconds': round(self.clock() - self.started, 6),
+                  'phases': dict((name, round(seconds, 6)) for name, seconds in sorted(self.phases.items())),
+                  'calls': calls}
+        if summary is not None:
+            report['summary'] = summary
+        return report
+
+    def write_json(self, path, summary=None):
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(self.report(summary), report_file, indent=2)
+
+    def prometheus(self, summary=None):
+        """The report in Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+        report = self.report(summary)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP ' + name + ' ' + help_text)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for key, label in labels)
+                lines.append(name + ('{' + label_text + '}' if label_text else '') + ' ' + repr(float(value)))
+
+        calls = report['calls']
+        metric('calendar_run_seconds', 'gauge', 'Wall time of the run.', [((), report['elapsed_seconds'])])
+        metric('calendar_phase_seconds', 'gauge', 'Time spent in each phase of the run.',
+               [((('phase', name),), seconds) for name, seconds in report['phases'].items()])
+        metric('calendar_api_requests_total', 'counter', 'HTTP requests sent, by API call.',
+               [((('call', kind),), stats['count']) for kind, stats in calls.items()])
+        metric('calendar_api_errors_total', 'counter', 'HTTP requests answered with an error status.',
+               [((('call', kind),), stats['errors']) for kind, stats in calls.items()])
+        metric('calendar_api_retries_total', 'counter', 'Retries after retryable errors.',
+               [((('call', kind),), stats['retries']) for kind, stats in calls.items()])
+        metric('calendar_api_backoff_seconds_total', 'counter', 'Time slept backing off before retries.',
+               [((('call', kind),), stats['sleep_seconds']) for kind, stats in calls.items()])
+        metric('calendar_api_bytes_total', 'counter', 'Request and response body bytes.',
+               [((('call', kind), ('direction', direction)), stats['bytes_' + direction])
+                for kind, stats in calls.items() for direction in ('sent', 'received')])
+        latency_samples = []
+        for kind, stats in calls.items():
+            for p in PERCENTILES:
+                latency_samples.append(((('call', kind), ('quantile', str(p / 100.0))),
+                                        stats['latency_seconds']['p' + str(p)]))
+        metric('calendar_api_latency_seconds', 'summary', 'HTTP request latency.', latency_samples)
+        for kind, stats in calls.items():
+            lines.append('calendar_api_latency_seconds_sum{call="%s"} %r' % (kind, float(stats['latency_seconds']['sum'])))
+            lines.append('calendar_api_latency_seconds_count{call="%s"} %r' % (kind, float(stats['count'])))
+        if summary:
+            metric('calendar_events_total', 'gauge', 'Events by outcome.',
+                   [((('outcome', key),), value) for key, value in summary.items()])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, summary=None):
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.prometheus(summary))
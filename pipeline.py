@@ -0,0 +1,222 @@
+"""Runs update_calendar_events over every (account, calendar, ruleset) entry of a manifest in parallel.
+
+Each entry runs in its own worker process with its account's credentials, so updating ten
+calendars takes about as long as the slowest one. An account's request quota is split
+between its entries, and one combined summary is printed at the end.
+
+Manifest format (see manifest.example.json):
+    {
+        "accounts": {"me@example.com": {"token": "tokens/me@example.com.json", "requests_per_second": 10}},
+        "calendars": [{"account": "me@example.com", "calendar": "NBC Sports", "rules": "rules.json"}]
+    }
+A calendar entry can name its calendar with "calendar" (resolved by name) or give "calendar_id".
+Two entries for the same calendar of the same account are rejected: their processes would patch
+and delete the same events at the same time.
+"""
+from __future__ import print_function
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os.path
+import time
+
+from googleapiclient.errors import HttpError
+
+from calendar_resolver import CalendarResolver
+from dispatcher import DEFAULT_REQUESTS_PER_SECOND, DEFAULT_WORKERS
+from deletion import DeletePolicy, DeletionJournal, DEFAULT_MAX_DELETIONS, JOURNAL_PATH
+from metrics import RunMetrics
+from retry_policy import RetryPolicy
+from rule_engine import DEFAULT_RULES_PATH
+import calendar_client
+import update_calendar_events
+
+MANIFEST_PATH = 'manifest.json'
+TOKENS_DIR = 'tokens'
+SUMMARY_KEYS = ('events', 'unchanged', 'updated', 'failed', 'deleted')
+
+
+def read_manifest(path=MANIFEST_PATH):
+    with open(path, encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    accounts = manifest.get('accounts', {})
+    entries = []
+    for index, entry in enumerate(manifest['calendars']):
+        if 'account' not in entry or not ('calendar' in entry or 'calendar_id' in entry):
+            raise ValueError("Manifest entry " + str(index) + " needs an account and a calendar or calendar_id")
+        account = accounts.get(entry['account'], {})
+        entries.append({
+            'index': index,
+            'account': entry['account'],
+            'calendar': entry.get('calendar'),
+            'calendar_id': entry.get('calendar_id'),
+            'rules': entry.get('rules', DEFAULT_RULES_PATH),
+            'token': account.get('token', os.path.join(TOKENS_DIR, entry['account'] + '.json')),
+            'requests_per_second': account.get('requests_per_second', DEFAULT_REQUESTS_PER_SECOND),
+        })
+    check_distinct_calendars(entries)
+    # Every account's quota is shared by all of its entries running at the same time
+    entries_per_account = {}
+    for entry in entries:
+        entries_per_account[entry['account']] = entries_per_account.get(entry['account'], 0) + 1
+    for entry in entries:
+        entry['requests_per_second'] = float(entry['requests_per_second']) / entries_per_account[entry['account']]
+    return entries
+
+
+def calendar_cache_path(account):
+    return '.calendar_cache.' + account + '.json'
+
+
+def check_distinct_calendars(entries):
+    """Raises ValueError if two entries of one account name the same calendar, by name or by calendar_id."""
+    seen = {}
+    for entry in entries:
+        keys = [(entry['account'], 'id', entry['calendar_id']), (entry['account'], 'name', entry['calendar'])]
+        for key in keys:
+            if key[2] is None:
+                continue
+            if key in seen and seen[key] != entry['index']:
+                raise ValueError("Manifest entries " + str(seen[key]) + " and " + str(entry['index']) +
+                                 " are both calendar " + str(key[2]) + " of " + entry['account'])
+            seen[key] = entry['index']
+
+
+def resolve_calendar_ids(entries):
+    """Looks up the calendar_id of every entry that names its calendar, one account at a time.
+
+    This runs in the parent process so entries given by name and by calendar_id can be checked
+    against each other, and so each account's calendar cache is written by a single process.
+    """
+    resolvers = {}
+    for entry in entries:
+        if entry['calendar_id']:
+            continue
+        if entry['account'] not in resolvers:
+            resolvers[entry['account']] = CalendarResolver(calendar_client.get_service(entry['token']),
+                                                           cache_path=calendar_cache_path(entry['account']))
+        try:
+            entry['calendar_id'] = resolvers[entry['account']].resolve(entry['calendar'])['id']
+        except LookupError:
+            # Left for the entry's worker, which reports it with the other results
+            pass
+    check_distinct_calendars(entries)
+
+
+def run_entry(entry, options):
+    """Runs in a worker process: sets update_calendar_events up for one entry and processes its calendar."""
+    started = time.time()
+    result = {'account': entry['account'], 'calendar': entry['calendar'] or entry['calendar_id'], 'error': None}
+    log = io.StringIO()
+    # Worker processes get reused, so every entry starts with fresh counters
+    update_calendar_events.metrics = RunMetrics()
+    update_calendar_events.retry_policy = RetryPolicy(metrics=update_calendar_events.metrics)
+    # Per-event output from parallel processes would be unreadable, so with --log-dir all of it goes to the entry's log file
+    handler = logging.StreamHandler(log)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(name)s: %(message)s'))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.DEBUG if options['log_dir'] else logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(log):
+            update_calendar_events.setup(entry['rules'], token_path=entry['token'],
+                                         calendar_cache_path=calendar_cache_path(entry['account']))
+            update_calendar_events.setup_dispatcher(options['workers'], entry['requests_per_second'])
+            update_calendar_events.delete_policy = DeletePolicy(options['delete_mode'], options['max_deletions'])
+            update_calendar_events.deletion_journal = DeletionJournal(options['journal'])
+            if entry['calendar_id']:
+                calendar = update_calendar_events.get_calendar_by_id(entry['calendar_id'])
+            else:
+                calendar = update_calendar_events.get_calendar_by_name(entry['calendar'])
+            result.update(update_calendar_events.execute_updates(calendar))
+    except (HttpError, LookupError, OSError, ValueError) as error:
+        result['error'] = str(error)
+    finally:
+        root_logger.removeHandler(handler)
+        if options['log_dir']:
+            log_path = os.path.join(options['log_dir'], entry['account'] + '.' + str(result['calendar']) + '.log')
+            with open(log_path, 'w', encoding='utf-8') as log_file:
+                log_file.write(log.getvalue())
+    result['retries'] = update_calendar_events.retry_policy.retries
+    result['seconds'] = time.time() - started
+    return result
+
+
+def print_summary(results, elapsed):
+    print("%-28s %-24s %7s %9s %7s %6s %7s %7s %8s" % (
+        'account', 'calendar', 'events', 'unchanged', 'updated', 'failed', 'deleted', 'retries', 'seconds'))
+    totals = dict((key, 0) for key in SUMMARY_KEYS + ('retries',))
+    for result in results:
+        if result['error']:
+            print("%-28s %-24s error: %s" % (result['account'], result['calendar'], result['error']))
+            continue
+        print("%-28s %-24s %7d %9d %7d %6d %7d %7d %8.1f" % (
+            result['account'], result['calendar'], result['events'], result['unchanged'], result['updated'],
+            result['failed'], result['deleted'], result['retries'], result['seconds']))
+        for key in totals:
+            totals[key] += result[key]
+    print("%-28s %-24s %7d %9d %7d %6d %7d %7d %8.1f" % (
+        'total', '', totals['events'], totals['unchanged'], totals['updated'], totals['failed'],
+        totals['deleted'], totals['retries'], elapsed))
+    slowest = max([result['seconds'] for result in results] or [0])
+    print("Wall time: %.1f seconds (slowest calendar: %.1f seconds)" % (elapsed, slowest))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', nargs='?', default=MANIFEST_PATH,
+                        help="JSON manifest of accounts and calendars (default: %(default)s)")
+    parser.add_argument('--processes', type=int,
+                        help="Worker processes to use (default: one per manifest entry)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="Concurrent batch requests inside each process (default: %(default)s)")
+    # Nobody can answer prompts from parallel processes, so there is no 'prompt' mode here
+    parser.add_argument('--delete-mode', choices=('dry-run', 'auto'), default='dry-run',
+                        help="How unwanted events are removed (default: %(default)s)")
+    parser.add_argument('--max-deletions', type=int, default=DEFAULT_MAX_DELETIONS,
+                        help="Per-calendar cap on deleted events (default: %(default)s)")
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help="JSON lines file recording every deleted event (default: %(default)s)")
+    parser.add_argument('--log-dir',
+                        help="Write each calendar's per-event output to a log file in this directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    entries = read_manifest(args.manifest)
+    if not entries:
+        print("No calendars in " + args.manifest)
+        return
+    # Log in to every account up front, one at a time, since the browser flow can't run in parallel
+    for token_path in sorted(set(entry['token'] for entry in entries)):
+        calendar_client.load_credentials(token_path)
+    resolve_calendar_ids(entries)
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+    options = {'workers': args.workers, 'delete_mode': args.delete_mode, 'max_deletions': args.max_deletions,
+               'journal': args.journal, 'log_dir': args.log_dir}
+
+    started = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.processes or len(entries)) as pool:
+        futures = dict((pool.submit(run_entry, entry, options), entry) for entry in entries)
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                # The worker process itself died; report it and keep the other calendars going
+                entry = futures[future]
+                result = {'account': entry['account'], 'calendar': entry['calendar'] or entry['calendar_id'],
+                          'error': repr(error), 'seconds': time.time() - started}
+            print("Finished " + str(result['calendar']) + " (" + result['account'] + ") in " +
+                  str(round(result['seconds'], 1)) + " seconds")
+            results.append(result)
+    print_summary(results, time.time() - started)
+
+
+if __name__ == '__main__':
+    main()
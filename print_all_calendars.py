@@ -1,57 +1,34 @@
 from __future__ import print_function
 
-import datetime
-import os.path
+import argparse
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-CREDENTIALS_DIR='credentials'
-
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
-
-
-def main():
-    """Shows basic usage of the Google Calendar API.
-    Prints the start and name of the next 10 events on the user's calendar.
-    """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_DIR + '/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+from calendar_mirror import CalendarMirror, DEFAULT_MIRROR_PATH, DEFAULT_MAX_AGE
+import calendar_client
 
-    try:
-        service = build('calendar', 'v3', credentials=creds)
 
-        page_token = None
-        while True:
-            calendar_list = service.calendarList().list(pageToken=page_token).execute()
-            for calendar_list_entry in calendar_list['items']:
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Print the name and id of every calendar in your calendar list")
+    parser.add_argument('--mirror', default=DEFAULT_MIRROR_PATH,
+                        help="SQLite file the calendar list is served from (default: %(default)s)")
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE,
+                        help="Fetch the list again if the mirror is older than this many seconds (default: %(default)s)")
+    parser.add_argument('--refresh', action='store_true', help="Fetch the calendar list again no matter how fresh it is")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Prints the name and id of every calendar in the user's calendar list."""
+    args = parse_args(argv)
+    try:
+        with CalendarMirror(calendar_client.get_service, args.mirror, args.max_age) as mirror:
+            for calendar_list_entry in mirror.calendars(refresh=args.refresh):
                 print (calendar_list_entry['summary'] + " " + calendar_list_entry['id'])
-            page_token = calendar_list.get('nextPageToken')
-            if not page_token:
-                break
 
     except HttpError as error:
         print('An error occurred: %s' % error)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,53 +1,42 @@
 from __future__ import print_function
 
+import argparse
 import datetime
-import os.path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-CREDENTIALS_DIR='credentials'
+from calendar_mirror import CalendarMirror, DEFAULT_MIRROR_PATH, DEFAULT_MAX_AGE
+import calendar_client
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Print the next events on your primary calendar")
+    parser.add_argument('--count', type=int, default=10, help="How many events to print (default: %(default)s)")
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat,
+                        help="Only events starting before this UTC date/time, e.g. 2022-02-21")
+    parser.add_argument('--query', help="Only events whose summary contains this text")
+    parser.add_argument('--mirror', default=DEFAULT_MIRROR_PATH,
+                        help="SQLite file the events are served from (default: %(default)s)")
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE,
+                        help="Sync the mirror first if it is older than this many seconds (default: %(default)s)")
+    parser.add_argument('--refresh', action='store_true', help="Throw the mirror away and fetch everything again")
+    return parser.parse_args(argv)
 
-def main():
+
+def main(argv=None):
     """Shows basic usage of the Google Calendar API.
     Prints the start and name of the next 10 events on the user's calendar.
     """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_DIR + '/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
+    args = parse_args(argv)
     try:
-        service = build('calendar', 'v3', credentials=creds)
-
-        # Call the Calendar API
         now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        print('Getting the upcoming 10 events')
-        
-        events_result = service.events().list(calendarId='primary', timeMin=now,
-                                              maxResults=10, singleEvents=True,
-                                              orderBy='startTime').execute()
-        events = events_result.get('items', [])
+        until = args.until.isoformat() + 'Z' if args.until else None
+        print('Getting the upcoming ' + str(args.count) + ' events')
+
+        # Served from the local mirror, which only calls the API when it is older than --max-age
+        with CalendarMirror(calendar_client.get_service, args.mirror, args.max_age, sync_from=now) as mirror:
+            events = mirror.events('primary', time_min=now, time_max=until, text=args.query, limit=args.count,
+                                   refresh=args.refresh)
 
         if not events:
             print('No upcoming events found.')
@@ -63,4 +52,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+from __future__ import print_function
+from email.utils import parsedate_to_datetime
+import asyncio
+import datetime
+import logging
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from metrics import request_kind
+
+log = logging.getLogger(__name__)
+
+# Ref: https://developers.google.com/calendar/api/guides/errors
+# Ref: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+DEFAULT_MAX_ATTEMPTS = 7
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 32.0
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def _error_reasons(error):
+    details = error.error_details if isinstance(error.error_details, list) else []
+    return [detail.get('reason') for detail in details if isinstance(detail, dict)]
+
+
+def is_rate_limit_error(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+    return any(reason in RATE_LIMIT_REASONS for reason in _error_reasons(error)) or 'Rate Limit Exceeded' in str(error.reason)
+
+
+def is_precondition_failed(error):
+    """A write sent with If-Match whose event changed since it was fetched."""
+    return isinstance(error, HttpError) and error.resp.status == 412
+
+
+def is_not_modified(error):
+    """A read sent with If-None-Match whose resource hasn't changed; googleapiclient raises these as errors."""
+    return isinstance(error, HttpError) and error.resp.status == 304
+
+
+def is_retryable_error(error):
+    """403 rate limits, 429 and 5xx responses are worth retrying, as are dropped connections and timeouts."""
+    if isinstance(error, HttpError):
+        return is_rate_limit_error(error) or error.resp.status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry_after_seconds(error):
+    """Returns how long the server asked us to wait in its Retry-After header, or None."""
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class RetryPolicy(object):
+    """Capped exponential backoff with full jitter, shared by every read and write call.
+
+    The n-th retry sleeps a random time between 0 and min(max_delay, base_delay * 2**n), or as
+    long as the server's Retry-After header asks if that is longer. Counters are updated under
+    a lock so one policy can be shared by the dispatcher's worker threads. With a RunMetrics,
+    retries and backoff time are also recorded per call type.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 sleep=time.sleep, rng=random.random, metrics=None):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.give_ups = 0
+        self.sleep_seconds = 0.0
+
+    def is_retryable(self, error):
+        return is_retryable_error(error)
+
+    def backoff(self, retry_number, error=None):
+        """Seconds to wait before retry number `retry_number` (starting at 0)."""
+        delay = self.rng() * min(self.max_delay, self.base_delay * 2**retry_number)
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def record(self, calls=0, retries=0, give_ups=0, sleep_seconds=0.0):
+        with self.lock:
+            self.calls += calls
+            self.retries += retries
+            self.give_ups += give_ups
+            self.sleep_seconds += sleep_seconds
+
+    def _record_wait(self, retry_number, error, kind):
+        delay = self.backoff(retry_number, error)
+        self.record(retries=1, sleep_seconds=delay)
+        if self.metrics is not None:
+            self.metrics.record_retry(kind, delay)
+        return delay
+
+    def wait(self, retry_number, error=None, kind='request'):
+        delay = self._record_wait(retry_number, error, kind)
+        self.sleep(delay)
+        return delay
+
+    async def wait_async(self, retry_number, error=None, kind='request'):
+        """Like wait, but lets the event loop run other requests during the backoff."""
+        delay = self._record_wait(retry_number, error, kind)
+        await asyncio.sleep(delay)
+        return delay
+
+    def call(self, function, description='request', kind='request'):
+        """Calls function() until it succeeds, raising the last error once it isn't retryable or attempts run out."""
+        attempt = 0
+        while True:
+            self.record(calls=1)
+            try:
+                return function()
+            except Exception as e:
+                attempt += 1
+                if not self.is_retryable(e) or attempt >= self.max_attempts:
+                    if self.is_retryable(e):
+                        self.record(give_ups=1)
+                        log.warning("Giving up on %s after %d attempts", description, attempt)
+                    raise
+                delay = self.wait(attempt - 1, e, kind)
+                log.warning("Retrying %s in %.2f seconds (%s)", description, delay, e)
+
+    async def call_async(self, function, description='request', kind='request'):
+        """call() for coroutines: awaits function() until it succeeds, with the same retry rules."""
+        attempt = 0
+        while True:
+            self.record(calls=1)
+            try:
+                return await function()
+            except Exception as e:
+                attempt += 1
+                if not self.is_retryable(e) or attempt >= self.max_attempts:
+                    if self.is_retryable(e):
+                        self.record(give_ups=1)
+                        log.warning("Giving up on %s after %d attempts", description, attempt)
+                    raise
+                delay = await self.wait_async(attempt - 1, e, kind)
+                log.warning("Retrying %s in %.2f seconds (%s)", description, delay, e)
+
+    def execute(self, request, description='request', **kwargs):
+        """Executes a googleapiclient request under this policy."""
+        return self.call(lambda: request.execute(**kwargs), description, request_kind(request))
+
+    def summary(self):
+        return ("Requests: " + str(self.calls) + ", retries: " + str(self.retries) + ", gave up: " + str(self.give_ups) +
+                ", time spent backing off: " + str(round(self.sleep_seconds, 2)) + " seconds")
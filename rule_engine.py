@@ -0,0 +1,139 @@
+from __future__ import print_function
+import json
+import re
+
+DEFAULT_RULES_PATH = 'rules.json'
+
+
+class Rule(object):
+    """One entry of the rule file: when its patterns match a summary, the actions are applied in file order.
+
+    A rule matches when at least one of its 'any' patterns, every one of its 'all' patterns and
+    none of its 'none' patterns are found in the summary. A rule with no patterns matches every event.
+    Patterns are regular expressions searched for anywhere in the first line of the summary, the
+    same as re.match(".*<pattern>.*"). Use scoped flags like (?i:Round Robin), not a leading (?i).
+    """
+
+    def __init__(self, name, any=(), all=(), none=(), color=None, reset_notifications=False, add_notifications=()):
+        self.name = name
+        self.any = tuple(any)
+        self.all = tuple(all)
+        self.none = tuple(none)
+        self.color = color
+        self.reset_notifications = reset_notifications
+        self.add_notifications = list(add_notifications)
+
+    @classmethod
+    def from_dict(cls, data):
+        unknown = set(data) - {'name', 'any', 'all', 'none', 'color', 'reset_notifications', 'add_notifications'}
+        if unknown:
+            raise ValueError("Unknown keys in rule " + repr(data.get('name')) + ": " + ", ".join(sorted(unknown)))
+        return cls(**data)
+
+    def __repr__(self):
+        return 'Rule(%r)' % self.name
+
+
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+def _is_literal(pattern):
+    return not REGEX_METACHARACTERS.intersection(pattern)
+
+
+def _can_overlap(first, second):
+    """True if the two literals can be found at overlapping places in some summary."""
+    if first in second or second in first:
+        return True
+    return any(second.startswith(first[-length:]) or first.startswith(second[-length:])
+               for length in range(1, min(len(first), len(second))))
+
+
+class RuleSet(object):
+    """Rules compiled into matchers so each summary is classified in a single pass per matcher.
+
+    Plain-text patterns are joined into one alternation, which re scans with its first-character
+    prefilter; since no two of them can overlap, finditer finds every one present. The other
+    patterns are named groups of a second alternation: nothing can match before its first match,
+    so only from there on are the remaining patterns searched for one by one. A pattern shared
+    by several rules is only evaluated once.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._pattern_indexes = {}
+        patterns = []
+        for rule in self.rules:
+            for pattern in rule.any + rule.all + rule.none:
+                if pattern not in self._pattern_indexes:
+                    self._pattern_indexes[pattern] = len(patterns)
+                    patterns.append(pattern)
+        literals = [pattern for pattern in patterns if _is_literal(pattern)]
+        if any(_can_overlap(first, second) for index, first in enumerate(literals) for second in literals[index + 1:]):
+            literals = []
+        self._literal_indexes = dict((literal, self._pattern_indexes[literal]) for literal in literals)
+        self._literal_matcher = re.compile('|'.join(literals)) if literals else None
+        others = [pattern for pattern in patterns if pattern not in self._literal_indexes]
+        self._other_patterns = [(self._pattern_indexes[pattern], re.compile(pattern)) for pattern in others]
+        self._other_groups = dict(('_pattern_%d' % position, position) for position in range(len(others)))
+        self._other_matcher = re.compile('|'.join(
+            '(?P<_pattern_%d>%s)' % (position, pattern) for position, pattern in enumerate(others))) if others else None
+        self._compiled_rules = [
+            (rule,
+             [self._pattern_indexes[pattern] for pattern in rule.any],
+             [self._pattern_indexes[pattern] for pattern in rule.all],
+             [self._pattern_indexes[pattern] for pattern in rule.none])
+            for rule in self.rules]
+        self._matched_rules = {}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def matching_rules(self, summary):
+        """Returns the rules that apply to a summary, in the order they appear in the rule file."""
+        # The set of patterns found is the cache key: the rules are evaluated once per combination
+        found = self._find_patterns(summary or '')
+        matched = self._matched_rules.get(found)
+        if matched is None:
+            matched = self._matched_rules[found] = self._evaluate(found)
+        return matched
+
+    def _find_patterns(self, summary):
+        # Patterns only ever applied to the first line, like re.match(".*<pattern>.*")
+        line = summary.partition('\n')[0]
+        found = set()
+        if self._literal_matcher is not None:
+            for match in self._literal_matcher.finditer(line):
+                found.add(self._literal_indexes[match.group()])
+        match = self._other_matcher.search(line) if self._other_matcher is not None else None
+        if match is not None:
+            position = self._other_groups[match.lastgroup]
+            # None of the patterns matches before this point, but any of them may match from here on,
+            # including inside the part of the summary the alternation consumed
+            for other_position, (index, pattern) in enumerate(self._other_patterns):
+                if other_position == position or pattern.search(line, match.start()):
+                    found.add(index)
+        return frozenset(found)
+
+    def _evaluate(self, found):
+        matched = []
+        for rule, any_patterns, all_patterns, none_patterns in self._compiled_rules:
+            if any_patterns and not any(pattern in found for pattern in any_patterns):
+                continue
+            if not all(pattern in found for pattern in all_patterns):
+                continue
+            if any(pattern in found for pattern in none_patterns):
+                continue
+            matched.append(rule)
+        return tuple(matched)
+
+    def validate_colors(self, colors):
+        for rule in self.rules:
+            if rule.color is not None and rule.color not in colors:
+                raise ValueError("Rule " + repr(rule.name) + " uses unknown color: " + rule.color)
+
+
+def load_rules(path=DEFAULT_RULES_PATH):
+    with open(path, encoding='utf-8') as rules_file:
+        data = json.load(rules_file)
+    return RuleSet(Rule.from_dict(rule) for rule in data['rules'])
@@ -0,0 +1,117 @@
+from __future__ import print_function
+import heapq
+import queue
+import threading
+
+from event_store import utc_timestamp
+
+
+
+def time_windows(start, end, count):
+    """Splits [start, end) into `count` back-to-back (start, end) windows of equal length."""
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    if end <= start:
+        raise ValueError("end must be after start")
+    step = (end - start) / count
+    bounds = [start + step * index for index in range(count)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def event_start(event):
+    value = event.get('start') or {}
+    return utc_timestamp(value.get('dateTime', value.get('date')))
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def prefetched(produce, depth=0):
+    """Returns an iterator over produce(), which runs on a thread of its own at most `depth` items ahead (0: no limit).
+
+    An error raised on the thread is raised by the iterator. Closing it stops the thread before
+    its next item.
+    """
+    items = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in produce():
+                if not put(item):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(_Failure(e))
+
+    def consume():
+        try:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+
+    # Started right away rather than on the first next(), which the merge only gets to once the earlier
+    # windows have delivered something
+    threading.Thread(target=run, daemon=True).start()
+    return consume()
+
+
+def _owned_events(pages, window_start, first):
+    # The API returns every event overlapping a window, so one that started in an earlier window shows up again
+    # here; it belongs to the window holding its start. The first window also keeps events that started before
+    # it, the same ones an unsharded listing returns. All-day events are placed by the calendar's time zone, which
+    # a bare date doesn't tell, so they are kept by every window that returns them and the merge takes the first.
+    window_start = utc_timestamp(window_start.isoformat())
+    try:
+        for page in pages:
+            for event in page:
+                if first or 'date' in (event.get('start') or {}) or event_start(event) >= window_start:
+                    yield event
+    finally:
+        pages.close()
+
+
+def sharded_events(fetch_window, windows):
+    """Fetches every window at once and yields their events merged back into start time order.
+
+    fetch_window(time_min, time_max) is called on a thread per window and has to yield pages (lists)
+    of the events overlapping that window in start time order. An event is taken from the window its
+    start falls in, an all-day event from the first window that returned it, and an id that has
+    already been yielded is skipped, in case an event moved between windows while they were being
+    fetched.
+
+    The merge reads the windows one after another, so each window's pages are buffered without a
+    limit: a later window is fully fetched while the earlier ones are read, never held back by them.
+    """
+    streams = [_owned_events(prefetched(lambda window=window: fetch_window(*window)), window[0], index == 0)
+               for index, window in enumerate(windows)]
+    seen = set()
+    try:
+        for event in heapq.merge(*streams, key=event_start):
+            if event['id'] in seen:
+                continue
+            seen.add(event['id'])
+            yield event
+    finally:
+        for stream in streams:
+            stream.close()
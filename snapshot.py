@@ -0,0 +1,69 @@
+from __future__ import print_function
+import datetime
+import gzip
+import json
+import os
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotWriter(object):
+    """Writes a calendar snapshot: gzip-compressed JSON lines with a header line and then one event per line.
+
+    Events are written as they are handed over, so a snapshot of any size is taken in constant
+    memory. Like a change plan it goes to a temporary file first and is only moved into place
+    once complete.
+    """
+
+    def __init__(self, path, calendar, params=None):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.header = {'snapshot': SNAPSHOT_VERSION, 'taken': datetime.datetime.utcnow().isoformat() + 'Z',
+                       'calendarId': calendar.get('id'), 'summary': calendar.get('summary'), 'params': params or {}}
+        self.events = 0
+        self.file = gzip.open(self.temp_path, 'wt', encoding='utf-8')
+        self._write(self.header)
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def add(self, event):
+        self._write(event)
+        self.events += 1
+
+    def close(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _check_header(path, header):
+    if header.get('snapshot') != SNAPSHOT_VERSION:
+        raise ValueError(path + " is not a version " + str(SNAPSHOT_VERSION) + " calendar snapshot")
+    return header
+
+
+def read_snapshot_header(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as snapshot_file:
+        return _check_header(path, json.loads(snapshot_file.readline()))
+
+
+def read_snapshot(path):
+    """Generator over the events in a snapshot, in the order they were listed, reading one line at a time."""
+    with gzip.open(path, 'rt', encoding='utf-8') as snapshot_file:
+        _check_header(path, json.loads(snapshot_file.readline()))
+        for line in snapshot_file:
+            if line.strip():
+                yield json.loads(line)
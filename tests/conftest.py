@@ -0,0 +1,64 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+# The scripts are top-level modules and the fake API lives with the benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from googleapiclient.discovery import build
+
+from deletion import DeletePolicy, DeletionJournal
+from dispatcher import Dispatcher, TokenBucket
+from fake_calendar import FakeCalendarBackend, FakeHttp
+from retry_policy import RetryPolicy
+from synthetic import synthetic_events
+import update_calendar_events
+
+RULES_PATH = os.path.join(ROOT, 'rules.json')
+
+
+class FakeCalendar(object):
+    """One calendar on a fake backend, and a service that talks to it."""
+
+    def __init__(self, events, calendar_id='test-calendar', name='Test', requests_per_second=None):
+        self.id = calendar_id
+        self.name = name
+        self.backend = FakeCalendarBackend(requests_per_second=requests_per_second)
+        self.backend.add_calendar(calendar_id, name, events)
+        self.service = build('calendar', 'v3', http=FakeHttp(self.backend), static_discovery=True)
+
+    def info(self):
+        """The calendar as the scripts get it from get_calendar_by_name."""
+        return {'id': self.id, 'summary': self.name}
+
+
+@pytest.fixture
+def fake_calendar():
+    """Makes a FakeCalendar of event_count timed events with ids evt0, evt1, ..."""
+    def make(event_count, requests_per_second=None):
+        events = [{'id': 'evt%d' % index, 'summary': 'Event %d' % index, 'status': 'confirmed',
+                   'start': {'dateTime': '2022-02-05T10:00:00Z'}, 'end': {'dateTime': '2022-02-05T11:00:00Z'}}
+                  for index in range(event_count)]
+        return FakeCalendar(events, requests_per_second=requests_per_second)
+    return make
+
+
+@pytest.fixture
+def olympic_calendar(tmp_path):
+    """A fake Olympics calendar of synthetic events, wired into update_calendar_events with the repo's rules."""
+    start = update_calendar_events.EVENTS_START_DATE + datetime.timedelta(days=1)
+    calendar = FakeCalendar(synthetic_events(60, start=start), update_calendar_events.OLYMPIC_CALENDAR_ID,
+                            update_calendar_events.OLYMPIC_CALENDAR_NAME)
+    update_calendar_events.service = calendar.service
+    update_calendar_events.dispatcher = Dispatcher(workers=2, limiter=TokenBucket(10000),
+                                                   http_factory=lambda: FakeHttp(calendar.backend))
+    update_calendar_events.retry_policy = RetryPolicy(base_delay=0.01, max_delay=0.05)
+    update_calendar_events.delete_policy = DeletePolicy('auto', None)
+    update_calendar_events.deletion_journal = DeletionJournal(str(tmp_path / 'deletions.jsonl'))
+    update_calendar_events.initialize_colors()
+    update_calendar_events.load_rule_set(RULES_PATH)
+    return calendar
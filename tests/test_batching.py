@@ -0,0 +1,85 @@
+from batching import BatchWriter, BatchResult, PendingWrite, settle_lost_batch
+from fake_calendar import FakeError
+from retry_policy import RetryPolicy
+
+
+def make_writer(calendar, batch_size=10, max_attempts=3):
+    sleeps = []
+    policy = RetryPolicy(max_attempts=max_attempts, sleep=sleeps.append, rng=lambda: 0.0)
+    return BatchWriter(calendar.service, calendar.id, batch_size=batch_size, policy=policy), sleeps
+
+
+def fail_first_attempts(backend, failing_ids, status=503, reason='backendError', times=1):
+    """Makes patches of the given events fail `times` times before going through; returns each event's attempts."""
+    attempts = {}
+    event_call = backend._event_call
+
+    def flaky_event_call(calendar_id, event_id, method, query, body, headers):
+        attempts[event_id] = attempts.get(event_id, 0) + 1
+        if event_id in failing_ids and attempts[event_id] <= times:
+            raise FakeError(status, reason, 'Injected failure')
+        return event_call(calendar_id, event_id, method, query, body, headers)
+
+    backend._event_call = flaky_event_call
+    return attempts
+
+
+def test_only_failed_parts_are_sent_again(fake_calendar):
+    calendar = fake_calendar(10)
+    backend = calendar.backend
+    writer, sleeps = make_writer(calendar)
+    attempts = fail_first_attempts(backend, {'evt2', 'evt7'})
+    for index in range(10):
+        writer.add_patch('evt%d' % index, {'colorId': '8'}, 'Event %d' % index)
+
+    result = writer.flush()
+
+    assert len(result.succeeded) == 10
+    assert result.failed == []
+    assert attempts == dict(('evt%d' % index, 2 if index in (2, 7) else 1) for index in range(10))
+    assert backend.batch_requests == 2
+    assert len(sleeps) == 1
+    assert all(backend.event(calendar.id, 'evt%d' % index)['colorId'] == '8' for index in range(10))
+    assert writer.policy.calls == 12
+
+
+def test_parts_that_keep_failing_give_up_after_max_attempts(fake_calendar):
+    calendar = fake_calendar(4)
+    writer, _ = make_writer(calendar, max_attempts=2)
+    attempts = fail_first_attempts(calendar.backend, {'evt1'}, times=5)
+    for index in range(4):
+        writer.add_patch('evt%d' % index, {'colorId': '8'})
+
+    result = writer.flush()
+
+    assert [write.event_id for write in result.failed] == ['evt1']
+    assert len(result.succeeded) == 3
+    assert attempts['evt1'] == 2
+    assert writer.policy.give_ups == 1
+
+
+def test_permanent_errors_are_not_retried(fake_calendar):
+    calendar = fake_calendar(3)
+    writer, sleeps = make_writer(calendar)
+    attempts = fail_first_attempts(calendar.backend, {'evt0'}, status=400, reason='invalid')
+    for index in range(3):
+        writer.add_patch('evt%d' % index, {'colorId': '8'})
+
+    result = writer.flush()
+
+    assert [write.event_id for write in result.failed] == ['evt0']
+    assert attempts['evt0'] == 1
+    assert sleeps == []
+
+
+def test_lost_batch_that_gives_up_is_counted():
+    policy = RetryPolicy(max_attempts=1)
+    writes = [PendingWrite('patch', 'evt%d' % index) for index in range(3)]
+    result = BatchResult()
+    retry = []
+
+    settle_lost_batch(writes, ConnectionError('reset'), policy, result, retry)
+
+    assert retry == []
+    assert len(result.failed) == 3
+    assert policy.give_ups == 3
@@ -0,0 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from deletion import DeletionJournal
+
+RUNS = 8
+EVENTS_PER_RUN = 200
+RECORDS_PER_RUN = 10
+
+
+def record_deletions(path, calendar_id):
+    journal = DeletionJournal(path)
+    # Far more than one buffer's worth of lines per call
+    events = [{'id': '%s-%d' % (calendar_id, index), 'summary': 'Event %d' % index, 'description': 'x' * 150}
+              for index in range(EVENTS_PER_RUN)]
+    for _ in range(RECORDS_PER_RUN):
+        journal.record(calendar_id, events)
+    return journal.run_id
+
+
+def test_parallel_runs_sharing_a_journal_append_each_call_whole(tmp_path):
+    path = str(tmp_path / 'deletions.jsonl')
+    with ProcessPoolExecutor(max_workers=RUNS) as pool:
+        run_ids = list(pool.map(record_deletions, [path] * RUNS, ['calendar%d' % index for index in range(RUNS)]))
+
+    journal = DeletionJournal(path)
+    entries = list(journal.entries())
+    assert len(entries) == RUNS * EVENTS_PER_RUN * RECORDS_PER_RUN
+    # Each record() call's lines are in the file together, not mixed with another run's
+    for start in range(0, len(entries), EVENTS_PER_RUN):
+        assert len(set(entry['run'] for entry in entries[start:start + EVENTS_PER_RUN])) == 1
+    for index, run_id in enumerate(run_ids):
+        run_entries = journal.entries_for_run(run_id)
+        assert len(run_entries) == EVENTS_PER_RUN * RECORDS_PER_RUN
+        assert set(entry['calendarId'] for entry in run_entries) == {'calendar%d' % index}
+
+
+def test_nothing_to_record_leaves_no_journal(tmp_path):
+    journal = DeletionJournal(str(tmp_path / 'deletions.jsonl'))
+    journal.record('calendar', [])
+    assert list(journal.entries()) == []
+    assert journal.last_run_id() is None
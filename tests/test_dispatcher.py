@@ -0,0 +1,132 @@
+from batching import BatchWriter
+from dispatcher import Dispatcher, TokenBucket
+from fake_calendar import FakeHttp
+from retry_policy import RetryPolicy
+
+
+class FakeClock(object):
+    """A clock that only moves when the bucket sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class DroppingHttp(FakeHttp):
+    """A connection that is reset on its first request, like a worker whose socket died."""
+
+    def __init__(self, backend, error):
+        FakeHttp.__init__(self, backend)
+        self.error = error
+        self.used = False
+
+    def request(self, *args, **kwargs):
+        if not self.used:
+            self.used = True
+            raise self.error
+        return FakeHttp.request(self, *args, **kwargs)
+
+
+def queue_patches(writer, event_count):
+    for index in range(event_count):
+        writer.add_patch('evt%d' % index, {'colorId': '8'}, 'Event %d' % index)
+
+
+def test_bucket_lets_a_burst_through_then_paces_at_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=5, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(25)]
+
+    assert waits[:5] == [0.0] * 5
+    assert all(abs(wait - 0.1) < 1e-9 for wait in waits[5:])
+    # 20 requests past the burst at 10 per second
+    assert abs(clock.now - 2.0) < 1e-9
+
+
+def test_bucket_refills_while_idle_but_not_past_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=5, clock=clock, sleep=clock.sleep)
+    bucket.acquire(5)
+
+    clock.now += 60
+    assert bucket.acquire(5) == 0.0
+    assert abs(bucket.acquire() - 0.1) < 1e-9
+
+
+def test_request_bigger_than_the_bucket_waits_for_a_full_bucket_and_goes_into_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=5, clock=clock, sleep=clock.sleep)
+    bucket.acquire(5)
+
+    # A 50-part batch on a 5-token bucket goes out once the bucket is full again
+    assert abs(bucket.acquire(50) - 0.5) < 1e-9
+    # and the 45 tokens it overdrew are paid back before anything else is sent
+    assert abs(bucket.acquire() - 4.6) < 1e-9
+
+
+def test_dispatched_batches_stay_under_the_server_quota(fake_calendar):
+    calendar = fake_calendar(200, requests_per_second=100)
+    backend = calendar.backend
+    dispatcher = Dispatcher(workers=4, limiter=TokenBucket(90, capacity=20), http_factory=lambda: FakeHttp(backend))
+    writer = BatchWriter(calendar.service, calendar.id, batch_size=20, policy=RetryPolicy(base_delay=0.01))
+    queue_patches(writer, 200)
+
+    result = writer.flush(dispatcher)
+
+    assert len(result.succeeded) == 200
+    assert backend.rate_limited == 0
+    assert backend.calls == {'events.patch': 200}
+    assert writer.policy.retries == 0
+
+
+def test_batch_on_a_dead_worker_is_settled_and_sent_again(fake_calendar):
+    calendar = fake_calendar(40)
+    backend = calendar.backend
+    connections = []
+
+    def new_http():
+        # Only the first connection dies
+        http = DroppingHttp(backend, ConnectionError('connection reset')) if not connections else FakeHttp(backend)
+        connections.append(http)
+        return http
+
+    dispatcher = Dispatcher(workers=1, http_factory=new_http)
+    policy = RetryPolicy(sleep=lambda seconds: None)
+    writer = BatchWriter(calendar.service, calendar.id, batch_size=20, policy=policy)
+    queue_patches(writer, 40)
+
+    result = writer.flush(dispatcher)
+
+    assert len(result.succeeded) == 40
+    assert result.failed == []
+    # The lost batch's writes were sent once more, and the dead connection was replaced rather than reused
+    assert backend.calls == {'events.patch': 40}
+    assert len(connections) > 1
+    assert [type(http) for http in connections].count(DroppingHttp) == 1
+    assert sorted(write.attempts for write in result.succeeded) == [1] * 20 + [2] * 20
+    assert policy.retries == 1
+
+
+def test_batch_lost_to_a_permanent_error_fails_its_writes(fake_calendar):
+    calendar = fake_calendar(10)
+    backend = calendar.backend
+    dispatcher = Dispatcher(workers=2, http_factory=lambda: DroppingHttp(backend, ValueError('bad request')))
+    policy = RetryPolicy(sleep=lambda seconds: None)
+    writer = BatchWriter(calendar.service, calendar.id, batch_size=5, policy=policy)
+    queue_patches(writer, 10)
+
+    result = writer.flush(dispatcher)
+
+    assert result.succeeded == []
+    assert len(result.failed) == 10
+    assert all(isinstance(write.error, ValueError) for write in result.failed)
+    assert backend.calls == {}
+    assert policy.give_ups == 0
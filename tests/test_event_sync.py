@@ -0,0 +1,61 @@
+import pytest
+
+from deletion import DeletePolicy
+from event_store import EventStore
+from fake_calendar import FakeError
+from retry_policy import RetryPolicy
+import update_calendar_events
+
+
+@pytest.fixture
+def calendar(olympic_calendar, tmp_path):
+    """The fake Olympics calendar with patches failing while failing['patches'] is set, and a store."""
+    backend = olympic_calendar.backend
+    failing = {'patches': True}
+    event_call = backend._event_call
+
+    def failing_event_call(calendar_id, event_id, method, query, body, headers):
+        if method == 'PATCH' and failing['patches']:
+            raise FakeError(503, 'backendError', 'Injected failure')
+        return event_call(calendar_id, event_id, method, query, body, headers)
+
+    backend._event_call = failing_event_call
+    update_calendar_events.retry_policy = RetryPolicy(max_attempts=2, sleep=lambda seconds: None)
+    update_calendar_events.delete_policy = DeletePolicy('dry-run', None)
+    with EventStore(str(tmp_path / 'events.db')) as store:
+        yield olympic_calendar.info(), store, failing
+
+
+def test_failed_patches_are_retried_by_the_next_incremental_run(calendar):
+    calendar_info, store, failing = calendar
+    first = update_calendar_events.execute_updates(calendar_info, store)
+    assert first['failed'] > 0
+    assert first['updated'] == 0
+
+    failing['patches'] = False
+    second = update_calendar_events.execute_updates(calendar_info, store)
+    assert second['failed'] == 0
+    assert second['updated'] == first['failed']
+
+    # The run's own patches come back in the delta once, and then there is nothing left to do
+    update_calendar_events.execute_updates(calendar_info, store)
+    fourth = update_calendar_events.execute_updates(calendar_info, store)
+    assert fourth['events'] == 0
+
+
+def test_unwanted_events_that_were_not_deleted_come_back(calendar):
+    calendar_info, store, failing = calendar
+    failing['patches'] = False
+    first = update_calendar_events.execute_updates(calendar_info, store)
+    assert first['unwanted'] > 0
+    assert first['deleted'] == 0
+
+    # Still there on the next incremental run, so switching to auto deletes them
+    update_calendar_events.delete_policy = DeletePolicy('auto', None)
+    second = update_calendar_events.execute_updates(calendar_info, store)
+    assert second['unwanted'] == first['unwanted']
+    assert second['deleted'] == first['unwanted']
+
+    third = update_calendar_events.execute_updates(calendar_info, store)
+    assert third['unwanted'] == 0
+    assert store.get_pending_ids(calendar_info['id']) == set()
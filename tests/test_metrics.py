@@ -0,0 +1,17 @@
+from metrics import percentile
+
+
+def test_percentile_is_the_nearest_rank():
+    assert percentile([1, 2], 50) == 1
+    assert percentile([1, 2, 3], 50) == 2
+    assert percentile(list(range(1, 7)), 50) == 3
+    assert percentile(list(range(1, 11)), 90) == 9
+    assert percentile(list(range(1, 11)), 99) == 10
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_percentile_edges():
+    assert percentile([], 50) == 0.0
+    assert percentile([7], 99) == 7
+    assert percentile([1, 2, 3], 0) == 1
+    assert percentile([1, 2, 3], 100) == 3
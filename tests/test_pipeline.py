@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+import pipeline
+
+CALENDAR_ID = 'icn02kf62d26hurpro3qksjhjc@group.calendar.google.com'
+
+
+def write_manifest(tmp_path, calendars):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({'accounts': {'me@example.com': {'token': 'token.json'}}, 'calendars': calendars}))
+    return str(path)
+
+
+def test_same_calendar_twice_is_rejected(tmp_path):
+    by_name = {'account': 'me@example.com', 'calendar': 'NBC Sports'}
+    by_id = {'account': 'me@example.com', 'calendar_id': CALENDAR_ID}
+    with pytest.raises(ValueError):
+        pipeline.read_manifest(write_manifest(tmp_path, [by_name, dict(by_name, rules='other.json')]))
+    with pytest.raises(ValueError):
+        pipeline.read_manifest(write_manifest(tmp_path, [by_id, by_id]))
+
+
+def test_name_and_id_of_the_same_calendar_are_rejected_once_resolved(tmp_path, monkeypatch):
+    entries = pipeline.read_manifest(write_manifest(tmp_path, [
+        {'account': 'me@example.com', 'calendar': 'NBC Sports'},
+        {'account': 'me@example.com', 'calendar_id': CALENDAR_ID},
+    ]))
+
+    class Resolver(object):
+        def __init__(self, service, cache_path):
+            pass
+
+        def resolve(self, name):
+            return {'id': CALENDAR_ID, 'summary': name}
+
+    monkeypatch.setattr(pipeline.calendar_client, 'get_service', lambda token_path: None)
+    monkeypatch.setattr(pipeline, 'CalendarResolver', Resolver)
+    with pytest.raises(ValueError):
+        pipeline.resolve_calendar_ids(entries)
+
+
+def test_example_manifest_has_distinct_calendars():
+    entries = pipeline.read_manifest(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'manifest.example.json'))
+    assert len(entries) == 2
@@ -0,0 +1,48 @@
+import os
+import re
+
+from rule_engine import Rule, RuleSet, load_rules
+from synthetic import synthetic_events
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rules.json')
+
+
+def searched_rules(rule_set, summary):
+    """What the rules match when every pattern is searched for on its own."""
+    line = summary.split('\n')[0]
+    matched = []
+    for rule in rule_set.rules:
+        if rule.any and not any(re.search(pattern, line) for pattern in rule.any):
+            continue
+        if not all(re.search(pattern, line) for pattern in rule.all):
+            continue
+        if any(re.search(pattern, line) for pattern in rule.none):
+            continue
+        matched.append(rule)
+    return tuple(matched)
+
+
+def names(rules):
+    return [rule.name for rule in rules]
+
+
+def test_rule_file_matches_the_same_as_searching_each_pattern():
+    rule_set = load_rules(RULES_PATH)
+    for event in synthetic_events(5000):
+        assert names(rule_set.matching_rules(event['summary'])) == names(searched_rules(rule_set, event['summary']))
+
+
+def test_overlapping_patterns_are_all_found():
+    rule_set = RuleSet([Rule('a', any=['USA']), Rule('b', any=['SA Cur']), Rule('c', any=['(?i:usa curling)']),
+                        Rule('d', all=['U[A-Z]+', 'S.'])])
+    summaries = ['USA Curling', 'Curling: USA', 'usa curling', 'JPN vs. USA Curling Final', '']
+    for summary in summaries:
+        assert names(rule_set.matching_rules(summary)) == names(searched_rules(rule_set, summary))
+    assert names(rule_set.matching_rules('USA Curling')) == ['a', 'b', 'c', 'd']
+
+
+def test_patterns_only_apply_to_the_first_line():
+    rule_set = RuleSet([Rule('hockey', any=['Hockey']), Rule('men', any=["(?i:men's)"])])
+    assert rule_set.matching_rules('Curling\nHockey') == ()
+    assert names(rule_set.matching_rules("Hockey\nMen's")) == ['hockey']
+    assert names(rule_set.matching_rules(None)) == []
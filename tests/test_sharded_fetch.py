@@ -0,0 +1,59 @@
+import datetime
+
+from sharded_fetch import sharded_events, time_windows
+
+NEW_YORK = datetime.timezone(datetime.timedelta(hours=-5))
+
+
+def utc(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def listed_range(event, time_zone):
+    """Where the API places an event: all-day events start and end at midnight in the calendar's time zone."""
+    times = []
+    for key in ('start', 'end'):
+        if 'date' in event[key]:
+            times.append(datetime.datetime.fromisoformat(event[key]['date']).replace(tzinfo=time_zone))
+        else:
+            times.append(utc(event[key]['dateTime']))
+    return times
+
+
+def make_fetch_window(events, time_zone):
+    def fetch_window(time_min, time_max):
+        time_min = time_min.replace(tzinfo=datetime.timezone.utc)
+        time_max = time_max.replace(tzinfo=datetime.timezone.utc)
+        overlapping = [event for event in events
+                       if listed_range(event, time_zone)[0] < time_max and listed_range(event, time_zone)[1] > time_min]
+        yield sorted(overlapping, key=lambda event: listed_range(event, time_zone)[0])
+    return fetch_window
+
+
+def test_all_day_event_after_a_boundary_past_utc_midnight_is_listed_once():
+    events = [
+        {'id': 'allday', 'start': {'date': '2022-02-10'}, 'end': {'date': '2022-02-11'}},
+        {'id': 'multiday', 'start': {'date': '2022-02-12'}, 'end': {'date': '2022-02-15'}},
+        {'id': 'early', 'start': {'dateTime': '2022-02-10T01:00:00Z'}, 'end': {'dateTime': '2022-02-10T03:00:00Z'}},
+        {'id': 'late', 'start': {'dateTime': '2022-02-10T20:00:00Z'}, 'end': {'dateTime': '2022-02-10T21:00:00Z'}},
+    ]
+    # Every window starts at 02:00Z, after UTC midnight but before midnight in New York
+    start = datetime.datetime(2022, 2, 1, 2)
+    windows = time_windows(start, start + datetime.timedelta(days=24), 24)
+    fetch_window = make_fetch_window(events, NEW_YORK)
+
+    unsharded = [event['id'] for page in fetch_window(start, start + datetime.timedelta(days=24)) for event in page]
+    sharded = [event['id'] for event in sharded_events(fetch_window, windows)]
+
+    assert sorted(sharded) == sorted(unsharded) == ['allday', 'early', 'late', 'multiday']
+
+
+def test_event_spanning_windows_is_taken_from_the_window_it_starts_in():
+    events = [{'id': 'evt%d' % hour, 'start': {'dateTime': '2022-02-05T%02d:30:00Z' % hour},
+               'end': {'dateTime': '2022-02-05T%02d:30:00Z' % (hour + 2)}} for hour in range(20)]
+    start = datetime.datetime(2022, 2, 5)
+    windows = time_windows(start, start + datetime.timedelta(days=1), 6)
+
+    sharded = [event['id'] for event in sharded_events(make_fetch_window(events, NEW_YORK), windows)]
+
+    assert sharded == ['evt%d' % hour for hour in range(20)]
@@ -0,0 +1,149 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+from googleapiclient.discovery import build
+
+from event_store import EventStore
+from fake_calendar import FakeHttp
+from retry_policy import RetryPolicy
+import update_calendar_events
+import watcher
+
+COALESCE_SECONDS = 0.3
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def post_ping(address, channel_id, token, state='exists'):
+    headers = {'X-Goog-Channel-ID': channel_id, 'X-Goog-Resource-State': state}
+    if token is not None:
+        headers['X-Goog-Channel-Token'] = token
+    try:
+        with urllib.request.urlopen(urllib.request.Request(address, data=b'', headers=headers, method='POST')) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+@pytest.fixture
+def settled_calendar(olympic_calendar, tmp_path):
+    """The fake Olympics calendar once the rules have been run over it, and the store that run used."""
+    store_path = str(tmp_path / 'events.db')
+    with EventStore(store_path) as store:
+        update_calendar_events.execute_updates(olympic_calendar.info(), store)
+        # The run's own patches come back in the next delta
+        update_calendar_events.execute_updates(olympic_calendar.info(), store)
+    return olympic_calendar, store_path
+
+
+@pytest.fixture
+def daemon(settled_calendar):
+    """The watcher's notification server, coalescer and channel manager, with every sync's summary recorded."""
+    calendar, store_path = settled_calendar
+    backend = calendar.backend
+    summaries = []
+    sync = watcher.make_sync(calendar.info(), store_path)
+    coalescer = watcher.ChangeCoalescer(lambda: summaries.append(sync()), window=COALESCE_SECONDS)
+    # Channels are made and renewed from the test thread while the coalescer syncs, so they get their own connection
+    service = build('calendar', 'v3', http=FakeHttp(backend), static_discovery=True)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), None)
+    address = 'http://127.0.0.1:%d/notifications' % server.server_address[1]
+    channels = watcher.ChannelManager(service, calendar.id, address, RetryPolicy())
+    server.RequestHandlerClass = watcher.make_handler(channels, coalescer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    coalescer.start()
+    thread.start()
+    channels.renew()
+    backend.wait_for_pings()
+    yield backend, channels, summaries, address
+    channels.stop()
+    server.shutdown()
+    coalescer.stop()
+
+
+def test_burst_of_pings_runs_one_sync(daemon):
+    backend, channels, summaries, _ = daemon
+    # The feed touches a few events at once; descriptions don't change any rule outcome
+    service = build('calendar', 'v3', http=FakeHttp(backend), static_discovery=True)
+    event_ids = [event['id'] for event in backend.events[update_calendar_events.OLYMPIC_CALENDAR_ID].values()
+                 if event.get('status') != 'cancelled'][:5]
+    for event_id in event_ids:
+        service.events().patch(calendarId=update_calendar_events.OLYMPIC_CALENDAR_ID, eventId=event_id,
+                               body={'description': 'Updated by the feed'}).execute()
+    backend.wait_for_pings()
+
+    wait_until(lambda: len(summaries) == 1)
+    time.sleep(COALESCE_SECONDS * 3)
+    assert len(summaries) == 1
+    assert summaries[0]['events'] == 5
+    assert summaries[0]['updated'] == 0
+    assert [ping[1:] for ping in backend.pings[-5:]] == [('exists', 200)] * 5
+
+
+def test_ping_during_sync_schedules_exactly_one_more():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def on_change():
+        calls.append(time.time())
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+
+    coalescer = watcher.ChangeCoalescer(on_change, window=0.05)
+    coalescer.start()
+    try:
+        coalescer.notify()
+        assert started.wait(5)
+        for _ in range(5):
+            coalescer.notify()
+        release.set()
+        wait_until(lambda: len(calls) == 2)
+        time.sleep(0.3)
+        assert len(calls) == 2
+    finally:
+        coalescer.stop()
+
+
+def test_stale_channel_or_token_gets_404(daemon):
+    backend, channels, summaries, address = daemon
+    current = channels.channel
+    assert backend.pings[-1] == (current.id, 'sync', 200)
+
+    channels.renew()
+    backend.wait_for_pings()
+
+    assert post_ping(address, current.id, current.token) == 404
+    assert post_ping(address, channels.channel.id, 'not-the-token') == 404
+    assert post_ping(address, channels.channel.id, None) == 404
+    assert post_ping(address, channels.channel.id, channels.channel.token, state='sync') == 200
+    # The old channel was stopped on the server, so only the new one is left
+    assert list(backend.channels) == [channels.channel.id]
+    assert summaries == []
+
+
+def test_channel_is_renewed_before_it_expires(daemon):
+    backend, channels, _, _ = daemon
+    channel = channels.channel
+    assert not channels.needs_renewal()
+
+    # Inside the renewal margin, but not expired yet
+    channel.expiration = time.time() + watcher.RENEW_MARGIN_SECONDS - 1
+    assert channels.needs_renewal()
+    channels.renew()
+
+    assert channels.channel.id != channel.id
+    assert channels.channel.expires_in() > watcher.RENEW_MARGIN_SECONDS
+    assert backend.calls['channels.stop'] == 1
+    assert list(backend.channels) == [channels.channel.id]
@@ -1,29 +1,65 @@
 from __future__ import print_function
-from time import sleep
-import math
-import random
 import re
+import time
+import asyncio
+import hashlib
 import datetime
-import os.path
-import copy
-import json
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import logging
+import argparse
+
 from googleapiclient.errors import HttpError
 
+import calendar_client
+from calendar_resolver import CalendarResolver, CACHE_PATH
+from batching import BatchWriter, BatchResult, PendingWrite, DEFAULT_BATCH_SIZE
+from async_client import AsyncCalendarClient
+from retry_policy import RetryPolicy, is_precondition_failed, is_not_modified
+from dispatcher import Dispatcher, TokenBucket, DEFAULT_WORKERS, DEFAULT_REQUESTS_PER_SECOND
+from event_store import EventStore, DEFAULT_STORE_PATH
+from event_sync import sync_events, sync_state_key
+from sharded_fetch import sharded_events, time_windows
+from event_model import EventRecord, as_record, DEFAULT_REMINDER_METHOD
+from change_plan import ChangePlanWriter, PlanCheckpoint, read_plan
+from listing_etags import ListingEtags, listing_key, LISTING_ETAGS_PATH
+from snapshot import SnapshotWriter, read_snapshot, read_snapshot_header
+from metrics import RunMetrics
+from rule_engine import load_rules, DEFAULT_RULES_PATH
+from deletion import (DeletePolicy, DeletionJournal, DeletionCapExceeded, DELETE_MODES, DEFAULT_DELETE_MODE,
+                      DEFAULT_MAX_DELETIONS, JOURNAL_PATH)
+
 OLYMPIC_CALENDAR_ID = 'icn02kf62d26hurpro3qksjhjc@group.calendar.google.com'
 service=None
-CREDENTIALS_DIR='credentials'
+credentials=None
+dispatcher=None
+delete_policy = DeletePolicy()
+deletion_journal = DeletionJournal()
+# Etags of listings earlier runs left up to date; None turns conditional listing off
+listing_etags = None
+# Phase timings and per-call-type request statistics for the run
+metrics = RunMetrics()
+# Shared by every read and write so the retry counters cover the whole run
+retry_policy = RetryPolicy(metrics=metrics)
+log = logging.getLogger(__name__)
 COLORS = {}
+RULES = None
+# Digest of the rule file, part of what a remembered listing etag is valid for
+RULES_DIGEST = None
+CALENDAR_CACHE_PATH = CACHE_PATH
 OLYMPIC_CALENDAR_NAME='NBC Sports'
 STD_NOTIFICATION_TIME = 5
 ONE_DAY_NOTIFICATION_TIME = 1440
-
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
+BATCH_SIZE = DEFAULT_BATCH_SIZE
+# Events per events().list page; the API allows up to 2500
+EVENTS_PAGE_SIZE = 250
+EVENTS_START_DATE = datetime.datetime(2022, 2, 1)
+# Partial response mask: only the fields the rules, events_are_equal and the sync need.
+# Attachments, conferenceData, attendees etc. are never downloaded. Ref: https://developers.google.com/calendar/api/guides/performance#partial
+# etag and updated are kept so patches can be made conditional on the version of the event they were computed from.
+EVENT_FIELDS = 'id,status,summary,start,end,location,description,reminders,colorId,recurringEventId,etag,updated'
+EVENT_LIST_FIELDS = 'etag,nextPageToken,nextSyncToken,items(' + EVENT_FIELDS + ')'
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+# How many times an event that keeps changing under a run is fetched and evaluated again before its patch counts as failed
+MAX_CONFLICT_ROUNDS = 3
 
 def initialize_colors():
     # Reference this page: https://lukeboyle.com/blog/posts/google-calendar-api-color-id
@@ -40,308 +76,816 @@ def initialize_colors():
     COLORS['green'] = '10'
     COLORS['red'] = '11'
 
-def setup():
-    global service
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_DIR + '/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    service = build('calendar', 'v3', credentials=creds)
+def load_rule_set(rules_path=DEFAULT_RULES_PATH):
+    global RULES, RULES_DIGEST
+    RULES = load_rules(rules_path)
+    RULES.validate_colors(COLORS)
+    with open(rules_path, 'rb') as rules_file:
+        RULES_DIGEST = hashlib.sha1(rules_file.read()).hexdigest()
+
+# Each dispatcher worker thread needs its own connection since httplib2 isn't thread-safe
+def new_http():
+    return metrics.wrap(calendar_client.new_http(credentials))
+
+def setup_dispatcher(workers=DEFAULT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+    global dispatcher
+    dispatcher = Dispatcher(workers=workers, limiter=TokenBucket(requests_per_second), http_factory=new_http)
+
+# The async client keeps as many requests in flight as the dispatcher has workers and pays the same token bucket
+def new_async_client():
+    return AsyncCalendarClient(credentials, concurrency=dispatcher.workers, policy=retry_policy, limiter=dispatcher.limiter,
+                               metrics=metrics)
+
+def setup(rules_path=DEFAULT_RULES_PATH, token_path=calendar_client.TOKEN_PATH, calendar_cache_path=CALENDAR_CACHE_PATH):
+    global service, credentials, CALENDAR_CACHE_PATH
+    CALENDAR_CACHE_PATH = calendar_cache_path
+    credentials = calendar_client.load_credentials(token_path)
+    service = calendar_client.build_service(credentials, http=new_http())
     initialize_colors()
+    load_rule_set(rules_path)
 
 
-def update_event(event):
-    print("Updating event: " + event.get('summary'))
-    # Implelmentation of exponential backoff; Ref: https://cloud.google.com/storage/docs/retry-strategy#exponential-backoff
-    max_retry_time = 60
-    rate = 10
-    progress_increment = 1 / rate
-    max_retries = math.log(max_retry_time + 1, 2)
-    progress = 0
-    while True:
-        try:
-            service.events().update(calendarId=OLYMPIC_CALENDAR_ID, eventId=event['id'], body=event).execute()
-        except HttpError as e:
-            if e.reason == "Rate Limit Exceeded":
-                print("Retry count: " + str(progress * rate))
-                if progress <= max_retries:
-                    sleep_time = 2**progress - 1
-                    if sleep_time > 0.5:
-                        sleep_time += random.uniform(0, 1)
-                    print("Retrying in " + str(sleep_time) + " seconds")
-                    sleep(sleep_time)                
-                else:
-                    # print("Error: " + str(e))
-                    # print("Exceeded maximum number of retries")
-                    raise e
-            progress += progress_increment
-            
-        break
-    print("Event updated successfully")
-
 def print_calendar_info(calendar):
     print("Calendar: " + calendar.get('summary') + " (" + calendar.get('id') + ")")
 
 
-def get_events_from_calendar(calendar, start_date=datetime.datetime(2022, 2, 1)):
+# Generator that follows nextPageToken and yields events as each page arrives.
+# Stops requesting pages as soon as the caller stops consuming.
+# end_date and query are pushed down to the server as timeMax and q so filtered-out events are never downloaded.
+# With single_events=False a recurring series comes back once, as its master event, plus one event for every
+# instance that was modified on its own (an exception) instead of one event per instance.
+# With shards > 1 the range up to end_date is split into that many time windows that are listed at the same time,
+# each on its own connection, and merged back into start time order (see sharded_fetch.py).
+# With a listing (see start_listing) the first page is asked for with If-None-Match, and on a 304 nothing is yielded.
+def get_events_from_calendar(calendar, start_date=EVENTS_START_DATE, page_size=EVENTS_PAGE_SIZE,
+                             end_date=None, query=None, fields=EVENT_LIST_FIELDS, single_events=True, shards=1,
+                             listing=None):
     id = calendar.get('id')
     print("Getting events from calendar:")
     print_calendar_info(calendar)
-    start_date = start_date.isoformat() + 'Z'  # 'Z' indicates UTC time
-    events_result = service.events().list(calendarId=id, timeMin=start_date,
-                                            maxResults=999, singleEvents=True,
-                                            orderBy='startTime').execute()
-    events = events_result.get('items', [])
-    return events
+    params = event_list_params(start_date, page_size, end_date, query, fields, single_events)
+    if shards > 1:
+        # The windows need an end, and merging them relies on each one coming back in start time order
+        if end_date is None or not single_events:
+            raise ValueError("Sharded fetches need an end date and expanded series")
+        yield from sharded_events(lambda time_min, time_max: get_window_pages(id, params, time_min, time_max),
+                                  time_windows(start_date, end_date, shards))
+        return
+    page_token = None
+    while True:
+        request = service.events().list(calendarId=id, pageToken=page_token, **params)
+        if listing is not None and page_token is None and listing['known_etag']:
+            request.headers['If-None-Match'] = listing['known_etag']
+        try:
+            events_result = retry_policy.execute(request, "events list")
+        except HttpError as e:
+            if not is_not_modified(e):
+                raise
+            listing['not_modified'] = True
+            print("No changes since the last run")
+            return
+        if listing is not None and page_token is None:
+            listing['etag'] = events_result.get('etag')
+        for event in events_result.get('items', []):
+            yield event
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+
+
+# Runs on a thread per window: httplib2 connections can't be shared between threads, so it takes one of the
+# dispatcher's per-thread connections, and every page pays the shared token bucket
+def get_window_pages(calendar_id, params, time_min, time_max):
+    http = dispatcher.http() if dispatcher is not None else None
+    params = dict(params, timeMin=time_min.isoformat() + 'Z', timeMax=time_max.isoformat() + 'Z')
+    page_token = None
+    while True:
+        if dispatcher is not None and dispatcher.limiter is not None:
+            dispatcher.limiter.acquire()
+        events_result = retry_policy.execute(service.events().list(calendarId=calendar_id, pageToken=page_token, **params),
+                                             "events list", http=http)
+        yield events_result.get('items', [])
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def event_list_params(start_date=EVENTS_START_DATE, page_size=EVENTS_PAGE_SIZE, end_date=None, query=None,
+                      fields=EVENT_LIST_FIELDS, single_events=True):
+    params = {'timeMin': start_date.isoformat() + 'Z',  # 'Z' indicates UTC time
+              'maxResults': page_size, 'singleEvents': single_events, 'fields': fields}
+    if end_date is not None:
+        params['timeMax'] = end_date.isoformat() + 'Z'
+    if query:
+        params['q'] = query
+    # The API only orders by start time when series are expanded
+    if single_events:
+        params['orderBy'] = 'startTime'
+    return params
+
+
+# A listing remembers the etag of the first page so finish_listing can store it once the run is done
+def start_listing(calendar, end_date=None, query=None, single_events=True):
+    key = listing_key(calendar.get('id'), event_list_params(end_date=end_date, query=query, single_events=single_events),
+                      RULES_DIGEST)
+    return {'key': key, 'known_etag': listing_etags.get(key), 'etag': None, 'not_modified': False}
+
+
+# The etag is only remembered from a run that found the listing already settled: it wrote nothing, nothing failed and
+# there was nothing unwanted left. Refetching the etag after the run's own writes would also cover any upstream edit
+# made since the listing, which the next run would then skip, so a run that wrote forgets it instead and the next run
+# lists everything again.
+def finish_listing(listing, summary):
+    if listing['not_modified']:
+        return
+    wrote = summary['updated'] or summary['deleted']
+    if wrote or summary['failed'] or summary.get('unwanted', 0):
+        listing_etags.forget(listing['key'])
+        return
+    listing_etags.remember(listing['key'], listing['etag'])
 
 
 def get_calendar_by_id(id):
-    return service.calendars().get(calendarId=id).execute()
+    return retry_policy.execute(service.calendars().get(calendarId=id), "calendar get")
 
+# Served from the local calendar cache (seeded from calendar_ids.csv) whenever possible
 def get_calendar_by_name(name):
-    id = None 
-    page_token = None
-    while True:
-            calendar_list = service.calendarList().list(pageToken=page_token).execute()
-            for calendar_list_entry in calendar_list['items']:
-                if calendar_list_entry['summary'] == name:
-                    id = calendar_list_entry.get('id')
-            page_token = calendar_list.get('nextPageToken')
-            if not page_token:
-                break
-    return get_calendar_by_id(id)
-
-def remove_events(events):    
-    if len(events) > 0:
-        for event in events:
-            user_input = input("Would you like to remove event: " + event.get('summary') + "? (y/n)")
-            if user_input =='y' or user_input == 'Y':
-                service.events().delete(calendarId=OLYMPIC_CALENDAR_ID, eventId=event.get('id')).execute()
-                print("Removed event: " + event.get('summary'))
-    else:
+    return CalendarResolver(service, cache_path=CALENDAR_CACHE_PATH, policy=retry_policy).resolve(name)
+
+# Which events really get deleted is up to delete_policy (prompt, dry-run or auto, with a safety cap).
+# Deletes go out in batches and every deleted event is written to the journal so the run can be undone.
+# Returns the ids of the events that were deleted.
+def remove_events(events, calendar_id=OLYMPIC_CALENDAR_ID):
+    events = _select_deletions(events)
+    if events is None:
+        return set()
+    with metrics.phase('delete'):
+        events_by_id = dict((event['id'], event) for event in events)
+        writer = BatchWriter(service, calendar_id, batch_size=BATCH_SIZE, policy=retry_policy)
+        for event in events_by_id.values():
+            writer.delete(event)
+        result = writer.flush(dispatcher)
+    return _record_deletions(calendar_id, events_by_id, result)
+
+async def remove_events_async(client, events, calendar_id=OLYMPIC_CALENDAR_ID):
+    events = _select_deletions(events)
+    if events is None:
+        return set()
+    with metrics.phase('delete'):
+        events_by_id = dict((event['id'], event) for event in events)
+        result = await client.write(calendar_id, [PendingWrite('delete', event['id'], summary=event.get('summary'))
+                                                  for event in events_by_id.values()], BATCH_SIZE)
+    return _record_deletions(calendar_id, events_by_id, result)
+
+# Returns the events the delete policy lets go, or None when nothing should be deleted at all
+def _select_deletions(events):
+    if len(events) == 0:
         print("No events to remove")
-
-# Returns true if an update is made (Meaning a call to update_event will be required to submit the changes)
+        return None
+    try:
+        return delete_policy.select(events)
+    except DeletionCapExceeded as e:
+        print("Not removing events: " + str(e))
+        return None
+
+def _record_deletions(calendar_id, events_by_id, result):
+    deletion_journal.record(calendar_id, [events_by_id[write.event_id] for write in result.succeeded])
+    for write in result.succeeded:
+        log.debug("Removed event: %s", write.summary)
+    print("Events removed: " + str(len(result.succeeded)))
+    return set(write.event_id for write in result.succeeded)
+
+# Deleted events stay on the calendar as cancelled for a while, so setting them back to confirmed restores them
+def undo_deletions(run_id=None):
+    run_id = run_id or deletion_journal.last_run_id()
+    entries = deletion_journal.entries_for_run(run_id) if run_id else []
+    if not entries:
+        print("No deletions to undo")
+        return
+    print("Restoring " + str(len(entries)) + " events deleted in run " + run_id)
+    writers = {}
+    for entry in entries:
+        calendar_id = entry['calendarId']
+        if calendar_id not in writers:
+            writers[calendar_id] = BatchWriter(service, calendar_id, batch_size=BATCH_SIZE, policy=retry_policy)
+        writers[calendar_id].patch(dict(entry['event'], status='confirmed'), ['status'])
+    for writer in writers.values():
+        result = writer.flush(dispatcher)
+        for write in result.succeeded:
+            log.debug("Restored event: %s", write.summary)
+        print("Events restored: " + str(len(result.succeeded)))
+
+# The rule helpers below work on EventRecords (see event_model.py).
+# Returns true if an update is made (Meaning the event will need a patch to submit the changes)
 def remove_notifications(event):
-    if event.get('reminders').get('useDefault') == False:
-        print("Removing notifications for event: " + event.get('summary'))
-        event['reminders'] = {'useDefault': True}   
-        # update_event(event)
+    if not event.use_default_reminders:
+        log.debug("Removing notifications for event: %s", event.summary)
+        event.use_default_reminders = True
+        event.overrides = frozenset()
         return True
     return False
 
 def notification_already_exists(event, minutes):
-    if event.get('reminders').get('useDefault') is True or event.get('reminders').get('overrides') is None:
+    if event.use_default_reminders:
         return False
-    for override in event.get('reminders').get('overrides'):
-        if override.get('minutes') == minutes:
+    for _, override_minutes in event.overrides:
+        if override_minutes == minutes:
             return True
     return False
 
 
 def set_notification(event, minutes):
     if notification_already_exists(event, minutes):
-        print("Notification already exists for event: " + event.get('summary'))
+        log.debug("Notification already exists for event: %s", event.summary)
     else: 
-        print(f"Setting {minutes} minute notification for event: " + event.get('summary'))
-        event['reminders'] = {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': minutes}]}
-        # update_event(event)
+        log.debug("Setting %s minute notification for event: %s", minutes, event.summary)
+        event.use_default_reminders = False
+        event.overrides = frozenset([(DEFAULT_REMINDER_METHOD, minutes)])
         return True
     return False
 
-# Returns true if an update is made (Meaning a call to update_event will be required to submit the changes)
+# Returns true if an update is made (Meaning the event will need a patch to submit the changes)
 def add_notifications(event, minutes_list):
     update_made = False
     if type(minutes_list) is int or type(minutes_list) is str:
         minutes_list = [minutes_list]
     
-    minutes_set = set(minutes_list)
-    for minutes in minutes_set:
+    for minutes in set(minutes_list):
         if notification_already_exists(event, minutes):
-            print("Notification already exists for event: " + event.get('summary'))
+            log.debug("Notification already exists for event: %s", event.summary)
         else:
-            print(f"Adding {minutes} minute notification for event: " + event.get('summary'))
-            if event.get('reminders').get('overrides') is None or len(event.get('reminders').get('overrides')) == 0:
+            log.debug("Adding %s minute notification for event: %s", minutes, event.summary)
+            if event.use_default_reminders or not event.overrides:
                 set_notification(event, minutes)
             else:
-                event.get('reminders').get('overrides').append({'method': 'popup', 'minutes': minutes})
-            # update_event(event)
+                event.overrides = event.overrides | {(DEFAULT_REMINDER_METHOD, minutes)}
             update_made = True
     return update_made
 
-# Returns true if an update is made (Meaning a call to update_event will be required to submit the changes)
+# Returns true if an update is made (Meaning the event will need a patch to submit the changes)
 def set_color(event, color):
     if color not in COLORS.keys():
-        print(f"Invalid color: {color}")
-    elif event.get('colorId') == COLORS[color]:
-        print(f"Color already set to {color} for event: {event.get('summary')}")
+        log.warning("Invalid color: %s", color)
+    elif event.color_id == COLORS[color]:
+        log.debug("Color already set to %s for event: %s", color, event.summary)
     else:
-        print(f"Setting {color} color for event: {event.get('summary')}")
-        event['colorId'] = str(COLORS[color])
-        # update_event(event)
+        log.debug("Setting %s color for event: %s", color, event.summary)
+        event.color_id = str(COLORS[color])
         return True
     return False
 
 
+# Accept API dicts or EventRecords; records hold overrides as a frozenset so there is nothing to normalize
 def event_reminders_are_equal(event1, event2):
-    if event1.get('reminders') == event2.get('reminders'):
-        return True
-
-    # Make sure use default is equal
-    if event1.get('reminders').get('useDefault') != event2.get('reminders').get('useDefault'):
-        return False
-
-    if event1.get('reminders').get('useDefault') is True:
-        return True
-
-    # Make sure overrides are effectivly equal
-    overrides_set_1 = set()
-    for override in event1.get('reminders').get('overrides'):
-        overrides_set_1.add(json.dumps(override, sort_keys=True))
-
-
-    overrides_set_2 = set()
-    for override in event2.get('reminders').get('overrides'):
-        overrides_set_2.add(json.dumps(override, sort_keys=True))
-
-    if overrides_set_1 != overrides_set_2:
-        return False
-
-    return True
+    event1, event2 = as_record(event1), as_record(event2)
+    return event1.use_default_reminders == event2.use_default_reminders and event1.overrides == event2.overrides
   
 
-# Returns true if events are effectivly the same. Add any comprisons that should be included in that determination here
+# Returns true if events are effectivly the same. The compared fields are EventRecord's equality key.
 def events_are_equal(event1, event2):
-    if str(event1.get('id')) != str(event2.get('id')):
-        return False
-
-    if str(event1.get('summary')) != str(event2.get('summary')):
-        return False
+    return as_record(event1) == as_record(event2)
 
-    if str(event1.get('start').get('dateTime')) != str(event2.get('start').get('dateTime')):
-        return False
-
-    if str(event1.get('end').get('dateTime')) != str(event2.get('end').get('dateTime')):
-        return False
-
-    if event1.get('location') != event2.get('location'):
-        return False
-
-    if str(event1.get('description')) != str(event2.get('description')):
-        return False
-
-    if not event_reminders_are_equal(event1, event2):
-        return False
 
-    if str(event1.get('colorId')) != str(event2.get('colorId')):
-        return False
-
-    return True
-
-
-def execute_updates(olympics_calendar):
-    olympic_events = get_events_from_calendar(olympics_calendar)
-    olympic_events = delete_unwanted_events(olympic_events)
-    original_olympic_events = copy.deepcopy(olympic_events)
-
-    for event in olympic_events:
-        # Set all events to least importance. Notifications and color will be added to specific events with if statements
-        # TODO: Figure out how to remove notifications from everything but what has notifications added so that all those with notifications will not be marked for update if they start with notifications
-        remove_notifications(event)
-        set_color(event, 'gray')
-
-        # Gold Medal Events
-        if bool(re.match(".*🏅.*", event.get('summary'))):
-            set_color(event, 'yellow')
-            add_notifications(event, [STD_NOTIFICATION_TIME, ONE_DAY_NOTIFICATION_TIME])
-        
-        # USA Events
-        if bool(re.match(".*USA.*", event.get('summary'))):
-            set_color(event, 'light blue')
-            add_notifications(event, STD_NOTIFICATION_TIME)
-
-        # Curling events
-        if bool(re.match(".*Curling.*", event.get('summary'))):
-            # USA Curling matches
-            if bool(re.match(".*USA.*", event.get('summary'))):
-                add_notifications(event, [ONE_DAY_NOTIFICATION_TIME, 30])
-
-            # Non-Round Robin Curling matches
-            if not bool(re.match(".*(?i)(Round Robin).*", event.get('summary'))):
-                set_color(event, 'dark blue')
-                add_notifications(event, [STD_NOTIFICATION_TIME, ONE_DAY_NOTIFICATION_TIME])
-
-        # Snowboarding events
-        if bool(re.match(".*Snowboarding.*", event.get('summary'))):
-            set_color(event, 'green')
-
-        # Skiiing events
-        if bool(re.match("(?i)(.*Skiing.*|.*Super-G.*|.*Downhill.*|.*Alpine.*)", event.get('summary'))) or bool(re.match(".*Super G.*", event.get('summary'))):
-            set_color(event, 'green')
-            add_notifications(event, [STD_NOTIFICATION_TIME])
-
-        # Hockey events 
-        if bool(re.match(".*Hockey.*", event.get('summary'))):
-            set_color(event, 'gray')
+# Rules come from the rule file (rules.json by default) and are applied in file order
+def apply_rules(event):
+    for rule in RULES.matching_rules(event.summary):
+        if rule.reset_notifications:
             remove_notifications(event)
+        if rule.color is not None:
+            set_color(event, rule.color)
+        if rule.add_notifications:
+            add_notifications(event, rule.add_notifications)
 
-    events_to_update = []
-    for event in olympic_events:
-        original_event = next(original_event for original_event in original_olympic_events if original_event.get('id') == event.get('id'))
-        if events_are_equal(event, original_event):
-            print("Event already up to date: " + event.get('summary'))
-        else: 
-            events_to_update.append(event)
 
+# With a store only the events that changed since the last run are fetched and evaluated
+def get_changed_events(calendar, store, single_events=True):
+    print("Syncing events from calendar:")
+    print_calendar_info(calendar)
+    return sync_events(service, calendar.get('id'), store, time_min=EVENTS_START_DATE.isoformat() + 'Z', page_size=EVENTS_PAGE_SIZE,
+                       policy=retry_policy, fields=EVENT_LIST_FIELDS, single_events=single_events,
+                       rules_digest=RULES_DIGEST, retry_pending=True)
+
+
+# Rules applied to a series master reach every instance that hasn't been modified on its own, and those
+# exceptions are listed separately and get the rules applied like any other event
+def fetch_events(olympics_calendar, store=None, end_date=None, query=None, single_events=True, shards=1, listing=None):
+    if store is None:
+        return get_events_from_calendar(olympics_calendar, end_date=end_date, query=query, single_events=single_events,
+                                        shards=shards, listing=listing)
+    return get_changed_events(olympics_calendar, store, single_events)
+
+
+# Runs the rules on one event and returns its record and the names of the fields they changed
+def evaluate_event(event):
+    # Only the managed fields are kept from here on, and a copy of the record is the snapshot to diff against
+    with metrics.phase('diff'):
+        record = EventRecord.from_api(event)
+        original = record.copy()
+    with metrics.phase('rules'):
+        apply_rules(record)
+    with metrics.phase('diff'):
+        changed_fields = record.changed_fields(original)
+    return record, changed_fields
+
+
+# Generator that runs the rules over the event stream and yields (record, changed fields) for every event
+# that needs a patch. Counts events and unchanged events in summary.
+def evaluate_events(olympic_events, summary):
+    # Time spent waiting on the stream is fetch time; the deletes it triggers at the end are timed on their own
+    for event in metrics.timed(olympic_events, 'fetch'):
+        summary['events'] += 1
+        record, changed_fields = evaluate_event(event)
+        if not changed_fields:
+            log.debug("Event already up to date: %s", record.summary)
+            summary['unchanged'] += 1
+            continue
+        yield record, changed_fields
+
+
+# Patches carry the etag their event was fetched with, and a 412 means the event changed upstream (e.g. the NBC
+# feed updated it) in the meantime. Takes those writes out of result.failed and returns them.
+def split_conflicts(result):
+    conflicts = [write for write in result.failed if is_precondition_failed(write.error)]
+    result.failed = [write for write in result.failed if not is_precondition_failed(write.error)]
+    return conflicts
+
+# The patch for an event that changed under the run, worked out again from the event as it is now, or None
+def conflict_rewrite(event, summary):
+    summary['conflicts'] = summary.get('conflicts', 0) + 1
+    # Deleted upstream, or renamed into something the next run will delete
+    if event.get('status') == 'cancelled' or is_unwanted_event(event):
+        return None
+    record, changed_fields = evaluate_event(event)
+    if not changed_fields:
+        summary['unchanged'] += 1
+        return None
+    return PendingWrite('patch', record.id, record.to_patch(changed_fields), record.summary, record.etag)
+
+def get_event(calendar_id, event_id, description):
+    return retry_policy.execute(service.events().get(calendarId=calendar_id, eventId=event_id, fields=EVENT_FIELDS),
+                                "get of " + str(description))
+
+# Flushes the writer, and for every patch that hit a 412 fetches that one event again, re-applies the rules and
+# sends the new patch, up to MAX_CONFLICT_ROUNDS times. Returns the combined BatchResult.
+def flush_updates(writer, summary):
+    result = BatchResult()
+    conflict_round = 0
+    while len(writer):
+        round_result = writer.flush(dispatcher)
+        conflicts = split_conflicts(round_result) if conflict_round < MAX_CONFLICT_ROUNDS else []
+        result.merge(round_result)
+        for write in conflicts:
+            log.info("Event changed since it was fetched, evaluating it again: %s", write.summary)
+            rewrite = conflict_rewrite(get_event(writer.calendar_id, write.event_id, write.summary), summary)
+            if rewrite is not None:
+                writer.add(rewrite)
+        conflict_round += 1
+    return result
+
+
+# Returns a summary of the run: events evaluated, already up to date, updated, failed and deleted
+def execute_updates(olympics_calendar, store=None, end_date=None, query=None, single_events=True, shards=1):
+    # Events are fetched, filtered, evaluated and diffed one at a time as the pages stream in,
+    # so the whole calendar is never held in memory at once
+    summary = {'events': 0, 'unchanged': 0, 'updated': 0, 'failed': 0, 'deleted': 0, 'conflicts': 0}
+    writer = BatchWriter(service, olympics_calendar.get('id'), batch_size=BATCH_SIZE, policy=retry_policy)
+    # Listings that can be compared with an earlier run: a whole, unsharded listing and not a sync token delta
+    listing = None
+    if listing_etags is not None and store is None and shards == 1:
+        listing = start_listing(olympics_calendar, end_date, query, single_events)
+    # Ids of synced events whose patch failed or that are unwanted but weren't deleted; the next sync yields them again
+    unsettled_ids = set()
+    olympic_events = fetch_events(olympics_calendar, store, end_date, query, single_events, shards, listing)
+    olympic_events = delete_unwanted_events(olympic_events, olympics_calendar.get('id'), summary, left=unsettled_ids)
     updated_events_count = 0
-    for event in events_to_update:
-        print("Events left to update: " + str(len(events_to_update) - updated_events_count))
-        update_event(event)
-        updated_events_count += 1
-        
-    print("Events updated: " + str(updated_events_count))
+    failed_events_count = 0
+    for record, changed_fields in evaluate_events(olympic_events, summary):
+        # Patch only what the rules changed instead of sending the whole event back
+        writer.patch(record, changed_fields)
+        # Send a round of batches as soon as there is one for every worker instead of waiting for the end of the stream
+        if len(writer) >= BATCH_SIZE * dispatcher.workers:
+            with metrics.phase('update'):
+                result = flush_updates(writer, summary)
+            updated_events_count += len(result.succeeded)
+            failed_events_count += len(result.failed)
+            unsettled_ids.update(write.event_id for write in result.failed)
+
+    log.info("Events left to update: %d", len(writer))
+    with metrics.phase('update'):
+        result = flush_updates(writer, summary)
+    updated_events_count += len(result.succeeded)
+    failed_events_count += len(result.failed)
+    unsettled_ids.update(write.event_id for write in result.failed)
+    if store is not None:
+        store.set_pending_ids(sync_state_key(olympics_calendar.get('id'), single_events), unsettled_ids)
 
-def delete_unwanted_events(olympic_events):
-    events_to_delete = list(filter( lambda event: 
-        'Re-Air' in event.get('summary') or 
+    print("Events updated: " + str(updated_events_count))
+    if failed_events_count:
+        print("Events failed to update: " + str(failed_events_count))
+    if summary['conflicts']:
+        print("Events changed during the run and evaluated again: " + str(summary['conflicts']))
+    summary['updated'] = updated_events_count
+    summary['failed'] = failed_events_count
+    if listing is not None:
+        finish_listing(listing, summary)
+    return summary
+
+
+async def get_event_pages_async(client, calendar, end_date=None, query=None, single_events=True, listing=None):
+    print("Getting events from calendar:")
+    print_calendar_info(calendar)
+    params = event_list_params(end_date=end_date, query=query, single_events=single_events)
+    etag = listing['known_etag'] if listing is not None else None
+    try:
+        async for page in client.iter_event_pages(calendar.get('id'), etag=etag, **params):
+            if listing is not None and listing['etag'] is None:
+                listing['etag'] = page.get('etag')
+            yield page.get('items', [])
+    except HttpError as e:
+        if not is_not_modified(e):
+            raise
+        listing['not_modified'] = True
+        print("No changes since the last run")
+
+
+# execute_updates on the async client. Each page is evaluated as soon as it arrives and its patches go out as
+# batches while the next page is being fetched, with at most client.concurrency batches in flight.
+async def execute_updates_async(olympics_calendar, client, end_date=None, query=None, single_events=True):
+    summary = {'events': 0, 'unchanged': 0, 'updated': 0, 'failed': 0, 'deleted': 0, 'conflicts': 0}
+    calendar_id = olympics_calendar.get('id')
+    result = BatchResult()
+    sending = set()
+    writes = []
+    unwanted = []
+
+    def hold_back(events, calendar_id):
+        # Deletions wait until the whole calendar has been listed, like they do in execute_updates
+        unwanted.extend(events)
+        return set()
+
+    async def wait_for_batches(limit):
+        while len(sending) > limit:
+            done, _ = await asyncio.wait(sending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                sending.discard(task)
+                result.merge(task.result())
+
+    listing = start_listing(olympics_calendar, end_date, query, single_events) if listing_etags is not None else None
+    pages = get_event_pages_async(client, olympics_calendar, end_date, query, single_events, listing)
+    try:
+        while True:
+            with metrics.phase('fetch'):
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+            page_events = delete_unwanted_events(page, calendar_id, remove=hold_back)
+            for record, changed_fields in evaluate_events(page_events, summary):
+                writes.append(PendingWrite('patch', record.id, record.to_patch(changed_fields), record.summary,
+                                           record.etag))
+            while len(writes) >= BATCH_SIZE:
+                sending.add(asyncio.ensure_future(client.write_batch(calendar_id, writes[:BATCH_SIZE])))
+                writes = writes[BATCH_SIZE:]
+            await wait_for_batches(client.concurrency - 1)
+        log.info("Events left to update: %d", len(writes))
+        if writes:
+            sending.add(asyncio.ensure_future(client.write_batch(calendar_id, writes)))
+    finally:
+        # Batches already on their way are finished even when listing failed
+        with metrics.phase('update'):
+            await wait_for_batches(0)
+    # Events that changed under the run are fetched again, all at once, and their new patches sent together
+    for _ in range(MAX_CONFLICT_ROUNDS):
+        conflicts = split_conflicts(result)
+        if not conflicts:
+            break
+        events = await asyncio.gather(*[client.get_event(calendar_id, write.event_id, fields=EVENT_FIELDS)
+                                        for write in conflicts])
+        rewrites = [rewrite for rewrite in (conflict_rewrite(event, summary) for event in events) if rewrite is not None]
+        if rewrites:
+            with metrics.phase('update'):
+                result.merge(await client.write(calendar_id, rewrites, BATCH_SIZE))
+    unwanted = without_series_exceptions(unwanted)
+    summary['unwanted'] = len(unwanted)
+    summary['deleted'] = len(await remove_events_async(client, unwanted, calendar_id))
+
+    print("Events updated: " + str(len(result.succeeded)))
+    if result.failed:
+        print("Events failed to update: " + str(len(result.failed)))
+    if summary['conflicts']:
+        print("Events changed during the run and evaluated again: " + str(summary['conflicts']))
+    summary['updated'] = len(result.succeeded)
+    summary['failed'] = len(result.failed)
+    if listing is not None:
+        finish_listing(listing, summary)
+    return summary
+
+
+async def run_updates_async(olympics_calendar, **kwargs):
+    async with new_async_client() as client:
+        return await execute_updates_async(olympics_calendar, client, **kwargs)
+
+
+# Runs the event stream through the same deletes, rules and diff as execute_updates and writes the changes to plan.
+# `select` picks which of the unwanted events are planned for deletion.
+def plan_changes(olympic_events, calendar_id, plan, summary, select):
+    def plan_deletions(events, calendar_id):
+        try:
+            events = select(events) if events else []
+        except DeletionCapExceeded as e:
+            print("Not planning any deletions: " + str(e))
+            return set()
+        for event in events:
+            plan.delete(event)
+        return set(event['id'] for event in events)
+
+    olympic_events = delete_unwanted_events(olympic_events, calendar_id, remove=plan_deletions)
+    for record, changed_fields in evaluate_events(olympic_events, summary):
+        plan.patch(record, changed_fields)
+    summary['patches'] = plan.patches
+    summary['deletes'] = plan.deletes
+
+
+# Same evaluation as execute_updates, but the patches and deletes are written to a change plan instead of being sent.
+# The delete policy (prompt, dry-run, cap) is applied now, so the plan holds exactly what apply_plan will delete.
+def plan_updates(olympics_calendar, plan_path, store=None, end_date=None, query=None, single_events=True, shards=1):
+    summary = {'events': 0, 'unchanged': 0, 'patches': 0, 'deletes': 0}
+    with ChangePlanWriter(plan_path, olympics_calendar.get('id')) as plan:
+        olympic_events = fetch_events(olympics_calendar, store, end_date, query, single_events, shards)
+        plan_changes(olympic_events, olympics_calendar.get('id'), plan, summary, delete_policy.select)
+    print("Planned " + str(summary['patches']) + " patches and " + str(summary['deletes']) + " deletions in " + plan_path)
+    return summary
+
+
+# Streams the calendar's events, as execute_updates would list them, to a snapshot file for replay_snapshot
+def export_snapshot(olympics_calendar, snapshot_path, end_date=None, query=None, single_events=True, shards=1):
+    params = event_list_params(end_date=end_date, query=query, single_events=single_events)
+    with SnapshotWriter(snapshot_path, olympics_calendar, params) as snapshot:
+        for event in metrics.timed(fetch_events(olympics_calendar, None, end_date, query, single_events, shards),
+                                   'fetch'):
+            snapshot.add(event)
+    print("Wrote " + str(snapshot.events) + " events to " + snapshot_path)
+    return {'events': snapshot.events}
+
+
+# The evaluation of plan_updates run against a snapshot instead of the API: no credentials, requests or quota.
+# Every unwanted event is planned for deletion, since nobody is asked and nothing is sent.
+def replay_snapshot(snapshot_path, plan_path):
+    header = read_snapshot_header(snapshot_path)
+    print("Replaying snapshot of " + str(header.get('summary')) + " (" + header['calendarId'] + ") taken " +
+          header['taken'])
+    summary = {'events': 0, 'unchanged': 0, 'patches': 0, 'deletes': 0}
+    started = time.perf_counter()
+    with ChangePlanWriter(plan_path, header['calendarId']) as plan:
+        plan_changes(read_snapshot(snapshot_path), header['calendarId'], plan, summary, list)
+    elapsed = time.perf_counter() - started
+    print("Planned " + str(summary['patches']) + " patches and " + str(summary['deletes']) + " deletions in " + plan_path)
+    print("Replayed %d events in %.2f seconds (%.0f events/s)" % (summary['events'], elapsed,
+                                                                 summary['events'] / elapsed if elapsed else 0))
+    return summary
+
+
+def _already_deleted(write):
+    # A delete that was sent before a crash but not checkpointed comes back as gone the second time
+    return write.kind == 'delete' and getattr(getattr(write.error, 'resp', None), 'status', None) in (404, 410)
+
+
+# Sends a plan's changes in order, one round of batches at a time, checkpointing after every round.
+# Every change that went through (or failed for good) is settled in the checkpoint on its own, so a round cut short
+# by writes that gave up on retryable errors (e.g. the daily quota ran out) stops the run without losing the rest of
+# the round. Running it again resumes with only the unsettled changes, without fetching or evaluating anything.
+# Returns the checkpoint state.
+def apply_plan(plan_path):
+    header, changes = read_plan(plan_path)
+    calendar_id = header['calendarId']
+    checkpoint = PlanCheckpoint(plan_path, header['id'])
+    state = checkpoint.load()
+    done = set(state['done'])
+    pending = [index for index in range(state['next'], len(changes)) if index not in done]
+    if not pending:
+        print("Plan " + plan_path + " has already been applied")
+        return state
+    if len(pending) < len(changes):
+        print("Resuming plan with " + str(len(pending)) + " of " + str(len(changes)) + " changes left")
+    round_size = BATCH_SIZE * dispatcher.workers
+    while pending:
+        round_indexes, pending = pending[:round_size], pending[round_size:]
+        writer = BatchWriter(service, calendar_id, batch_size=BATCH_SIZE, policy=retry_policy)
+        indexes = {}
+        deleted_events = {}
+        for index in round_indexes:
+            change = changes[index]
+            if change['op'] == 'patch':
+                write = PendingWrite('patch', change['id'], body=change['body'], summary=change.get('summary'))
+            else:
+                deleted_events[change['id']] = change['event']
+                write = PendingWrite('delete', change['id'], summary=change.get('summary'))
+            indexes[write] = index
+            writer.add(write)
+        with metrics.phase('update'):
+            result = writer.flush(dispatcher)
+        deleted = [write for write in result.succeeded if write.kind == 'delete']
+        deletion_journal.record(calendar_id, [deleted_events[write.event_id] for write in deleted])
+        gone = [write for write in result.failed if _already_deleted(write)]
+        failed = [write for write in result.failed if not _already_deleted(write)]
+        # Writes that gave up on retryable errors are left unsettled for the next --apply; the rest are done
+        unsettled = [write for write in failed if retry_policy.is_retryable(write.error)]
+        failed = [write for write in failed if not retry_policy.is_retryable(write.error)]
+        done.update(indexes[write] for write in result.succeeded + gone + failed)
+        while state['next'] in done:
+            done.remove(state['next'])
+            state['next'] += 1
+        state['done'] = sorted(done)
+        state['updated'] += len(result.succeeded) - len(deleted)
+        state['deleted'] += len(deleted) + len(gone)
+        state['failed'] += len(failed)
+        checkpoint.save(state)
+        settled = state['next'] + len(done)
+        if unsettled:
+            print("Stopped after " + str(len(unsettled)) + " changes gave up on retryable errors, with " +
+                  str(settled) + " of " + str(len(changes)) + " changes applied; run --apply again to resume")
+            return state
+        print("Applied " + str(settled) + " of " + str(len(changes)) + " changes")
+    print("Events updated: " + str(state['updated']) + ", removed: " + str(state['deleted']) +
+          ", failed: " + str(state['failed']))
+    return state
+
+
+def is_unwanted_event(event):
+    return ('Re-Air' in event.get('summary') or 
         're-air' in event.get('summary') or 
         'Re-air' in event.get('summary') or
         re.match(".*Success! You're connected to NBC Olympics.*", event.get('summary')) or
-        re.match(".*The 2022 Olympic Winter Games are here!️.*", event.get('summary')), 
-    olympic_events))
-    
-    olympic_events = [event for event in olympic_events if event not in events_to_delete]
-    remove_events(events_to_delete)
-    return olympic_events
-
-
-def main():
+        re.match(".*The 2022 Olympic Winter Games are here!️.*", event.get('summary')))
+
+# Deleting a series master deletes all of its instances, including the modified ones listed next to it
+def without_series_exceptions(events):
+    series_ids = set(event['id'] for event in events)
+    return [event for event in events if event.get('recurringEventId') not in series_ids]
+
+# Generator that passes wanted events through and removes the unwanted ones once the stream is exhausted.
+# The number of deleted events is added to summary['deleted'] when a summary dict is given, and the ids of
+# unwanted events that are still on the calendar afterwards to `left` when a set is given.
+# `remove` is called with the unwanted events and the calendar id and returns the ids of those that went
+# (remove_events by default).
+def delete_unwanted_events(olympic_events, calendar_id=OLYMPIC_CALENDAR_ID, summary=None, remove=None, left=None):
+    unwanted_events = []
+    for event in olympic_events:
+        if is_unwanted_event(event):
+            unwanted_events.append(event)
+        else:
+            yield event
+    events_to_delete = without_series_exceptions(unwanted_events)
+    deleted_ids = (remove or remove_events)(events_to_delete, calendar_id)
+    if summary is not None:
+        summary['unwanted'] = summary.get('unwanted', 0) + len(events_to_delete)
+        summary['deleted'] = summary.get('deleted', 0) + len(deleted_ids)
+    if left is not None:
+        # A modified instance goes with its series master
+        left.update(event['id'] for event in unwanted_events
+                    if event['id'] not in deleted_ids and event.get('recurringEventId') not in deleted_ids)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Color and set notifications on the " + OLYMPIC_CALENDAR_NAME + " calendar")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fetch and evaluate events that changed since the last incremental run")
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH,
+                        help="SQLite file holding the local event copy and sync token (default: %(default)s)")
+    parser.add_argument('--until', type=datetime.datetime.fromisoformat,
+                        help="Only process events starting before this UTC date/time, e.g. 2022-02-21 (sent as timeMax)")
+    parser.add_argument('--query',
+                        help="Only process events matching this free-text search (sent as q)")
+    parser.add_argument('--series', action='store_true',
+                        help="Fetch recurring events as one series master plus its modified instances instead of "
+                             "every instance, so a series is evaluated and updated once")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Split the range up to --until into this many time windows and list them at the same time, "
+                             "e.g. one per day of competition (default: %(default)s)")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Use the asyncio client (needs aiohttp) so page fetches and update batches overlap")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="Number of batch requests sent at the same time (default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="Requests per second allowed by the project's per-user quota (default: %(default)s)")
+    parser.add_argument('--delete-mode', choices=DELETE_MODES, default=DEFAULT_DELETE_MODE,
+                        help="How unwanted events are removed: ask for each one, only list them, or delete without asking (default: %(default)s)")
+    parser.add_argument('--max-deletions', type=int, default=DEFAULT_MAX_DELETIONS,
+                        help="Refuse to delete anything if more than this many events would go (default: %(default)s)")
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help="JSON lines file recording every deleted event (default: %(default)s)")
+    parser.add_argument('--undo-deletions', nargs='?', const='', metavar='RUN',
+                        help="Restore the events deleted in a run from the journal (the last run if no id is given) and exit")
+    parser.add_argument('--plan', metavar='PLAN',
+                        help="Evaluate the rules and write the patches and deletions to this change plan instead of sending them")
+    parser.add_argument('--apply', metavar='PLAN',
+                        help="Send the changes in a plan written by --plan, resuming from its checkpoint, and exit")
+    parser.add_argument('--listing-etags', default=LISTING_ETAGS_PATH, metavar='PATH',
+                        help="File of listing etags from runs that left the calendar up to date; a listing that has not "
+                             "changed since is skipped without fetching it. An empty path turns this off "
+                             "(default: %(default)s)")
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help="Stream the events the run would list to this gzipped JSON lines snapshot and exit")
+    parser.add_argument('--replay', metavar='SNAPSHOT',
+                        help="Evaluate the rules against a snapshot written by --snapshot instead of the calendar, "
+                             "without credentials or API calls, and write the would-be changes to the --plan file")
+    parser.add_argument('--rules', default=DEFAULT_RULES_PATH,
+                        help="JSON rule file mapping summary patterns to colors and notifications (default: %(default)s)")
+    parser.add_argument('--metrics',
+                        help="Write a JSON run report with phase timings and per-call request statistics to this file")
+    parser.add_argument('--prometheus',
+                        help="Also write the run report in Prometheus text format to this file")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='warning',
+                        help="Per-event messages are logged at debug, per-batch ones at info (default: %(default)s)")
+    args = parser.parse_args(argv)
+    # The API rejects timeMax and q on requests that carry a sync token
+    if args.incremental and (args.until or args.query):
+        parser.error("--until and --query can't be combined with --incremental")
+    if len([option for option in (args.plan, args.apply, args.undo_deletions) if option is not None]) > 1:
+        parser.error("--plan, --apply and --undo-deletions can't be combined")
+    # The sync token would move past changes that are only in the plan, and the next incremental run would miss them
+    if args.incremental and args.plan:
+        parser.error("--plan can't be combined with --incremental")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards > 1 and not args.until:
+        parser.error("--shards needs --until to know where the last window ends")
+    if args.shards > 1 and (args.incremental or args.series or args.use_async):
+        parser.error("--shards can't be combined with --incremental, --series or --async")
+    if args.use_async and (args.incremental or args.plan or args.apply or args.undo_deletions is not None):
+        parser.error("--async only applies to a plain update run")
+    if args.snapshot and (args.incremental or args.use_async or args.plan or args.apply or args.replay or
+                          args.undo_deletions is not None):
+        parser.error("--snapshot can only be combined with the options that choose what is listed")
+    if args.replay and not args.plan:
+        parser.error("--replay needs --plan for the file to write the would-be changes to")
+    # The listing options were fixed when the snapshot was taken
+    if args.replay and (args.incremental or args.until or args.query or args.series or args.shards > 1 or
+                        args.use_async):
+        parser.error("--replay can't be combined with options that choose what is listed")
+    return args
+
+
+def main(argv=None):
     # TODO: Remove images from events so the color will always show through
     # Google Calendar API Reference: https://developers.google.com/calendar/api
     # Google App Dashboard: https://console.cloud.google.com/apis/dashboard?project=wesnicol-calendar-testing
-    setup() # Run setup first
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(levelname)s %(name)s: %(message)s')
+    if args.replay:
+        # Offline: only the rules are needed
+        initialize_colors()
+        load_rule_set(args.rules)
+        summary = replay_snapshot(args.replay, args.plan)
+        if args.metrics:
+            metrics.write_json(args.metrics, summary)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus, summary)
+        return
+    setup(args.rules) # Run setup first
+    setup_dispatcher(args.workers, args.rate)
+    global delete_policy, deletion_journal, listing_etags
+    delete_policy = DeletePolicy(args.delete_mode, args.max_deletions)
+    deletion_journal = DeletionJournal(args.journal)
+    listing_etags = ListingEtags(args.listing_etags) if args.listing_etags else None
+    if args.undo_deletions is not None:
+        undo_deletions(args.undo_deletions)
+        return
+    if args.apply:
+        try:
+            apply_plan(args.apply)
+        finally:
+            print(retry_policy.summary())
+        return
+    store = EventStore(args.store) if args.incremental else None
+    summary = None
     try:
-        olympics_calendar = get_calendar_by_name('NBC Sports')
-        execute_updates(olympics_calendar)
-
-        
+        with metrics.phase('resolve'):
+            olympics_calendar = get_calendar_by_name(OLYMPIC_CALENDAR_NAME)
+        if args.snapshot:
+            summary = export_snapshot(olympics_calendar, args.snapshot, end_date=args.until, query=args.query,
+                                      single_events=not args.series, shards=args.shards)
+        elif args.plan:
+            summary = plan_updates(olympics_calendar, args.plan, end_date=args.until, query=args.query,
+                                   single_events=not args.series, shards=args.shards)
+        elif args.use_async:
+            summary = asyncio.run(run_updates_async(olympics_calendar, end_date=args.until, query=args.query,
+                                                    single_events=not args.series))
+        else:
+            summary = execute_updates(olympics_calendar, store, end_date=args.until, query=args.query,
+                                      single_events=not args.series, shards=args.shards)
 
     except HttpError as error:
         print('An error occurred: %s' % error)
+    finally:
+        print(retry_policy.summary())
+        if store is not None:
+            store.close()
+        if args.metrics:
+            metrics.write_json(args.metrics, summary)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus, summary)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
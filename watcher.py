@@ -0,0 +1,239 @@
+"""Long-running mode: react to push notifications instead of re-scanning the whole calendar.
+
+Subscribes to the calendar with events().watch and listens for Google's pings on a small HTTP
+endpoint. Pings that arrive close together are coalesced into one incremental sync, which only
+fetches and evaluates the events that changed. Channels are renewed before they expire.
+
+Google only delivers to an HTTPS address with a valid certificate, so --address is the public
+URL (a reverse proxy or tunnel) that forwards to the local --host/--port.
+Ref: https://developers.google.com/calendar/api/guides/push
+"""
+from __future__ import print_function
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import secrets
+import threading
+import time
+import uuid
+
+from googleapiclient.errors import HttpError
+
+from deletion import DeletePolicy, DeletionJournal, DEFAULT_MAX_DELETIONS, JOURNAL_PATH
+from dispatcher import DEFAULT_REQUESTS_PER_SECOND, DEFAULT_WORKERS
+from event_store import EventStore, DEFAULT_STORE_PATH
+from rule_engine import DEFAULT_RULES_PATH
+import calendar_client
+import update_calendar_events
+
+DEFAULT_PORT = 8080
+# Wait this long after a ping for more of them before syncing
+DEFAULT_COALESCE_SECONDS = 2.0
+# Google caps web_hook channels at about a week; ask for a day and renew an hour early
+CHANNEL_TTL_SECONDS = 24 * 60 * 60
+RENEW_MARGIN_SECONDS = 60 * 60
+
+
+class ChangeCoalescer(object):
+    """Turns bursts of pings into single calls to `on_change`, run one at a time on a worker thread.
+
+    A ping that arrives while a sync is running schedules exactly one more sync afterwards, so
+    no change is missed and syncs never overlap.
+    """
+
+    def __init__(self, on_change, window=DEFAULT_COALESCE_SECONDS):
+        self.on_change = on_change
+        self.window = window
+        self.pending = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='coalescer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.pending.set()
+        self.thread.join()
+
+    def notify(self):
+        self.pending.set()
+
+    def _run(self):
+        while True:
+            self.pending.wait()
+            if self.stopped.is_set():
+                return
+            # Let the rest of the burst arrive, then sync once for all of it
+            time.sleep(self.window)
+            self.pending.clear()
+            try:
+                self.on_change()
+            except Exception as e:
+                print("Sync after notification failed: " + repr(e))
+
+
+class Channel(object):
+    """A watch channel: what Google needs to stop it, and when it runs out."""
+
+    def __init__(self, channel_id, resource_id, expiration, token):
+        self.id = channel_id
+        self.resource_id = resource_id
+        # Seconds since the epoch
+        self.expiration = expiration
+        self.token = token
+
+    def expires_in(self):
+        return self.expiration - time.time()
+
+
+class ChannelManager(object):
+    def __init__(self, service, calendar_id, address, policy, ttl=CHANNEL_TTL_SECONDS):
+        self.service = service
+        self.calendar_id = calendar_id
+        self.address = address
+        self.policy = policy
+        self.ttl = ttl
+        self.channel = None
+        self.lock = threading.Lock()
+
+    def is_current(self, channel_id, token):
+        with self.lock:
+            return self.channel is not None and channel_id == self.channel.id and token == self.channel.token
+
+    def open(self):
+        token = secrets.token_urlsafe(24)
+        body = {'id': str(uuid.uuid4()), 'type': 'web_hook', 'address': self.address, 'token': token,
+                'params': {'ttl': str(self.ttl)}}
+        response = self.policy.execute(self.service.events().watch(calendarId=self.calendar_id, body=body), "events watch")
+        # Google reports expiration in milliseconds since the epoch
+        channel = Channel(response['id'], response['resourceId'], int(response['expiration']) / 1000.0, token)
+        print("Watching " + self.calendar_id + " on channel " + channel.id + " until " +
+              time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(channel.expiration)))
+        return channel
+
+    def close(self, channel):
+        try:
+            self.policy.execute(self.service.channels().stop(body={'id': channel.id, 'resourceId': channel.resource_id}),
+                                "channel stop")
+        except HttpError as e:
+            # An expired or unknown channel is already gone
+            print("Could not stop channel " + channel.id + ": " + str(e))
+
+    def renew(self):
+        # Open the new channel before closing the old one so no change falls in between
+        channel = self.open()
+        with self.lock:
+            old_channel, self.channel = self.channel, channel
+        if old_channel is not None:
+            self.close(old_channel)
+
+    def needs_renewal(self):
+        return self.channel is None or self.channel.expires_in() < RENEW_MARGIN_SECONDS
+
+    def stop(self):
+        with self.lock:
+            channel, self.channel = self.channel, None
+        if channel is not None:
+            self.close(channel)
+
+
+def make_handler(channels, coalescer):
+    class NotificationHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            channel_id = self.headers.get('X-Goog-Channel-ID')
+            token = self.headers.get('X-Goog-Channel-Token')
+            state = self.headers.get('X-Goog-Resource-State')
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+            if not channels.is_current(channel_id, token):
+                # Pings for old channels or from anyone else get an error so they are not mistaken for changes
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.end_headers()
+            # 'sync' is the handshake sent when a channel opens; 'exists' means something changed
+            if state == 'exists':
+                coalescer.notify()
+
+        def log_message(self, format, *args):
+            pass
+
+    return NotificationHandler
+
+
+def make_sync(calendar, store_path):
+    """The coalescer's on_change: one incremental execute_updates run against the store."""
+    def sync():
+        # SQLite connections belong to the thread that made them, and only the coalescer thread syncs
+        with EventStore(store_path) as thread_store:
+            summary = update_calendar_events.execute_updates(calendar, thread_store)
+        print("Synced: " + ", ".join(key + " " + str(value) for key, value in summary.items()))
+        return summary
+
+    return sync
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--address', required=True,
+                        help="Public HTTPS URL Google should send notifications to")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on (default: %(default)s)")
+    parser.add_argument('--calendar', default=update_calendar_events.OLYMPIC_CALENDAR_NAME,
+                        help="Name of the calendar to watch (default: %(default)s)")
+    parser.add_argument('--coalesce', type=float, default=DEFAULT_COALESCE_SECONDS,
+                        help="Seconds to wait for more pings before syncing (default: %(default)s)")
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH,
+                        help="SQLite file holding the local event copy and sync token (default: %(default)s)")
+    parser.add_argument('--rules', default=DEFAULT_RULES_PATH,
+                        help="JSON rule file (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND)
+    # A daemon can't answer prompts
+    parser.add_argument('--delete-mode', choices=('dry-run', 'auto'), default='dry-run',
+                        help="How unwanted events are removed (default: %(default)s)")
+    parser.add_argument('--max-deletions', type=int, default=DEFAULT_MAX_DELETIONS)
+    parser.add_argument('--journal', default=JOURNAL_PATH)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    update_calendar_events.setup(args.rules)
+    update_calendar_events.setup_dispatcher(args.workers, args.rate)
+    update_calendar_events.delete_policy = DeletePolicy(args.delete_mode, args.max_deletions)
+    update_calendar_events.deletion_journal = DeletionJournal(args.journal)
+    calendar = update_calendar_events.get_calendar_by_name(args.calendar)
+    coalescer = ChangeCoalescer(make_sync(calendar, args.store), window=args.coalesce)
+    # Channels are renewed from this thread while the coalescer syncs, and httplib2 connections can't be shared
+    channel_service = calendar_client.build_service(update_calendar_events.credentials)
+    channels = ChannelManager(channel_service, calendar['id'], args.address, update_calendar_events.retry_policy)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(channels, coalescer))
+    server_thread = threading.Thread(target=server.serve_forever, name='notifications', daemon=True)
+
+    coalescer.start()
+    server_thread.start()
+    print("Listening for notifications on " + args.host + ":" + str(args.port))
+    # Catch up on anything that changed while nobody was watching
+    coalescer.notify()
+    try:
+        while True:
+            if channels.needs_renewal():
+                try:
+                    channels.renew()
+                except HttpError as e:
+                    print("Could not renew the watch channel, trying again in a minute: " + str(e))
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        channels.stop()
+        server.shutdown()
+        coalescer.stop()
+        print(update_calendar_events.retry_policy.summary())
+
+
+if __name__ == '__main__':
+    main()